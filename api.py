@@ -5,30 +5,56 @@ move game logic to another file. Ideally the API will be simple, concerned
 primarily with communication to/from the API's users."""
 
 
+from datetime import date
+
 import endpoints
 from protorpc import remote
 from protorpc import messages
 from protorpc import message_types
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
 
 from models import User
 from models import UsersRankingForm
+from models import UserRankForm
+from models import UserStats
+from models import UserStatsForm
 from models import Game
 from models import GameForm
 from models import GameForms
 from models import ChooseDiceForm
 from models import ChooseCatForm
-from models import Score
+from models import ScoreForm
 from models import ScoreForms
+from models import ScoreWindow
 from models import StringMessage
 from models import GameHistoryForm
+from models import CompactHistoryForm
+from models import HintForm
+from models import CategoryScoreForm
+from models import CategoryScoresForm
+from models import MovesForm
+from models import GamesMovesForm
+from models import MoveStepForm
+from models import MovesResultForm
+from models import MovesResultForms
+from models import CardCategory
+from models import ConflictException
+from models import get_user_async
 
 from utils import get_by_urlsafe
+from utils import get_by_urlsafe_async
+from utils import get_multi_by_urlsafe
 from utils import get_user_id
-from play import choose_dice
-from play import roll
-from play import find_score
+import engine
+import hotstate
+import play
+from instrument import instrumented
+import leaderboard
+import rankings
+from solver import advise
 from settings import WEB_CLIENT_ID
+from settings import LEADERBOARD_SIZE
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
@@ -41,6 +67,23 @@ ROLL_REQUEST = endpoints.ResourceContainer(
 CATEGORY_REQUEST = endpoints.ResourceContainer(
         ChooseCatForm,
         urlsafe_game_key=messages.StringField(1),)
+HIGH_SCORES_REQUEST = endpoints.ResourceContainer(
+        window=messages.EnumField(ScoreWindow, 1, default='ALL_TIME'),
+        number_of_results=messages.IntegerField(2, default=3),)
+MOVES_REQUEST = endpoints.ResourceContainer(
+        MovesForm,
+        urlsafe_game_key=messages.StringField(1),)
+HISTORY_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        offset=messages.IntegerField(2, default=0),
+        limit=messages.IntegerField(3, default=play.ROUNDS),)
+RANKINGS_REQUEST = endpoints.ResourceContainer(
+        page_size=messages.IntegerField(1, default=20),
+        cursor=messages.StringField(2),)
+MAX_PAGE_SIZE = 100
+# every move of a game, and games, in one batch
+MAX_BATCH_MOVES = 52
+MAX_BATCH_GAMES = 20
 
 
 @endpoints.api(name='yahtzee', version='v1',
@@ -55,6 +98,7 @@ class YahtzeeGameApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @instrumented
     def create_user(self, request):
         """Create a User."""
         cur_user = endpoints.get_current_user()
@@ -80,12 +124,13 @@ class YahtzeeGameApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @instrumented
     def new_game(self, request):
         """Create new game"""
         # preload user data
         user = self._get_user()
         game = Game.new_game(user.key)
-        return game.to_form('Roll the Dice! Good Luck!')
+        return game.to_form('Roll the Dice! Good Luck!', user)
 
     # Get Game
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -93,18 +138,14 @@ class YahtzeeGameApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @instrumented
     def get_game(self, request):
         """Return the selected game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            user = self._get_user()
-            if game.user.get() is not user:
-                raise endpoints.NotFoundException(
-                    'You cannot get the game not belonging to you.')
-            else:
-                return game.to_form('Let us roll!')
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        if game.user != user.key:
+            raise endpoints.NotFoundException(
+                'You cannot get the game not belonging to you.')
+        return hotstate.load(game).to_form('Let us roll!', user)
 
     # Remove the incompleted game
     @endpoints.method(request_message=GET_GAME_REQUEST,
@@ -112,72 +153,154 @@ class YahtzeeGameApi(remote.Service):
                       path='game/{urlsafe_game_key}/cancel',
                       name='cancel_game',
                       http_method='DELETE')
+    @instrumented
     def cancel_game(self, request):
         """Delete the selected game."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            user = self._get_user()
-            if game.user.get() is not user:
-                return StringMessage(
-                    message="You cannot cancel the game not belonging to you.")
-            if not game.game_over:
-                game.key.delete()
-                return StringMessage(message="The game is cancelled.")
-            else:
-                return StringMessage(
-                    message="You cannot cancel completed games.")
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        if game.user != user.key:
+            return StringMessage(
+                message="You cannot cancel the game not belonging to you.")
+        if not game.game_over and game.cancel():
+            hotstate.forget(game.key)
+            return StringMessage(message="The game is cancelled.")
         else:
-            raise endpoints.NotFoundException('Game not found!')
+            return StringMessage(
+                message="You cannot cancel completed games.")
 
     # Return all active games of the user
     @endpoints.method(request_message=message_types.VoidMessage,
                       response_message=GameForms,
                       http_method='POST',
                       name='get_user_games')
+    @instrumented
     def get_user_games(self, request):
         """Return all of a User's active games."""
         user = self._get_user()
-        games = Game.query(Game.user == user.key).filter(
-            Game.game_over == False).order(Game.round_remain)
+        games = sorted(
+            [game for game in ndb.get_multi(user.active_game_keys)
+             if game and not game.game_over],
+            key=lambda game: game.round_remain)
+        hotstate.load_multi(games)
         # return set of GameForm object per game
         return GameForms(
-            items=[game.to_form('%s remaining rounds.' % game.round_remain)
+            items=[game.to_form('%s remaining rounds.' % game.round_remain,
+                                user)
                    for game in games])
 
     # Return the history record of the game
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=HISTORY_REQUEST,
                       response_message=GameHistoryForm,
                       http_method='GET',
                       name='get_game_history')
+    @instrumented
     def get_game_history(self, request):
         """Return history of the game"""
-        user = self._get_user()
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.user.get() is user:
-            return game.to_history_form()
+        game = self._get_history_game(request)
+        return game.to_history_form(request.offset, request.limit)
+
+    # Return the history record of the game, compactly
+    @endpoints.method(request_message=HISTORY_REQUEST,
+                      response_message=CompactHistoryForm,
+                      path='game/{urlsafe_game_key}/history/compact',
+                      http_method='GET',
+                      name='get_compact_history')
+    @instrumented
+    def get_compact_history(self, request):
+        """Return history of the game with the dice of each round packed
+        into a string"""
+        game = self._get_history_game(request)
+        return game.to_compact_history_form(request.offset, request.limit)
+
+    def _get_history_game(self, request):
+        """helper -- check a history request, return the game"""
+        if request.offset < 0 or not 0 < request.limit <= play.ROUNDS:
+            raise endpoints.BadRequestException(
+                'offset must be at least 0 and limit between 1 and %s.'
+                % play.ROUNDS)
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        if game.user != user.key:
+            raise endpoints.NotFoundException(
+                'You cannot get the game not belonging to you.')
+        return game
 
     # Return a leader-board
-    @endpoints.method(request_message=message_types.VoidMessage,
+    @endpoints.method(request_message=HIGH_SCORES_REQUEST,
                       response_message=ScoreForms,
                       http_method='GET',
                       name='get_high_scores')
+    @instrumented
     def get_high_scores(self, request):
         """Return a list of high scores"""
-        high_scores = Score.query().order(-Score.result).fetch(3)
+        if not 0 < request.number_of_results <= LEADERBOARD_SIZE:
+            raise endpoints.BadRequestException(
+                'number_of_results must be between 1 and %s.'
+                % LEADERBOARD_SIZE)
+        entries = leaderboard.get_board(request.window.name, date.today())
         return ScoreForms(
-            items=[score.to_form() for score in high_scores])
+            items=[ScoreForm(user_name=name, date=day, result=result)
+                   for result, name, day, score_id
+                   in entries[:request.number_of_results]])
 
     # Return the ranking of users
-    @endpoints.method(request_message=message_types.VoidMessage,
+    @endpoints.method(request_message=RANKINGS_REQUEST,
                       response_message=UsersRankingForm,
                       http_method='GET',
                       name='get_user_rankings')
+    @instrumented
     def get_user_rankings(self, request):
-        """Return the rankings of users"""
-        ranking_users = User.query().order(-User.max_score).order(
-            User.games_completed).fetch()
+        """Return a page of the rankings of users"""
+        if not 0 < request.page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                'page_size must be between 1 and %s.' % MAX_PAGE_SIZE)
+        try:
+            ranking_users, ranks, next_cursor = rankings.get_page(
+                request.page_size, request.cursor)
+        except (ValueError, TypeError, datastore_errors.BadValueError,
+                datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException('Invalid cursor')
         return UsersRankingForm(
-            items=[user.to_perf_form() for user in ranking_users])
+            items=[user.to_perf_form(rank)
+                   for user, rank in zip(ranking_users, ranks)],
+            next_cursor=next_cursor)
+
+    # Return the rank of the current user
+    @endpoints.method(request_message=message_types.VoidMessage,
+                      response_message=UserRankForm,
+                      path='user/rank',
+                      http_method='GET',
+                      name='get_my_rank')
+    @instrumented
+    def get_my_rank(self, request):
+        """Return the current user's position in the rankings"""
+        user = self._get_user()
+        rank, ranked_users = rankings.get_rank(user)
+        if rank is None:
+            message = 'Rankings are not computed yet.'
+        else:
+            message = 'You rank %s of %s.' % (rank, ranked_users)
+        return UserRankForm(user=user.to_perf_form(rank),
+                            ranked_users=ranked_users, message=message)
+
+    # Return the statistics of the current user
+    @endpoints.method(request_message=message_types.VoidMessage,
+                      response_message=UserStatsForm,
+                      path='user/stats',
+                      http_method='GET',
+                      name='get_user_stats')
+    @instrumented
+    def get_user_stats(self, request):
+        """Return the averages and rates of the current user's completed
+        games"""
+        cur_user = endpoints.get_current_user()
+        if not cur_user:
+            raise endpoints.UnauthorizedException('Authourization required')
+        user_key = ndb.Key(User, get_user_id(cur_user))
+        stats = UserStats.key_for(user_key).get()
+        if stats is None:
+            # no game completed yet, or no such user
+            self._get_user()
+            stats = UserStats(key=UserStats.key_for(user_key))
+        return stats.to_form()
 
     # Roll Dice
     @endpoints.method(request_message=ROLL_REQUEST,
@@ -185,26 +308,18 @@ class YahtzeeGameApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='roll_dice',
                       http_method='PUT')
+    @instrumented
     def roll_dice(self, request):
         """Roll a dice -- Three chances each round"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.game_over:
+        game, owner = self._get_game_and_owner(request.urlsafe_game_key)
+        try:
+            result = self._apply_move(
+                game, lambda state: engine.roll_dice(
+                    state, request.index_chosen),
+                request.move_seq, 'roll:%s' % request.index_chosen)
+            return game.to_form(result.message, owner.get_result())
+        except engine.GameOverError:
             raise endpoints.ForbiddenException('Game is already over!')
-        # for the first roll you cannot choose dice to keep
-        if not game.dice and request.index_chosen:
-            return game.to_form('Cannot choose index now.')
-        if len(request.index_chosen) is 5:
-            return game.to_form('You cannot keep all dice to roll.')
-        if game.roll_remain < 1:
-            return game.to_form('You have to choose the category, \
-                no more roll chance.')
-        else:
-            dice_kept = choose_dice(game.dice, request.index_chosen)
-            game.dice = roll(dice_kept)
-            game.roll_remain -= 1
-            game.put()
-            return game.to_form('%s chances remain to roll in this round.'
-                                % game.roll_remain)
 
     # Category Round
     @endpoints.method(request_message=CATEGORY_REQUEST,
@@ -212,57 +327,190 @@ class YahtzeeGameApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='choose_category',
                       http_method='POST')
+    @instrumented
     def choose_category(self, request):
         """Choose a category to earn points for each round"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game, owner = self._get_game_and_owner(request.urlsafe_game_key)
+        # cast category Enum to int as the index
+        result = self._apply_move(
+            game, lambda state: engine.choose_category(
+                state, int(request.category)),
+            request.move_seq, 'category:%s' % request.category)
+        return game.to_form(result.message, owner.get_result())
+
+    # Make several moves
+    @endpoints.method(request_message=MOVES_REQUEST,
+                      response_message=MovesResultForm,
+                      path='game/{urlsafe_game_key}/moves',
+                      name='play_moves',
+                      http_method='POST')
+    @instrumented
+    def play_moves(self, request):
+        """Make moves in order on a game, stopping at the first refused"""
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        self._check_moves(game, user, request.moves)
+        return self._play_moves(game, user, request.moves, request.move_seq)
+
+    # Make several moves on each of several games
+    @endpoints.method(request_message=GamesMovesForm,
+                      response_message=MovesResultForms,
+                      path='games/moves',
+                      name='play_games_moves',
+                      http_method='POST')
+    @instrumented
+    def play_games_moves(self, request):
+        """Make moves in order on each of several games of the user"""
+        if len(request.items) > MAX_BATCH_GAMES:
+            raise endpoints.BadRequestException(
+                'At most %s games can be played at once.' % MAX_BATCH_GAMES)
+        # the user is read along with the games
+        user = self._get_user_async()
+        games = get_multi_by_urlsafe(
+            [item.urlsafe_game_key for item in request.items], Game)
+        user = user.get_result()
+        for game, item in zip(games, request.items):
+            self._check_moves(game, user, item.moves)
+        return MovesResultForms(
+            items=[self._play_moves(game, user, item.moves, item.move_seq)
+                   for game, item in zip(games, request.items)])
+
+    # Score the dice in every open category
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=CategoryScoresForm,
+                      path='game/{urlsafe_game_key}/scores',
+                      name='get_open_scores',
+                      http_method='GET')
+    @instrumented
+    def get_open_scores(self, request):
+        """Return the points the dice would score in each open category"""
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        if game.user != user.key:
+            raise endpoints.NotFoundException(
+                'You cannot get the game not belonging to you.')
         if game.game_over:
-            return game.to_form('Game already over!')
-        card = game.score_card
-        index = int(request.category)  # cast category Enum to int as the index
+            raise endpoints.ForbiddenException('Game is already over!')
+        hotstate.load(game)
+        scores = game.open_scores()
+        if not scores:
+            return CategoryScoresForm(message='Roll the dice first!')
+        return CategoryScoresForm(
+            items=[CategoryScoreForm(category=CardCategory(category),
+                                     points=points)
+                   for category, points in scores],
+            message='%s categories open.' % len(scores))
+
+    # Suggest the best move
+    @endpoints.method(request_message=GET_GAME_REQUEST,
+                      response_message=HintForm,
+                      path='game/{urlsafe_game_key}/hint',
+                      name='get_hint',
+                      http_method='GET')
+    @instrumented
+    def get_hint(self, request):
+        """Return the move with the highest expected final score"""
+        game, user = self._get_game_and_user(request.urlsafe_game_key)
+        if game.user != user.key:
+            raise endpoints.NotFoundException(
+                'You cannot get the game not belonging to you.')
+        if game.game_over:
+            raise endpoints.ForbiddenException('Game is already over!')
+        hotstate.load(game)
+        try:
+            hint = advise(
+                game.score_card, game.dice, game.roll_remain)
+        except IOError:
+            raise endpoints.InternalServerErrorException(
+                'Strategy table is not available.')
+        if hint.category is not None:
+            return HintForm(category=CardCategory(hint.category),
+                            expected_score=hint.expected,
+                            message='Score the dice now.')
         if not game.dice:
-            return game.to_form('Roll the dice first!')
-        if card[index] is not -1:
-            return game.to_form(
-                'You have already chosen this category.')
-        # Record score to the category
-        points = find_score(game.dice, index)
-        card[index] = points
-        game.round_remain -= 1
-        # Record game history
-        dice_str = ''.join(str(num) for num in game.dice)
-        game.dice_history.append(dice_str)
-        game.cat_history.append(request.category)
-        # Check the sum and add bonus if any
-        if -1 not in card[0:6]:
-            card[6] = sum(card[0:6])
-            card[7] = 35 if card[6] >= 63 else 0
-        # Check if game end and add sum
-        if -1 not in card[0:15]:
-            card[15] = sum(card[8:15])
-            card[16] = sum(card[6:15])
-            total = card[16]
-            game.end_game()
-            msg = 'You got total %s ! Game End.' % total
-            return game.to_form(msg)
+            message = 'Roll the dice.'
         else:
-            # Reset dice
-            game.roll_remain = 3
-            game.dice[:] = []
-            game.put()
-        return game.to_form('You got %s points.' % points)
+            message = 'Keep the chosen dice and roll again.'
+        return HintForm(index_chosen=hint.index_chosen,
+                        expected_score=hint.expected,
+                        message=message)
+
+    # Save the outcome of a move
+    def _apply_move(self, game, move, move_seq, fingerprint):
+        """helper -- apply an engine move to the game and store it"""
+        try:
+            result = hotstate.apply_move(game, move, move_seq, fingerprint)
+        except hotstate.StaleMoveError as error:
+            raise ConflictException(
+                'move_seq %s is not the current move, %s Reload the game.'
+                % (move_seq, error))
+        if result is None:
+            raise ConflictException(
+                'The game is being played elsewhere, try again.')
+        return result
+
+    def _check_moves(self, game, user, moves):
+        """helper -- check a batch of moves can be made on a game"""
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if game.user != user.key:
+            raise endpoints.NotFoundException(
+                'You cannot play the game not belonging to you.')
+        if len(moves) > MAX_BATCH_MOVES:
+            raise endpoints.BadRequestException(
+                'At most %s moves can be made at once.' % MAX_BATCH_MOVES)
+
+    def _play_moves(self, game, user, moves, move_seq):
+        """helper -- make a batch of moves with one load and save"""
+        moves = [(engine.ROLL, list(move.index_chosen))
+                 if move.category is None
+                 else (engine.SCORE, int(move.category))
+                 for move in moves]
+        steps = []
+
+        def apply_moves(state):
+            result = engine.play_moves(state, moves)
+            steps[:] = result.steps
+            return result
+        result = self._apply_move(game, apply_moves, move_seq, 'moves:%s' % moves)
+        return MovesResultForm(
+            game=game.to_form(result.message, user),
+            steps=[MoveStepForm(applied=bool(step.effects),
+                                dice=step.state.dice, points=step.points,
+                                message=step.message)
+                   for step in steps])
 
     # Get game user information
     def _get_user(self):
         """helper -- get user"""
+        return self._get_user_async().get_result()
+
+    @ndb.tasklet
+    def _get_user_async(self):
+        """helper -- Future of _get_user"""
         cur_user = endpoints.get_current_user()
         if not cur_user:
             raise endpoints.UnauthorizedException('Authourization required')
         user_id = get_user_id(cur_user)
-        p_key = ndb.Key(User, user_id)
-        user = p_key.get()
+        user = yield get_user_async(ndb.Key(User, user_id))
         if not user:
             raise endpoints.NotFoundException('Please create as a user first')
-        return user
+        raise ndb.Return(user)
+
+    def _get_game_and_user(self, urlsafe_game_key):
+        """helper -- get a game and the current user, read in one batch"""
+        game = get_by_urlsafe_async(urlsafe_game_key, Game)
+        user = self._get_user_async()
+        game = game.get_result()
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        return game, user.get_result()
+
+    def _get_game_and_owner(self, urlsafe_game_key):
+        """helper -- get a game and a Future of its user, read while the
+        move is stored"""
+        game = get_by_urlsafe(urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        return game, get_user_async(game.user)
 
 
 api = endpoints.api_server([YahtzeeGameApi])
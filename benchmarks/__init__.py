@@ -0,0 +1,2 @@
+"""benchmarks - Offline benchmarks for the game. Run each one from the
+project root, e.g. `python -m benchmarks.bench_scoring`."""
@@ -0,0 +1,136 @@
+"""bench_async.py - Latency of API methods with datastore reads made one
+after another, as before, and together through tasklets.
+
+Usage: python -m benchmarks.bench_async [--calls 100] [--rpc-delay 0.02]
+
+Runs on the SDK datastore stub with --rpc-delay seconds added to every
+datastore RPC, where RPCs in flight together overlap. Each call is a
+request of its own. The 'before' flows repeat the blocking calls the
+methods made. Needs the App Engine SDK on the Python path."""
+import argparse
+import time
+
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+import api
+import engine
+import hotstate
+from benchmarks import stubs
+from models import Game
+from models import User
+from models import get_user
+from models import remember_user
+from utils import get_by_urlsafe
+
+_EMAIL = 'bench@example.com'
+_VOID = message_types.VoidMessage()
+
+
+def _owned_game(request):
+    """get_by_urlsafe, then _get_user, then the owner check"""
+    game = get_by_urlsafe(request.urlsafe_game_key, Game)
+    user = get_user(ndb.Key(User, _EMAIL))
+    if game.user != user.key:
+        raise AssertionError('Not the owner')
+    return game, user
+
+
+def get_game_before(request):
+    game, user = _owned_game(request)
+    return hotstate.load(game).to_form('Let us roll!', user)
+
+
+def get_game_history_before(request):
+    game, user = _owned_game(request)
+    return game.to_history_form(request.offset, request.limit)
+
+
+def cancel_game_before(request):
+    game, user = _owned_game(request)
+
+    def txn():
+        stored = game.key.get()
+        if not stored or stored.game_over:
+            return None
+        owner = game.user.get()
+        owner.remove_active_game(game.key)
+        owner.put()
+        game.key.delete()
+        return owner
+    remember_user(ndb.transaction(txn, xg=True))
+
+
+def new_game_before(request):
+    user = get_user(ndb.Key(User, _EMAIL))
+    game = Game(user=user.key)
+    game.set_state(engine.new_state())
+
+    def txn():
+        player = user.key.get()
+        game.put()
+        player.add_active_game(game.key)
+        player.put()
+        return player
+    remember_user(ndb.transaction(txn, xg=True))
+    return game.to_form('Roll the Dice! Good Luck!', user)
+
+
+def measure(name, function, requests, counter):
+    counter.reset()
+    times = []
+    for request in requests:
+        stubs.new_request()
+        start = time.time()
+        function(request)
+        times.append(time.time() - start)
+    times.sort()
+    print('%-24s mean %6.1fms  p50 %6.1fms  p95 %6.1fms  %.1f RPCs/call'
+          % (name, 1000 * sum(times) / len(times),
+             1000 * times[len(times) // 2],
+             1000 * times[int(len(times) * 0.95)],
+             float(counter.count()) / len(times)))
+
+
+def game_requests(container, games):
+    return [container.combined_message_class(
+        urlsafe_game_key=game.key.urlsafe()) for game in games]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--rpc-delay', type=float, default=0.02)
+    args = parser.parse_args()
+    bed = stubs.setup_testbed()
+    try:
+        stubs.sign_in(_EMAIL)
+        service = api.YahtzeeGameApi()
+        service.create_user(_VOID)
+        games = [Game.new_game(ndb.Key(User, _EMAIL))
+                 for i in range(3 * args.calls)]
+        stubs.delay_datastore(args.rpc_delay)
+        counter = stubs.RpcCounter().install()
+        voids = [_VOID] * args.calls
+        for name, before, after, requests in [
+                ('get_game', get_game_before, service.get_game,
+                 game_requests(api.GET_GAME_REQUEST, games[:args.calls])),
+                ('get_game_history', get_game_history_before,
+                 service.get_game_history,
+                 game_requests(api.HISTORY_REQUEST, games[:args.calls])),
+                ('new_game', new_game_before, service.new_game, voids)]:
+            measure(name + ' before', before, requests, counter)
+            measure(name + ' after', after, requests, counter)
+        cancels = games[args.calls:]
+        measure('cancel_game before', cancel_game_before,
+                game_requests(api.GET_GAME_REQUEST,
+                              cancels[:args.calls]), counter)
+        measure('cancel_game after', service.cancel_game,
+                game_requests(api.GET_GAME_REQUEST,
+                              cancels[args.calls:2 * args.calls]), counter)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
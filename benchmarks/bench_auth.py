@@ -0,0 +1,94 @@
+"""bench_auth.py - Latency of resolving an OAuth token to a user id, cold
+and from the memcache and instance caches.
+
+Usage: python -m benchmarks.bench_auth [--requests 200] [--latency 0.05]
+
+Serves a fake tokeninfo on localhost that answers after --latency seconds,
+and points utils.get_user_id at it through the SDK urlfetch stub. Needs
+the App Engine SDK on the Python path."""
+import argparse
+import BaseHTTPServer
+import json
+import os
+import threading
+import time
+import urlparse
+
+import utils
+from benchmarks.stubs import setup_testbed
+
+
+class FakeTokenInfo(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers any access token with a user id derived from it"""
+    latency = 0.05
+    requests = 0
+
+    def do_GET(self):
+        FakeTokenInfo.requests += 1
+        time.sleep(self.latency)
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        if 'access_token' not in query:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': 'invalid_token'}))
+            return
+        token = query['access_token'][0]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'user_id': 'user-' + token,
+                                     'expires_in': 3600}))
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(latency):
+    FakeTokenInfo.latency = latency
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), FakeTokenInfo)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def measure(name, tokens, before_each=None):
+    FakeTokenInfo.requests = 0
+    times = []
+    for token in tokens:
+        if before_each:
+            before_each()
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer ' + token
+        start = time.time()
+        user_id = utils.get_user_id(None, 'oauth')
+        times.append(time.time() - start)
+        if user_id != 'user-' + token:
+            raise AssertionError('Got user id %r' % user_id)
+    times.sort()
+    print('%-9s mean %7.2fms  p50 %7.2fms  p95 %7.2fms  %d tokeninfo calls'
+          % (name, 1000 * sum(times) / len(times),
+             1000 * times[len(times) // 2],
+             1000 * times[int(len(times) * 0.95)], FakeTokenInfo.requests))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    server = start_server(args.latency)
+    utils.TOKENINFO_URL = 'http://localhost:%d/oauth2/v1/tokeninfo' % (
+        server.server_address[1])
+    try:
+        tokens = ['token%d' % i for i in range(args.requests)]
+        measure('cold', tokens)
+        measure('memcache', tokens, utils._token_cache.clear)
+        measure('instance', tokens)
+    finally:
+        server.shutdown()
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""bench_concurrency.py - Many clients making moves on the same game at once.
+
+Usage: python -m benchmarks.bench_concurrency [--threads 8] [--games 10]
+       [--duplicates 0.3]
+
+For each game, every thread reads it, picks the greedy move for what it
+read and sends it with move_seq, sending it again with probability
+--duplicates as a retrying client would. Each send is a fresh request that
+loads the game. Checks that every game scored each category once, adds
+up, replays from its seed and was recorded once, and reports how moves
+ended. Needs the App Engine SDK on the Python path."""
+import argparse
+import random
+import threading
+import time
+
+from google.appengine.ext import ndb
+
+import engine
+import hotstate
+import play
+import simulate
+from benchmarks.stubs import setup_testbed
+from models import Game
+from models import Score
+from models import User
+
+
+class Outcomes(object):
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, outcome):
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+
+def load(game_key):
+    return hotstate.load(game_key.get(use_cache=False))
+
+
+def send(game_key, move, move_seq, fingerprint, outcomes):
+    game = load(game_key)
+    try:
+        result = hotstate.apply_move(game, move, move_seq, fingerprint)
+    except hotstate.StaleMoveError:
+        outcomes.add('stale')
+    except engine.GameOverError:
+        outcomes.add('over')
+    else:
+        outcomes.add('lost race' if result is None else 'applied or replayed')
+
+
+def client(game_key, rand, duplicates, outcomes):
+    ndb.get_context().set_cache_policy(False)
+    while True:
+        game = load(game_key)
+        if game.game_over:
+            return
+        state = game.to_state()
+        action, value = simulate.greedy_strategy(state, rand)
+        if action == 'roll':
+            move = lambda state: engine.roll_dice(state, value)
+        else:
+            move = lambda state: engine.choose_category(state, value)
+        fingerprint = '%s:%s' % (action, value)
+        for i in range(2 if rand.random() < duplicates else 1):
+            send(game_key, move, game.version, fingerprint, outcomes)
+
+
+def check(game):
+    if not game.game_over or game.round_remain != 0:
+        raise AssertionError('Game did not finish')
+    categories = [int(cat) for cat in game.cat_history]
+    if sorted(categories) != sorted(play.CATEGORIES):
+        raise AssertionError('Categories scored %s' % categories)
+    for dice, category in zip(game.dice_history, categories):
+        if game.score_card[category] != play.find_score(
+                [int(face) for face in dice], category):
+            raise AssertionError('Score of %s does not match' % category)
+    if game.replay_dice_history() != game.dice_history:
+        raise AssertionError('Dice history does not replay from the seed')
+
+
+def run(threads, games, duplicates):
+    user_key = User(name='bench').put()
+    outcomes = Outcomes()
+    rand = random.Random(1)
+    start = time.time()
+    for i in range(games):
+        game = Game.new_game(user_key)
+        clients = [threading.Thread(target=client, args=(
+            game.key, random.Random(rand.random()), duplicates, outcomes))
+                   for j in range(threads)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        check(game.key.get(use_cache=False))
+    elapsed = time.time() - start
+    scores = Score.query(Score.user == user_key).count()
+    user = user_key.get(use_cache=False)
+    if scores != games or user.games_completed != games:
+        raise AssertionError('%s games recorded %s scores, %s completed'
+                             % (games, scores, user.games_completed))
+    print('%d games by %d threads in %.1fs, all consistent'
+          % (games, threads, elapsed))
+    for outcome, count in sorted(outcomes.counts.items()):
+        print('  %-20s %d' % (outcome, count))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--duplicates', type=float, default=0.3)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    try:
+        run(args.threads, args.games, args.duplicates)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""bench_dice.py - Rolls per second of the dice sources.
+
+Usage: python -m benchmarks.bench_dice [--rolls 1000000]
+
+Compares the old per-die random.randint loop with the bulk DiceSource, the
+seeded source games made for every roll before and the GameDice they keep."""
+import argparse
+import hashlib
+import random
+import time
+
+import play
+
+
+def randint_rolls(rolls):
+    """The previous play.roll_dice, one randint call per die."""
+    for j in range(rolls):
+        dice = []
+        for i in range(play.TOTAL_DICE):
+            dice.append(random.randint(1, 6))
+
+
+def bulk_rolls(rolls):
+    source = play.DiceSource(1, chunk_size=1024)
+    for j in range(rolls):
+        source.roll(play.TOTAL_DICE)
+
+
+class KeyedDiceSource(play.DiceSource):
+    """The source made for every roll of a game before GameDice."""
+
+    def __init__(self, key):
+        self._key = key
+        self._counter = 0
+        self._faces = []
+
+    def _random_bytes(self):
+        block = '%s:%d' % (self._key, self._counter)
+        self._counter += 1
+        return hashlib.sha256(block.encode('ascii')).digest()
+
+
+def keyed_rolls(rolls):
+    seed = 1
+    for j in range(rolls):
+        KeyedDiceSource('%d:%d:%d' % (seed, j % play.ROUNDS,
+                                      j % play.ROLLS_PER_ROUND)
+                        ).roll(play.TOTAL_DICE)
+
+
+def game_rolls(rolls):
+    game_dice = play.GameDice(1)
+    for j in range(rolls):
+        game_dice.roll(play.TOTAL_DICE, j % play.ROUNDS,
+                       j % play.ROLLS_PER_ROUND)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rolls', type=int, default=1000000)
+    args = parser.parse_args()
+    for name, func in [('randint per die (before)', randint_rolls),
+                       ('DiceSource bulk', bulk_rolls),
+                       ('keyed source per roll (before)', keyed_rolls),
+                       ('GameDice', game_rolls)]:
+        start = time.time()
+        func(args.rolls)
+        seconds = time.time() - start
+        print('%-32s %12.0f rolls/s' % (name, args.rolls / seconds))
+
+
+if __name__ == '__main__':
+    main()
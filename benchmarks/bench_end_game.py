@@ -0,0 +1,82 @@
+"""bench_end_game.py - Latency of finishing a game, before and after
+end_game became a single transaction.
+
+Usage: python -m benchmarks.bench_end_game [--games 200] [--rpc-delay 0.01]
+
+Runs on the SDK datastore stub with --rpc-delay seconds added to every
+datastore RPC. The leaderboard update is left out of both paths, it only
+measures writing the game, score and user."""
+import argparse
+import time
+from datetime import date
+
+import leaderboard
+import play
+from benchmarks.stubs import RpcCounter
+from benchmarks.stubs import delay_datastore
+from benchmarks.stubs import setup_testbed
+from models import Game
+from models import Score
+from models import User
+
+
+def legacy_end_game(game):
+    """Game.end_game before the transaction: four serial round trips"""
+    game.game_over = True
+    game.put()
+    total_score = game.score_card[16]
+    score = Score(user=game.user, date=date.today(), result=total_score)
+    score.put()
+    user = User.query(User.key == game.user).get()
+    if total_score > user.max_score:
+        user.max_score = total_score
+    user.games_completed += 1
+    user.put()
+
+
+def finished_games(user_key, num):
+    games = []
+    for i in range(num):
+        game = Game.new_game(user_key)
+        game.score_card = [10] * (play.TOTAL + 1)
+        game.round_remain = 0
+        games.append(game)
+    return games
+
+
+def measure(name, end_game, games, counter):
+    counter.reset()
+    times = []
+    for game in games:
+        start = time.time()
+        end_game(game)
+        times.append(time.time() - start)
+    times.sort()
+    print('%-12s mean %6.1fms  p50 %6.1fms  p95 %6.1fms  %.1f RPCs/game'
+          % (name, 1000 * sum(times) / len(times),
+             1000 * times[len(times) // 2],
+             1000 * times[int(len(times) * 0.95)],
+             float(counter.count()) / len(games)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--rpc-delay', type=float, default=0.01)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    leaderboard.record_score = lambda score, user_name: None
+    try:
+        user_key = User(id='bench', name='bench').put()
+        legacy = finished_games(user_key, args.games)
+        single = finished_games(user_key, args.games)
+        delay_datastore(args.rpc_delay)
+        counter = RpcCounter().install()
+        measure('before', legacy_end_game, legacy, counter)
+        measure('after', Game.end_game, single, counter)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""bench_engine.py - Full 13-round games through engine.GameRunner on the
+in-memory store.
+
+Usage: python -m benchmarks.bench_engine [--games 10000] [--profile]
+
+Each round rolls three times, keeping the dice of the most common face, then
+scores the best open category."""
+import argparse
+import cProfile
+import pstats
+import time
+
+import engine
+import play
+from storage import MemoryStore
+
+
+def play_game(runner, game_id):
+    store = runner.store
+    for round_no in range(play.ROUNDS):
+        runner.roll_dice(game_id)
+        for reroll in range(play.ROLLS_PER_ROUND - 1):
+            dice = store.get_game(game_id).dice
+            face = max(set(dice), key=dice.count)
+            runner.roll_dice(game_id, [i for i, die in enumerate(dice)
+                                       if die == face])
+        state = store.get_game(game_id)
+        scores = play.score_all(state.dice)
+        open_categories = [i for i, category in enumerate(play.CATEGORIES)
+                           if state.score_card[category] == -1]
+        best = max(open_categories, key=lambda i: scores[i])
+        runner.choose_category(game_id, play.CATEGORIES[best])
+
+
+def run(games, seed):
+    runner = engine.GameRunner(MemoryStore())
+    user_id = runner.store.create_user('bench')
+    for i in range(games):
+        play_game(runner, runner.new_game(user_id, seed + i))
+    return runner.store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run, args.games, args.seed)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        return
+    start = time.time()
+    store = run(args.games, args.seed)
+    seconds = time.time() - start
+    totals = [result for user_id, day, result in store.scores]
+    print('%d games in %.2fs: %.0f games/s, %.0f games/hour, '
+          'mean score %.1f' % (args.games, seconds, args.games / seconds,
+                               args.games / seconds * 3600,
+                               float(sum(totals)) / len(totals)))
+
+
+if __name__ == '__main__':
+    main()
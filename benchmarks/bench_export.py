@@ -0,0 +1,155 @@
+"""bench_export.py - Throughput and memory of export.py on the local
+datastore stub, with an interrupted and resumed run and an incremental one.
+
+Usage: python -m benchmarks.bench_export [--games 20000] [--format ndjson]
+       [--chunk-bytes 1048576]
+
+Stores --games completed games with their Scores, ended a second apart,
+exports them, then exports again stopping after a few pages and resuming,
+and finally exports only games added after the first run, starting from
+export.SAFETY_WINDOW before its last game. Checks every game is written
+once and reports the growth of peak memory during each
+run. Needs the App Engine SDK on the Python path."""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+import engine
+import export
+import simulate
+from benchmarks.stubs import setup_testbed
+from models import Game
+from models import Score
+from models import User
+
+_PUT_BATCH = 500
+
+
+def finished_states(count, rand):
+    states = []
+    for i in range(count):
+        state = engine.new_state(rand.getrandbits(48))
+        while not state.game_over:
+            action, value = simulate.greedy_strategy(state, rand)
+            if action == 'roll':
+                state = engine.roll_dice(state, value).state
+            else:
+                state = engine.choose_category(state, value).state
+        states.append(state)
+    return states
+
+
+def store_games(user_key, states, count, start):
+    """Store count completed games cycling through states, ended a second
+    apart from start"""
+    for first in range(0, count, _PUT_BATCH):
+        games = []
+        for i in range(first, min(count, first + _PUT_BATCH)):
+            game = Game(user=user_key, ended=start + timedelta(seconds=i))
+            game.set_state(states[i % len(states)])
+            games.append(game)
+        ndb.put_multi(games)
+        ndb.put_multi([Score(key=Score.key_for(game.key), user=user_key,
+                             date=game.ended.date(),
+                             result=game.score_card[16]) for game in games])
+
+
+def exported_games(output, manifest):
+    keys = []
+    for name in manifest['chunks']:
+        with open(os.path.join(output, name)) as chunk:
+            if manifest['format'] == 'ndjson':
+                keys.extend(json.loads(line)['game'] for line in chunk)
+            else:
+                keys.extend(json.load(chunk)['game'])
+    return keys
+
+
+def peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(name, expected, **kwargs):
+    output = kwargs['output']
+    before = peak_kb()
+    start = time.time()
+    manifest = export.export(**kwargs)
+    elapsed = time.time() - start
+    keys = exported_games(output, manifest)
+    if len(keys) != expected or len(set(keys)) != expected:
+        raise AssertionError('%s: %d games written, %d distinct, expected %d'
+                             % (name, len(keys), len(set(keys)), expected))
+    size = sum(os.path.getsize(os.path.join(output, chunk))
+               for chunk in manifest['chunks'])
+    print('%-12s %6d games in %5.1fs (%6.0f/s)  %3d chunks  %5.0f bytes/game'
+          '  peak memory +%d kB'
+          % (name, len(keys), elapsed, len(keys) / elapsed,
+             len(manifest['chunks']), float(size) / len(keys),
+             peak_kb() - before))
+    return manifest
+
+
+class Interrupted(Exception):
+    pass
+
+
+def stop_after(pages, limit):
+    """Wrap export.pages to fail after limit pages"""
+    def wrapper(*args, **kwargs):
+        for i, page in enumerate(pages(*args, **kwargs)):
+            if i == limit:
+                raise Interrupted()
+            yield page
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=20000)
+    parser.add_argument('--format', choices=sorted(export.CHUNKS),
+                        default='ndjson')
+    parser.add_argument('--chunk-bytes', type=int, default=1 << 20)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    root = tempfile.mkdtemp()
+    try:
+        user_key = User(name='bench').put()
+        states = finished_states(200, random.Random(1))
+        start = datetime(2016, 5, 1)
+        store_games(user_key, states, args.games, start)
+        options = dict(format=args.format, chunk_bytes=args.chunk_bytes)
+        full = run('full', args.games, output=os.path.join(root, 'full'),
+                   **options)
+
+        pages = export.pages
+        export.pages = stop_after(pages, 30)
+        try:
+            export.export(output=os.path.join(root, 'resumed'), **options)
+        except Interrupted:
+            pass
+        finally:
+            export.pages = pages
+        run('resumed', args.games, output=os.path.join(root, 'resumed'),
+            resume=True, **options)
+
+        added = args.games // 10
+        store_games(user_key, states, added,
+                    start + timedelta(seconds=args.games))
+        run('incremental', added, output=os.path.join(root, 'incremental'),
+            after=full, **options)
+    finally:
+        shutil.rmtree(root)
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
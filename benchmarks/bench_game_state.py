@@ -0,0 +1,124 @@
+"""bench_game_state.py - Stored size and put cost of a Game, with the state
+in separate properties as before and packed into one blob.
+
+Usage: python -m benchmarks.bench_game_state [--games 200] [--seed 1]
+
+Plays greedy self-play games and stores each one after every move in both
+layouts on the SDK datastore stub. Index rows count the built-in
+ascending and descending rows of each indexed value, the composite indexes
+of index.yaml are the same for both. Needs the App Engine SDK on the
+Python path."""
+import argparse
+import random
+
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import msgprop
+
+import engine
+import simulate
+from benchmarks.stubs import RpcCounter
+from benchmarks.stubs import setup_testbed
+from models import CardCategory
+from models import Game
+from models import User
+
+
+class LegacyGame(ndb.Model):
+    """Game as stored before the packed state"""
+    user = ndb.KeyProperty(required=True, kind='User')
+    round_remain = ndb.IntegerProperty(required=True)
+    roll_remain = ndb.IntegerProperty(required=True)
+    game_over = ndb.BooleanProperty(required=True, default=False)
+    dice = ndb.IntegerProperty(repeated=True)
+    score_card = ndb.IntegerProperty(repeated=True)
+    cat_history = msgprop.EnumProperty(CardCategory, repeated=True)
+    dice_history = ndb.StringProperty(repeated=True)
+    seed = ndb.IntegerProperty(indexed=False)
+    roll_log = ndb.StringProperty(repeated=True, indexed=False)
+
+    def set_state(self, state):
+        self.round_remain = state.round_remain
+        self.roll_remain = state.roll_remain
+        self.game_over = state.game_over
+        self.dice = state.dice
+        self.score_card = state.score_card
+        self.cat_history = [CardCategory(cat) for cat in state.cat_history]
+        self.dice_history = state.dice_history
+        self.seed = state.seed
+        self.roll_log = state.roll_log
+
+
+class Layout(object):
+    def __init__(self, name):
+        self.name = name
+        self.puts = 0
+        self.put_bytes = 0
+        self.index_rows = 0
+        self.final_bytes = 0
+        self.final_index_rows = 0
+
+    def report(self, games):
+        print('%-7s final entity %5.0f bytes %5.1f index rows  '
+              'per put %5.0f bytes %5.1f index rows'
+              % (self.name, float(self.final_bytes) / games,
+                 float(self.final_index_rows) / games,
+                 float(self.put_bytes) / self.puts,
+                 float(self.index_rows) / self.puts))
+
+
+def index_rows(entity):
+    return 2 * len(ndb.ModelAdapter().entity_to_pb(entity).property_list())
+
+
+def store(layout, entity, state, counter):
+    entity.set_state(state)
+    counter.reset()
+    entity.put()
+    layout.puts += 1
+    layout.put_bytes += counter.datastore_bytes
+    layout.index_rows += index_rows(entity)
+
+
+def run(games, seed):
+    user_key = User(name='bench').put()
+    counter = RpcCounter().install()
+    packed = Layout('packed')
+    legacy = Layout('legacy')
+    for i in range(games):
+        game_seed = simulate.game_seed(seed, i)
+        state = engine.new_state(game_seed)
+        rand = random.Random(game_seed)
+        game = Game(user=user_key)
+        old = LegacyGame(user=user_key)
+        while True:
+            store(packed, game, state, counter)
+            store(legacy, old, state, counter)
+            if state.game_over:
+                break
+            action, value = simulate.greedy_strategy(state, rand)
+            if action == 'roll':
+                state = engine.roll_dice(state, value).state
+            else:
+                state = engine.choose_category(state, value).state
+        for layout, entity in ((packed, game), (legacy, old)):
+            layout.final_bytes += ndb.ModelAdapter().entity_to_pb(
+                entity).ByteSize()
+            layout.final_index_rows += index_rows(entity)
+    for layout in (legacy, packed):
+        layout.report(games)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    try:
+        run(args.games, args.seed)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""bench_history.py - Time to build and serialize game histories.
+
+Usage: python -m benchmarks.bench_history [--histories 100000] [--limit 5]
+
+Builds the JSON of get_game_history for --histories finished games loaded
+from their packed state, with the loop it replaced, with to_history_form,
+a page of --limit rounds and the compact form. Needs the App Engine SDK
+on the Python path."""
+import argparse
+import random
+import time
+
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+import codec
+import engine
+import simulate
+from models import Game
+from models import GameHistory
+from models import GameHistoryForm
+
+_DISTINCT = 1000
+
+
+def packed_states(count, rand):
+    states = []
+    for i in range(count):
+        state = engine.new_state(rand.getrandbits(48))
+        while not state.game_over:
+            action, value = simulate.greedy_strategy(state, rand)
+            if action == 'roll':
+                state = engine.roll_dice(state, value).state
+            else:
+                state = engine.choose_category(state, value).state
+        states.append(codec.encode_state(state))
+    return states
+
+
+def loaded_game(user_key, packed):
+    """A Game as read from the datastore, its state not decoded yet"""
+    return Game(user=user_key, round_remain=0, game_over=True, state=packed)
+
+
+def replaced_history_form(game):
+    """to_history_form before rounds were sliced from the packed state"""
+    form = GameHistoryForm()
+    length = len(game.dice_history)
+    for i in range(0, length):
+        history = GameHistory()
+        history.dice = game.dice_history[i]
+        history.category = game.cat_history[i].name
+        if i == 0:
+            form_list = [history]
+        else:
+            form_list.append(history)
+    form.items = [item for item in form_list]
+    return form
+
+
+def measure(name, to_form, states, histories):
+    user_key = ndb.Key('User', 'bench')
+    size = 0
+    start = time.time()
+    for i in range(histories):
+        game = loaded_game(user_key, states[i % len(states)])
+        size += len(protojson.encode_message(to_form(game)))
+    elapsed = time.time() - start
+    print('%-14s %7.1fus/history  %6.0f histories/s  %5.0f bytes'
+          % (name, 1e6 * elapsed / histories, histories / elapsed,
+             float(size) / histories))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--histories', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=5)
+    args = parser.parse_args()
+    states = packed_states(_DISTINCT, random.Random(1))
+    measure('replaced', replaced_history_form, states, args.histories)
+    measure('full', lambda game: game.to_history_form(), states,
+            args.histories)
+    measure('page', lambda game: game.to_history_form(0, args.limit),
+            states, args.histories)
+    measure('compact', lambda game: game.to_compact_history_form(), states,
+            args.histories)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""bench_hotstate.py - Datastore writes per game with every move written
+through, and with rolls cached by hotstate.
+
+Usage: python -m benchmarks.bench_hotstate [--games 100] [--evict 0.0]
+
+Plays greedy self-play games on the SDK datastore and memcache stubs.
+--evict drops a game's cache entry before a move with that probability,
+to check games still finish with dice the seed replays. Needs the App
+Engine SDK on the Python path."""
+import argparse
+import random
+import time
+
+from google.appengine.api import memcache
+
+import engine
+import hotstate
+import simulate
+from benchmarks.stubs import RpcCounter
+from benchmarks.stubs import setup_testbed
+from models import Game
+from models import User
+
+
+def write_through(game, move):
+    """Moves as the api applied them before hotstate"""
+    result = move(game.to_state())
+    game.set_state(result.state)
+    if engine.END_GAME in result.effects:
+        game.end_game()
+    elif engine.SAVE_GAME in result.effects:
+        game.put()
+    return result
+
+
+def play(apply_move, user_key, rand, evict):
+    game = Game.new_game(user_key)
+    strategy_rand = random.Random(game.seed)
+    while not game.game_over:
+        if rand.random() < evict:
+            memcache.flush_all()
+            game = game.key.get()
+        # the strategy sees the state a client would be shown
+        state = hotstate.load(game).to_state()
+        action, value = simulate.greedy_strategy(state, strategy_rand)
+        if action == 'roll':
+            move = lambda state: engine.roll_dice(state, value)
+        else:
+            move = lambda state: engine.choose_category(state, value)
+        if apply_move(game, move) is None:
+            raise RuntimeError('Move lost every race')
+    if game.replay_dice_history() != game.dice_history:
+        raise RuntimeError('Dice history does not replay from the seed')
+
+
+def measure(name, apply_move, games, evict, user_key, counter):
+    rand = random.Random(1)
+    counter.reset()
+    start = time.time()
+    for i in range(games):
+        play(apply_move, user_key, rand, evict)
+    elapsed = time.time() - start
+    print('%-13s %5.1f datastore puts/game  %5.1f memcache calls/game  '
+          '%6.1fms/game'
+          % (name, float(counter.count('datastore_v3', 'Put')) / games,
+             float(counter.count('memcache')) / games,
+             1000 * elapsed / games))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--evict', type=float, default=0.0)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    try:
+        user_key = User(name='bench').put()
+        counter = RpcCounter().install()
+        measure('write-through', write_through, args.games, args.evict,
+                user_key, counter)
+        measure('hotstate', hotstate.apply_move, args.games, args.evict,
+                user_key, counter)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
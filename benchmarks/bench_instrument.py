@@ -0,0 +1,47 @@
+"""bench_instrument.py - Time @instrumented adds to a call, with sampling
+off and on.
+
+Usage: python -m benchmarks.bench_instrument [--calls 200000]
+
+Times a method that does nothing, bare and decorated. Needs the App
+Engine SDK on the Python path."""
+import argparse
+import time
+
+import instrument
+import settings
+from models import StringMessage
+
+
+class Service(object):
+    def bare(self, request):
+        return StringMessage(message='ok')
+
+    @instrument.instrumented
+    def decorated(self, request):
+        return StringMessage(message='ok')
+
+
+def per_call(method, calls):
+    start = time.time()
+    for i in range(calls):
+        method(None)
+    return 1e6 * (time.time() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+    service = Service()
+    bare = per_call(service.bare, args.calls)
+    print('bare            %6.2fus/call' % bare)
+    for rate in (0, 0.01, 1):
+        settings.INSTRUMENT_SAMPLE_RATE = rate
+        cost = per_call(service.decorated, args.calls) - bare
+        print('sample rate %-4s +%5.2fus/call' % (rate, cost))
+    instrument.reset()
+
+
+if __name__ == '__main__':
+    main()
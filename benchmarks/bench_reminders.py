@@ -0,0 +1,75 @@
+"""bench_reminders.py - Users processed per second by the reminder fan-out,
+on the App Engine SDK's datastore, task queue and mail stubs.
+
+Usage: python -m benchmarks.bench_reminders [--users 10000]
+       [--with-games 0.3]
+
+Needs the App Engine SDK on the Python path. The task queue stub does not
+run tasks, so they are pulled and dispatched here until the queue drains."""
+import argparse
+import random
+import time
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import engine
+import reminders
+from benchmarks.stubs import run_tasks
+from benchmarks.stubs import setup_testbed
+from models import Game
+from models import User
+
+
+def create_users(num, with_games, seed):
+    rand = random.Random(seed)
+    users = [User(id=str(i), name='user%d' % i, email='user%d@example.com' % i)
+             for i in range(num)]
+    keys = ndb.put_multi(users)
+    games = [Game(user=key) for key in keys if rand.random() < with_games]
+    for game in games:
+        game.set_state(engine.new_state())
+    ndb.put_multi(games)
+    players = dict(zip(keys, users))
+    for game in games:
+        players[game.user].add_active_game(game.key)
+    ndb.put_multi(users)
+    return len(games)
+
+
+def drain(bed, mailer):
+    """Run queued tasks until none are left, return the tasks run"""
+    def dispatch(url, params):
+        if url == reminders.FAN_OUT_URL:
+            reminders.fan_out(params.get('cursor'))
+        else:
+            reminders.send_batch(params['keys'].split(','), mailer,
+                                 int(params.get('attempt', 1)))
+    return run_tasks(bed, [reminders.QUEUE], dispatch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--with-games', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    bed = setup_testbed()
+    try:
+        with_games = create_users(args.users, args.with_games, args.seed)
+        mailer = reminders.RateLimitedMailer(
+            'noreply@example.com', per_second=1e9)
+        start = time.time()
+        reminders.start()
+        tasks = drain(bed, mailer)
+        seconds = time.time() - start
+        sent = len(bed.get_stub(testbed.MAIL_SERVICE_NAME).get_sent_messages())
+        print('%d users (%d with games), %d tasks, %d mails in %.2fs: '
+              '%.0f users/s' % (args.users, with_games, tasks, sent, seconds,
+                                args.users / seconds))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
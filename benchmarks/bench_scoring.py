@@ -0,0 +1,71 @@
+"""bench_scoring.py - Compare play.score_batch against calling
+play.find_score once per (dice, category) pair.
+
+Usage: python -m benchmarks.bench_scoring [--sizes 10000,1000000,10000000]
+       [--scalar-limit 1000000]
+
+The scalar path is only timed up to --scalar-limit rolls, larger sizes are
+extrapolated from its measured rate and marked as estimated."""
+import argparse
+import random
+import time
+
+import play
+
+
+def random_rolls(num, seed):
+    """Return num rolls as an N x 5 array (list of lists without numpy)."""
+    if play.numpy is not None:
+        state = play.numpy.random.RandomState(seed)
+        return state.randint(1, 7, size=(num, play.TOTAL_DICE)).astype(
+            play.numpy.int8)
+    rand = random.Random(seed)
+    return [[rand.randint(1, 6) for i in range(play.TOTAL_DICE)]
+            for j in range(num)]
+
+
+def score_scalar(rows):
+    """Score rows through find_score, one call per category."""
+    find_score = play.find_score
+    categories = play.CATEGORIES
+    return [[find_score(dice, category) for category in categories]
+            for dice in rows]
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10000,1000000,10000000')
+    parser.add_argument('--scalar-limit', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('numpy: %s' % (play.numpy.__version__ if play.numpy else 'missing'))
+    print('%10s %14s %14s %9s' % ('rolls', 'scalar (s)', 'batch (s)',
+                                  'speedup'))
+    scalar_rate = None
+    for num in [int(size) for size in args.sizes.split(',')]:
+        rows = random_rolls(num, args.seed)
+        batch = timed(play.score_batch, rows)
+        if num <= args.scalar_limit or scalar_rate is None:
+            sample = rows if play.numpy is None else rows.tolist()
+            scalar = timed(score_scalar, sample[:args.scalar_limit])
+            scalar_rate = scalar / min(num, args.scalar_limit)
+            scalar = scalar_rate * num
+            estimated = num > args.scalar_limit
+        else:
+            scalar = scalar_rate * num
+            estimated = True
+        print('%10d %13.3f%s %14.3f %8.1fx' % (
+            num, scalar, '*' if estimated else ' ', batch,
+            scalar / batch if batch else float('inf')))
+    print('* extrapolated from the measured scalar rate')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""stubs.py - Local stand-ins for App Engine services used by the benchmarks.
+
+setup_testbed() activates the SDK's datastore, memcache, mail, task queue
+and user stubs, sign_in() and new_request() stand in for the endpoints
+auth and the start of a request, and run_tasks() runs queued tasks.
+delay_datastore() makes every datastore RPC take a fixed
+extra time, started when the RPC is made and waited for when its result
+is needed, so RPCs in flight together overlap as they do in production.
+RpcCounter counts the RPCs of each service. Needs the App Engine SDK on
+the Python path."""
+import itertools
+import os
+import threading
+import time
+import urlparse
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_testbed():
+    """Activate and return a testbed with the services the app uses"""
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_app_identity_stub()
+    bed.init_mail_stub()
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+    return bed
+
+
+def sign_in(email):
+    """Make endpoints.get_current_user() return a user of this email"""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+
+_request_ids = itertools.count()
+
+
+def new_request():
+    """Start a new request: empty the ndb context cache and give it a new
+    request id, which models' request caches are keyed by"""
+    os.environ['REQUEST_LOG_ID'] = 'bench-%d' % next(_request_ids)
+    ndb.get_context().clear_cache()
+
+
+def run_tasks(bed, queue_names, dispatch):
+    """Run the tasks of queues until none are left, calling dispatch with
+    each task's url and {name: value} params. Returns the tasks run"""
+    stub = bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    run = 0
+    while True:
+        tasks = [(queue_name, task) for queue_name in queue_names
+                 for task in stub.get_filtered_tasks(
+                     queue_names=[queue_name])]
+        if not tasks:
+            return run
+        for queue_name, task in tasks:
+            stub.DeleteTask(queue_name, task.name)
+            params = dict((name, values[0]) for name, values in
+                          urlparse.parse_qs(task.payload or '').items())
+            dispatch(task.url, params)
+            run += 1
+
+
+class _DelayedRPC(apiproxy_rpc.RPC):
+    """RPC whose latency runs in the background from MakeCall to Wait"""
+
+    def __init__(self, delay, *args, **kwargs):
+        super(_DelayedRPC, self).__init__(*args, **kwargs)
+        self._delay = delay
+        self._latency = None
+
+    def _MakeCallImpl(self):
+        self._latency = threading.Thread(target=time.sleep,
+                                         args=(self._delay,))
+        self._latency.start()
+        super(_DelayedRPC, self)._MakeCallImpl()
+
+    def _WaitImpl(self):
+        if self._latency is not None:
+            self._latency.join()
+        return super(_DelayedRPC, self)._WaitImpl()
+
+
+class _DelayedStub(object):
+    """Wraps a service stub, adding delay seconds to each call"""
+
+    def __init__(self, stub, delay):
+        self._stub = stub
+        self._delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+    def MakeSyncCall(self, service, call, request, response,
+                     request_id=None):
+        time.sleep(self._delay)
+        return self._stub.MakeSyncCall(service, call, request, response)
+
+    def CreateRPC(self):
+        return _DelayedRPC(self._delay, stub=self._stub)
+
+
+def delay_datastore(delay):
+    """Make each datastore RPC take delay more seconds"""
+    proxy = apiproxy_stub_map.apiproxy
+    proxy.ReplaceStub('datastore_v3',
+                      _DelayedStub(proxy.GetStub('datastore_v3'), delay))
+
+
+class RpcCounter(object):
+    """Counts API calls per service and method and the bytes of datastore
+    requests and responses while installed"""
+
+    def __init__(self):
+        self.calls = {}
+        self.methods = {}
+        self.datastore_bytes = 0
+        self._installed = False
+
+    def _pre_call(self, service, call, request, response):
+        self.calls[service] = self.calls.get(service, 0) + 1
+        self.methods[service, call] = self.methods.get((service, call), 0) + 1
+        if service == 'datastore_v3':
+            self.datastore_bytes += request.ByteSize()
+
+    def _post_call(self, service, call, request, response):
+        if service == 'datastore_v3':
+            self.datastore_bytes += response.ByteSize()
+
+    def install(self):
+        if not self._installed:
+            proxy = apiproxy_stub_map.apiproxy
+            proxy.GetPreCallHooks().Append('rpc_counter', self._pre_call)
+            proxy.GetPostCallHooks().Append('rpc_counter', self._post_call)
+            self._installed = True
+        return self
+
+    def reset(self):
+        self.calls = {}
+        self.methods = {}
+        self.datastore_bytes = 0
+
+    def count(self, service='datastore_v3', call=None):
+        if call is not None:
+            return self.methods.get((service, call), 0)
+        return self.calls.get(service, 0)
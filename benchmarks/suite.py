@@ -0,0 +1,306 @@
+"""suite.py - End-to-end benchmarks of YahtzeeGameApi on local stand-ins.
+
+Usage: python -m benchmarks.suite [--output results.json] [--users 100000]
+       [--games 20] [--repeat 100] [--scenarios full_game,list_games]
+       [--compare earlier.json]
+
+Calls the API methods in process on the SDK datastore, memcache, mail,
+task queue and urlfetch stubs, signed in through the endpoints auth
+environment variables. Every call runs as a request of its own, with an
+empty ndb context cache and a new request id. Each scenario runs on a
+fresh testbed:
+
+    full_game   create_user, new_game and --games greedy games of 13 rounds
+    list_games  get_user_games of a user with 100 active games
+    rankings    get_high_scores, get_user_rankings pages and get_my_rank
+                over --users users, after building the rank buckets
+    reminders   the reminder cron over --users users, 30% with a game
+
+Each operation reports throughput, latency percentiles and RPCs per call.
+--output writes them as JSON, --compare prints the change of p50 latency
+and throughput against the JSON of an earlier run. Needs the App Engine
+SDK on the Python path."""
+import argparse
+import collections
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import date
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+import api
+import rankings
+import reminders
+import simulate
+from benchmarks import stubs
+from benchmarks.bench_reminders import create_users
+from benchmarks.bench_reminders import drain
+from engine import GameState
+from models import CardCategory
+from models import Game
+from models import GameForm
+from models import Score
+from models import ScoreWindow
+from models import User
+
+SCENARIOS = ('full_game', 'list_games', 'rankings', 'reminders')
+_VOID = message_types.VoidMessage()
+_PUT_BATCH = 1000
+
+
+class Recorder(object):
+    """Latency and RPCs of every call of a scenario's operations. Calls
+    can nest, each counts the RPCs made while it ran."""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.calls = collections.OrderedDict()
+
+    def _counts(self):
+        return (self.counter.count('datastore_v3'),
+                self.counter.count('memcache'),
+                self.counter.datastore_bytes)
+
+    def call(self, name, function, *args):
+        stubs.new_request()
+        before = self._counts()
+        start = time.time()
+        result = function(*args)
+        elapsed = time.time() - start
+        after = self._counts()
+        self.calls.setdefault(name, []).append(
+            (elapsed,) + tuple(a - b for a, b in zip(after, before)))
+        return result
+
+    def report(self):
+        return collections.OrderedDict(
+            (name, summarize(calls)) for name, calls in self.calls.items())
+
+
+def summarize(calls):
+    times = sorted(call[0] for call in calls)
+    count = len(calls)
+
+    def percentile(percent):
+        return 1000 * times[min(count - 1, int(count * percent / 100.0))]
+
+    def mean(column):
+        return float(sum(call[column] for call in calls)) / count
+    return collections.OrderedDict([
+        ('calls', count),
+        ('per_second', count / sum(times) if sum(times) else None),
+        ('p50_ms', percentile(50)),
+        ('p95_ms', percentile(95)),
+        ('p99_ms', percentile(99)),
+        ('datastore_rpcs', mean(1)),
+        ('memcache_rpcs', mean(2)),
+        ('datastore_bytes', mean(3)),
+    ])
+
+
+def _put_in_batches(entities):
+    for i in range(0, len(entities), _PUT_BATCH):
+        ndb.put_multi(entities[i:i + _PUT_BATCH])
+
+
+def _form_state(form):
+    """The GameState a client can tell from a GameForm"""
+    card = [getattr(form, GameForm.field_by_number(7 + category).name)
+            for category in range(17)]
+    return GameState(roll_remain=form.roll_remain, dice=list(form.dice),
+                     score_card=card, game_over=form.game_over)
+
+
+# ==============
+# Scenarios -- set up the data, then record the calls
+def full_game(service, bed, args, recorder):
+    for i in range(args.games):
+        stubs.sign_in('player%d@example.com' % i)
+        recorder.call('create_user', service.create_user, _VOID)
+        recorder.call('full_game', _play_game, service, recorder,
+                      random.Random(i))
+
+
+def _play_game(service, recorder, rand):
+    form = recorder.call('new_game', service.new_game, _VOID)
+    while not form.game_over:
+        action, value = simulate.greedy_strategy(_form_state(form), rand)
+        if action == 'roll':
+            form = recorder.call(
+                'roll_dice', service.roll_dice,
+                api.ROLL_REQUEST.combined_message_class(
+                    urlsafe_game_key=form.urlsafe_key, index_chosen=value,
+                    move_seq=form.version))
+        else:
+            form = recorder.call(
+                'choose_category', service.choose_category,
+                api.CATEGORY_REQUEST.combined_message_class(
+                    urlsafe_game_key=form.urlsafe_key,
+                    category=CardCategory(value), move_seq=form.version))
+
+
+def list_games(service, bed, args, recorder):
+    email = 'lister@example.com'
+    stubs.sign_in(email)
+    service.create_user(_VOID)
+    for i in range(100):
+        stubs.new_request()
+        Game.new_game(ndb.Key(User, email))
+    for i in range(args.repeat):
+        recorder.call('get_user_games', service.get_user_games, _VOID)
+
+
+def rankings_scenario(service, bed, args, recorder):
+    rand = random.Random(1)
+    today = date.today()
+    users = [User(id='user%d@example.com' % i, name='user%d' % i,
+                  email='user%d@example.com' % i,
+                  max_score=rand.randint(50, 350),
+                  games_completed=rand.randint(1, 100))
+             for i in range(args.users)]
+    _put_in_batches(users)
+    _put_in_batches([Score(user=user.key, result=user.max_score,
+                           date=today - timedelta(days=rand.randint(0, 13)))
+                     for user in users])
+    recorder.call('build_rank_buckets', _build_rank_buckets, bed)
+    stubs.sign_in(users[0].email)
+    for window in (ScoreWindow.ALL_TIME, ScoreWindow.WEEKLY,
+                   ScoreWindow.DAILY):
+        request = api.HIGH_SCORES_REQUEST.combined_message_class(
+            window=window, number_of_results=10)
+        for i in range(args.repeat):
+            recorder.call('get_high_scores_%s' % window.name.lower(),
+                          service.get_high_scores, request)
+        for i in range(args.repeat):
+            memcache.flush_all()
+            recorder.call('get_high_scores_%s_uncached' % window.name.lower(),
+                          service.get_high_scores, request)
+    cursor = None
+    for i in range(args.repeat):
+        page = recorder.call(
+            'get_user_rankings', service.get_user_rankings,
+            api.RANKINGS_REQUEST.combined_message_class(page_size=20,
+                                                        cursor=cursor))
+        cursor = page.next_cursor
+    for i in range(args.repeat):
+        stubs.sign_in(rand.choice(users).email)
+        recorder.call('get_my_rank', service.get_my_rank, _VOID)
+
+
+def _build_rank_buckets(bed):
+    rankings.start_build()
+    stubs.run_tasks(bed, ['default'],
+                    lambda url, params: rankings.build_step())
+
+
+def reminders_scenario(service, bed, args, recorder):
+    create_users(args.users, 0.3, 1)
+    mailer = reminders.RateLimitedMailer('noreply@example.com',
+                                         per_second=1e9)
+    recorder.call('reminder_cron', _send_reminders, bed, mailer)
+
+
+def _send_reminders(bed, mailer):
+    reminders.start()
+    drain(bed, mailer)
+
+
+_RUNNERS = {'full_game': full_game, 'list_games': list_games,
+            'rankings': rankings_scenario, 'reminders': reminders_scenario}
+
+
+# ==============
+# Running and comparing
+def run(names, args):
+    results = collections.OrderedDict()
+    for name in names:
+        bed = stubs.setup_testbed()
+        # the app runs with ndb's default caching
+        ndb.get_context().set_cache_policy(None)
+        ndb.get_context().set_memcache_policy(None)
+        # hooks go with the testbed's API proxy
+        counter = stubs.RpcCounter().install()
+        try:
+            recorder = Recorder(counter)
+            start = time.time()
+            _RUNNERS[name](api.YahtzeeGameApi(), bed, args, recorder)
+            results[name] = collections.OrderedDict([
+                ('seconds', time.time() - start),
+                ('operations', recorder.report())])
+        finally:
+            bed.deactivate()
+        print_scenario(name, results[name])
+    return results
+
+
+def print_scenario(name, result):
+    print('%s (%.1fs)' % (name, result['seconds']))
+    for operation, stats in result['operations'].items():
+        print('  %-32s %5d calls %8.1f/s  p50 %8.2fms  p95 %8.2fms  '
+              'p99 %8.2fms  %6.1f datastore %6.1f memcache RPCs'
+              % (operation, stats['calls'], stats['per_second'] or 0,
+                 stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                 stats['datastore_rpcs'], stats['memcache_rpcs']))
+
+
+def compare(earlier, results):
+    print('change against the earlier run')
+    for name, result in results.items():
+        before = earlier.get('scenarios', {}).get(name, {})
+        for operation, stats in result['operations'].items():
+            old = before.get('operations', {}).get(operation)
+            if not old:
+                continue
+            print('  %-12s %-32s p50 %+6.1f%%  throughput %+6.1f%%'
+                  % (name, operation, _change(old['p50_ms'], stats['p50_ms']),
+                     _change(old['per_second'], stats['per_second'])))
+
+
+def _change(old, new):
+    if not old or new is None:
+        return 0.0
+    return 100.0 * (new - old) / old
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    args = parser.parse_args(argv)
+    names = args.scenarios.split(',')
+    for name in names:
+        if name not in _RUNNERS:
+            parser.error('unknown scenario %s' % name)
+    results = run(names, args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(collections.OrderedDict([
+                ('revision', _revision()),
+                ('time', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+                ('args', vars(args)),
+                ('scenarios', results)]), output, indent=2)
+    if args.compare:
+        with open(args.compare) as earlier:
+            compare(json.load(earlier), results)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
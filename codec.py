@@ -0,0 +1,170 @@
+"""codec.py - Compact binary encoding of an engine.GameState.
+
+Layout, all integers little-endian:
+
+    version     1 byte
+    flags       1 byte, bit 0 set when a seed follows
+    roll_remain 1 byte
+    dice        1 byte count, then 2 bytes of 3-bit faces
+    score card  2 bytes mask of filled categories, then 10 bytes of 6-bit
+                scores in play.CATEGORIES order
+    seed        8 bytes, only with flag bit 0
+    history     1 byte count, then 3 bytes per round: 3-bit faces of the
+                5 dice and the 4-bit position in play.CATEGORIES
+    roll log    1 byte count, then 2 bytes per roll: 4-bit round, the
+                5-bit mask of dice kept and the 7-bit draw
+
+Totals and the bonus are not stored, they follow from the card. The
+round_remain and game_over fields are left to the caller, Game keeps them
+as indexed properties. History records have a fixed size, so
+history_slice() can decode some rounds without the rest."""
+import struct
+
+import engine
+import play
+
+VERSION = 1
+HISTORY_RECORD = 3
+_HEAD = struct.Struct('<BBBBHH')
+_SEED = struct.Struct('<Q')
+_CARD_BYTES = 10
+_SCORE_BITS = 6
+_FACE_BITS = 3
+_UNFILLED = -1
+
+
+def _to_bytes(value, length):
+    return bytearray((value >> (8 * i)) & 0xff for i in range(length))
+
+
+def _from_bytes(data):
+    value = 0
+    for i, byte in enumerate(bytearray(data)):
+        value |= byte << (8 * i)
+    return value
+
+
+def _pack_dice(dice):
+    bits = 0
+    for i, face in enumerate(dice):
+        bits |= face << (_FACE_BITS * i)
+    return bits
+
+
+def _unpack_dice(bits, count):
+    return [(bits >> (_FACE_BITS * i)) & 7 for i in range(count)]
+
+
+def encode_state(state):
+    """Return the packed bytes of a GameState"""
+    scores = 0
+    for i, category in enumerate(play.CATEGORIES):
+        if state.filled & (1 << i):
+            scores |= state.score_card[category] << (_SCORE_BITS * i)
+    flags = 1 if state.seed is not None else 0
+    data = bytearray(_HEAD.pack(VERSION, flags, state.roll_remain,
+                                len(state.dice), _pack_dice(state.dice),
+                                state.filled))
+    data += _to_bytes(scores, _CARD_BYTES)
+    if state.seed is not None:
+        data += _SEED.pack(state.seed)
+    data.append(len(state.dice_history))
+    for dice, category in zip(state.dice_history, state.cat_history):
+        record = (_pack_dice([int(face) for face in dice]) |
+                  play.CATEGORY_INDEX[category] << 15)
+        data += _to_bytes(record, HISTORY_RECORD)
+    data.append(len(state.roll_log))
+    for entry in state.roll_log:
+        round_no, kept, draw = play.parse_roll(entry)
+        mask = 0
+        for i in kept:
+            mask |= 1 << i
+        data += _to_bytes(round_no | mask << 4 | draw << 9, 2)
+    return bytes(data)
+
+
+def _history_start(data):
+    flags = bytearray(data[1:2])[0]
+    start = _HEAD.size + _CARD_BYTES
+    return start + _SEED.size if flags & 1 else start
+
+
+# packed dice of a history record -> dice_history string, filled as seen
+_dice_strings = {}
+
+
+def _dice_string(bits):
+    dice = _dice_strings.get(bits)
+    if dice is None:
+        dice = _dice_strings[bits] = ''.join(
+            str(face) for face in _unpack_dice(bits, play.TOTAL_DICE))
+    return dice
+
+
+def _decode_history(data, start, count):
+    records = bytearray(data[start:start + count * HISTORY_RECORD])
+    dice_history = []
+    cat_history = []
+    for offset in range(0, len(records), HISTORY_RECORD):
+        record = (records[offset] | records[offset + 1] << 8 |
+                  records[offset + 2] << 16)
+        dice_history.append(_dice_string(record & 0x7fff))
+        cat_history.append(play.CATEGORIES[record >> 15])
+    return dice_history, cat_history
+
+
+def history_length(data):
+    """Number of rounds in the history of packed bytes"""
+    return bytearray(data[_history_start(data):_history_start(data) + 1])[0]
+
+
+def history_slice(data, offset, limit):
+    """Return (dice_history, cat_history) of rounds [offset, offset+limit)
+    of packed bytes, decoding only those rounds"""
+    start = _history_start(data)
+    count = bytearray(data[start:start + 1])[0]
+    offset = max(0, min(offset, count))
+    limit = max(0, min(limit, count - offset))
+    return _decode_history(data, start + 1 + offset * HISTORY_RECORD, limit)
+
+
+def decode_state(data):
+    """Return the GameState of packed bytes, leaving round_remain and
+    game_over at their defaults"""
+    version, flags, roll_remain, num_dice, dice, filled = _HEAD.unpack(
+        bytes(data[:_HEAD.size]))
+    if version != VERSION:
+        raise ValueError('Unknown game state version %s' % version)
+    offset = _HEAD.size
+    scores = _from_bytes(data[offset:offset + _CARD_BYTES])
+    offset += _CARD_BYTES
+    card = [_UNFILLED] * (play.TOTAL + 1)
+    upper = lower = 0
+    for i, category in enumerate(play.CATEGORIES):
+        if filled & (1 << i):
+            points = card[category] = (scores >> (_SCORE_BITS * i)) & 0x3f
+            if category <= play.SIXES:
+                upper += points
+            else:
+                lower += points
+    seed = None
+    if flags & 1:
+        seed = _SEED.unpack(bytes(data[offset:offset + _SEED.size]))[0]
+        offset += _SEED.size
+    count = bytearray(data[offset:offset + 1])[0]
+    dice_history, cat_history = _decode_history(data, offset + 1, count)
+    offset += 1 + count * HISTORY_RECORD
+    roll_log = []
+    for i in range(bytearray(data[offset:offset + 1])[0]):
+        start = offset + 1 + 2 * i
+        entry = _from_bytes(data[start:start + 2])
+        roll_log.append(play.log_roll(
+            entry & 0xf, [j for j in range(play.TOTAL_DICE)
+                          if entry >> 4 & (1 << j)], entry >> 9))
+    state = engine.GameState(
+        roll_remain=roll_remain, dice=_unpack_dice(dice, num_dice),
+        score_card=card, cat_history=cat_history,
+        dice_history=dice_history, seed=seed, roll_log=roll_log,
+        filled=filled, upper=upper, lower=lower)
+    state.fill_totals()
+    return state
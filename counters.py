@@ -0,0 +1,65 @@
+"""counters.py - Repair of the active game lists kept on User.
+
+User.active_game_keys is updated in the transactions that create, cancel
+and end games. The repair walks all users by cursor in a task chain and
+rebuilds each list from the Game kind, for users created before the list
+existed or lists thrown off by a failed request. A key is only added or
+removed after its game was read by key in the transaction that updates the
+list."""
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game
+from models import User
+
+REPAIR_URL = '/tasks/repair_active_games'
+# Users repaired by each task
+REPAIR_BATCH = 200
+# games read in each repair transaction, besides the user: a cross-group
+# transaction spans at most 25 entity groups
+_CHECKED_GAMES = 24
+
+
+def start_repair():
+    taskqueue.add(url=REPAIR_URL)
+
+
+def _active_game_keys_async(user_key):
+    return Game.query(Game.user == user_key).filter(
+        Game.game_over == False).fetch_async(keys_only=True)
+
+
+def repair_step(cursor=None):
+    """Repair the lists of a batch of users and enqueue the next batch"""
+    users, next_cursor, more = User.query().fetch_page(
+        REPAIR_BATCH, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    found = [_active_game_keys_async(user.key) for user in users]
+    for user, games in zip(users, found):
+        # the query is eventually consistent, so it only nominates the
+        # keys to check; each is settled by a get of its game
+        suspects = sorted(set(user.active_game_keys) ^
+                          set(games.get_result()))
+        for i in range(0, len(suspects), _CHECKED_GAMES):
+            _repair_active_games(user.key,
+                                 suspects[i:i + _CHECKED_GAMES])
+    if more and next_cursor:
+        taskqueue.add(url=REPAIR_URL, params={'cursor': next_cursor.urlsafe()})
+    return len(users)
+
+
+@ndb.transactional(xg=True)
+def _repair_active_games(user_key, game_keys):
+    """Count on the user those of the games that are active and stop
+    counting those ended or deleted"""
+    user = user_key.get()
+    if not user:
+        return
+    before = list(user.active_game_keys)
+    for key, game in zip(game_keys, ndb.get_multi(game_keys)):
+        if game and not game.game_over and game.user == user_key:
+            user.add_active_game(key)
+        else:
+            user.remove_active_game(key)
+    if user.active_game_keys != before:
+        user.put()
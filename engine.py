@@ -0,0 +1,279 @@
+"""engine.py - The game rules as moves on a plain GameState.
+
+Nothing here touches App Engine: a move takes a state and returns a new state
+with the message for the player and the side effects the caller has to carry
+out. api.py applies them to the datastore, GameRunner to any store with the
+interface of storage.MemoryStore."""
+import play
+
+# Side effects of a move
+SAVE_GAME = 'save_game'
+END_GAME = 'end_game'
+# Kinds of move in a batch, see play_moves
+ROLL = 'roll'
+SCORE = 'score'
+# GameState.filled of a complete upper section and a complete card
+UPPER_FILLED = (1 << play.SIXES + 1) - 1
+ALL_FILLED = (1 << len(play.CATEGORIES)) - 1
+
+
+class GameOverError(Exception):
+    """Raised when rolling the dice of a game that is already over."""
+
+
+class GameState(object):
+    """GameState -- everything Game stores about a game in progress.
+    cat_history holds category numbers rather than CardCategory enums.
+
+    filled has bit i set once play.CATEGORIES[i] is scored, upper and lower
+    are the points scored in each section without the bonus. They follow
+    score_card when it is assigned and are kept up by choose_category.
+
+    draw picks another dice stream for the rolls of the state and its
+    copies, see play.GameDice. It is kept in the roll log, not stored."""
+    __slots__ = ('round_remain', 'roll_remain', 'game_over', 'dice',
+                 '_score_card', 'cat_history', 'dice_history', 'seed',
+                 'roll_log', 'filled', 'upper', 'lower', '_game_dice',
+                 'draw')
+
+    def __init__(self, round_remain=play.ROUNDS,
+                 roll_remain=play.ROLLS_PER_ROUND, game_over=False,
+                 dice=None, score_card=None, cat_history=None,
+                 dice_history=None, seed=None, roll_log=None,
+                 filled=None, upper=0, lower=0):
+        self.round_remain = round_remain
+        self.roll_remain = roll_remain
+        self.game_over = game_over
+        self.dice = dice or []
+        self.cat_history = cat_history or []
+        self.dice_history = dice_history or []
+        self.seed = seed
+        self.roll_log = roll_log or []
+        self._game_dice = None
+        self.draw = 0
+        if filled is None:
+            self.score_card = score_card or [-1] * 17
+        else:
+            self._score_card = score_card
+            self.filled = filled
+            self.upper = upper
+            self.lower = lower
+
+    @property
+    def score_card(self):
+        return self._score_card
+
+    @score_card.setter
+    def score_card(self, card):
+        self._score_card = card
+        self.filled, self.upper, self.lower = card_sums(card)
+
+    def fill_totals(self):
+        """Write the upper score and bonus of a complete upper section and
+        the lower score and total of a complete card from the subtotals"""
+        card = self._score_card
+        if self.filled & UPPER_FILLED == UPPER_FILLED:
+            card[play.UPPER_SCORE] = self.upper
+            card[play.UPPER_BONUS] = 35 if self.upper >= 63 else 0
+        if self.filled == ALL_FILLED:
+            card[play.LOWER_SCORE] = self.lower
+            card[play.TOTAL] = (self.upper + card[play.UPPER_BONUS] +
+                                self.lower)
+
+    def open_scores(self):
+        """Return [(category, points)] of the categories not scored yet
+        for the current dice, empty before the first roll"""
+        if not self.dice:
+            return []
+        scores = play.score_all(self.dice)
+        return [(category, scores[i])
+                for i, category in enumerate(play.CATEGORIES)
+                if not self.filled & (1 << i)]
+
+    def game_dice(self):
+        """Return the play.GameDice of the seed, made on the first roll and
+        shared with the copies of the state"""
+        if self._game_dice is None:
+            self._game_dice = play.GameDice(self.seed)
+        return self._game_dice
+
+    def copy(self):
+        state = GameState(
+            self.round_remain, self.roll_remain, self.game_over,
+            list(self.dice), list(self._score_card), list(self.cat_history),
+            list(self.dice_history), self.seed, list(self.roll_log),
+            self.filled, self.upper, self.lower)
+        state._game_dice = self._game_dice
+        state.draw = self.draw
+        return state
+
+
+def card_sums(card):
+    """Return (filled, upper, lower) of a score card, see GameState"""
+    filled = upper = lower = 0
+    for i, category in enumerate(play.CATEGORIES):
+        points = card[category]
+        if points != -1:
+            filled |= 1 << i
+            if category <= play.SIXES:
+                upper += points
+            else:
+                lower += points
+    return filled, upper, lower
+
+
+class MoveResult(object):
+    """MoveResult -- outcome of a move
+
+    state: the game state after the move.
+    message: text for the player.
+    effects: list of SAVE_GAME / END_GAME the caller has to carry out, empty
+        when the move was refused and nothing changed.
+    points: points scored by a category choice, otherwise None.
+    steps: MoveResult of each move tried by play_moves.
+    """
+
+    def __init__(self, state, message, effects=(), points=None, steps=()):
+        self.state = state
+        self.message = message
+        self.effects = list(effects)
+        self.points = points
+        self.steps = list(steps)
+
+
+def new_state(seed=None):
+    """Return the state of a new seeded game"""
+    return GameState(seed=play.new_seed() if seed is None else seed)
+
+
+def roll_dice(state, index_chosen):
+    """Roll the dice not kept -- Three chances each round"""
+    if state.game_over:
+        raise GameOverError('Game is already over!')
+    # for the first roll you cannot choose dice to keep
+    if not state.dice and index_chosen:
+        return MoveResult(state, 'Cannot choose index now.')
+    if len(index_chosen) == play.TOTAL_DICE:
+        return MoveResult(state, 'You cannot keep all dice to roll.')
+    # each die can be kept once, the dice kept stay in their order
+    if (len(set(index_chosen)) != len(index_chosen) or
+            [i for i in index_chosen if not 0 <= i < len(state.dice)]):
+        return MoveResult(state, 'Invalid index of dice to keep.')
+    # kept in the order of the roll, which is all the packed roll log keeps
+    index_chosen = sorted(index_chosen)
+    if state.roll_remain < 1:
+        return MoveResult(
+            state, 'You have to choose the category, no more roll chance.')
+    state = state.copy()
+    round_no = play.ROUNDS - state.round_remain
+    dice_kept = play.choose_dice(state.dice, index_chosen)
+    if state.seed is None:
+        # games created before seeding cannot be replayed
+        state.dice = play.roll(dice_kept)
+    else:
+        roll_no = play.ROLLS_PER_ROUND - state.roll_remain
+        state.dice = dice_kept + state.game_dice().roll(
+            play.TOTAL_DICE - len(dice_kept), round_no, roll_no, state.draw)
+        state.roll_log.append(
+            play.log_roll(round_no, index_chosen, state.draw))
+    state.roll_remain -= 1
+    return MoveResult(
+        state, '%s chances remain to roll in this round.' % state.roll_remain,
+        [SAVE_GAME])
+
+
+def choose_category(state, category):
+    """Score the dice in a category (a CardCategory number) to end the
+    round"""
+    if state.game_over:
+        return MoveResult(state, 'Game already over!')
+    if not state.dice:
+        return MoveResult(state, 'Roll the dice first!')
+    if category not in play.CATEGORY_INDEX:
+        return MoveResult(state, 'Totals cannot be chosen as a category.')
+    bit = 1 << play.CATEGORY_INDEX[category]
+    if state.filled & bit:
+        return MoveResult(state, 'You have already chosen this category.')
+    state = state.copy()
+    # Record score to the category
+    points = play.find_score(state.dice, category)
+    state.score_card[category] = points
+    state.filled |= bit
+    if category <= play.SIXES:
+        state.upper += points
+    else:
+        state.lower += points
+    state.round_remain -= 1
+    # Record game history
+    state.dice_history.append(''.join(str(num) for num in state.dice))
+    state.cat_history.append(category)
+    # Add the sums and bonus of the sections complete
+    state.fill_totals()
+    if state.filled == ALL_FILLED:
+        state.game_over = True
+        total = state.score_card[play.TOTAL]
+        return MoveResult(state, 'You got total %s ! Game End.' % total,
+                          [END_GAME], points)
+    # Reset dice
+    state.roll_remain = play.ROLLS_PER_ROUND
+    state.dice = []
+    return MoveResult(state, 'You got %s points.' % points, [SAVE_GAME],
+                      points)
+
+
+def play_moves(state, moves):
+    """Apply moves, (ROLL, index_chosen) or (SCORE, category) pairs, in
+    order and stop at the first one refused. Returns a MoveResult of the
+    whole batch, with its effects carried out once"""
+    steps = []
+    effects = []
+    for action, value in moves:
+        try:
+            if action == ROLL:
+                step = roll_dice(state, value)
+            else:
+                step = choose_category(state, value)
+        except GameOverError as error:
+            step = MoveResult(state, str(error))
+        steps.append(step)
+        if not step.effects:
+            break
+        state = step.state
+        effects = [END_GAME] if END_GAME in step.effects else [SAVE_GAME]
+    message = steps[-1].message if steps else 'No moves to make.'
+    return MoveResult(state, message, effects, steps=steps)
+
+
+class GameRunner(object):
+    """Plays moves against a store, loading and saving the game around
+    each one. The store needs the create_game, get_game, put_game and
+    end_game methods of storage.MemoryStore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def new_game(self, user_id, seed=None):
+        """Create a game and return its id"""
+        return self.store.create_game(user_id, new_state(seed))
+
+    def roll_dice(self, game_id, index_chosen=()):
+        result = roll_dice(self.store.get_game(game_id), list(index_chosen))
+        self.apply(game_id, result)
+        return result
+
+    def choose_category(self, game_id, category):
+        result = choose_category(self.store.get_game(game_id), category)
+        self.apply(game_id, result)
+        return result
+
+    def play_moves(self, game_id, moves):
+        result = play_moves(self.store.get_game(game_id), moves)
+        self.apply(game_id, result)
+        return result
+
+    def apply(self, game_id, result):
+        """Carry out the side effects of a move"""
+        if END_GAME in result.effects:
+            self.store.end_game(game_id, result.state)
+        elif SAVE_GAME in result.effects:
+            self.store.put_game(game_id, result.state)
@@ -0,0 +1,291 @@
+"""export.py - Streaming export of completed games for offline analysis.
+
+Usage: python export.py --output DIR [--format ndjson|columns]
+       [--after PREVIOUS_DIR | --since 2016-05-01T00:00:00[.000000]]
+       [--resume] [--server HOST] [--chunk-bytes 8388608] [--page-size 200]
+
+Pages through the completed games by cursor. Each page's Scores come in
+one batch get while the next page is fetched. Games are written with
+their score card, dice and category history, end time and Score date
+into chunk files of about --chunk-bytes:
+
+    ndjson   chunk-00000.ndjson, one JSON object per game
+    columns  chunk-00000.columns.json, one JSON object per chunk mapping
+             each field, and each score card slot by its GameForm name,
+             to the list of its values. A game's dice history is a
+             string of 5 digits per round, its categories a list of
+             CardCategory numbers
+
+A chunk holds the pages written since the previous one, so memory stays
+at one chunk however many games there are. manifest.json lists the
+chunks done and the cursor after the last one. --resume carries on from
+there, redoing at most the chunk that was being written.
+
+--after exports the games ended since the run in PREVIOUS_DIR, in the
+order they ended. Game.ended is set before the game is committed and the
+index on it is eventually consistent, so a game can show up after a run
+has gone past its end time: an incremental run starts SAFETY_WINDOW before
+the last_ended of the previous run and leaves out the games that run
+wrote, which its manifest lists. --since only exports games ended after a
+UTC time, without that overlap, so games ended just before it may never
+be written; a warehouse loading those runs should upsert records on
+'game'.
+
+Games ended before Game.ended existed are left out of incremental runs.
+Their Scores were stored before Scores were linked to games and cannot be
+told apart, so they are exported with a null end time and Score date.
+
+Connects through remote_api to --server, localhost:8080 for the
+development server by default. Needs the App Engine SDK on the Python
+path."""
+import argparse
+import collections
+import json
+import os
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from google.appengine.ext.remote_api import remote_api_stub
+
+from models import CARD_FIELDS
+from models import CardCategory
+from models import Game
+from models import Score
+
+MANIFEST = 'manifest.json'
+PAGE_SIZE = 200
+CHUNK_BYTES = 8 << 20
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# how long a game can take to show up in the index on ended
+SAFETY_WINDOW = timedelta(minutes=10)
+
+
+def parse_time(text):
+    """Return the datetime of a UTC time with or without microseconds"""
+    if '.' not in text:
+        text += '.0'
+    return datetime.strptime(text, TIME_FORMAT)
+
+
+def game_query(since=None):
+    """Completed games, ended after since in the order they ended when
+    given"""
+    if since is None:
+        return Game.query(Game.game_over == True)
+    return Game.query(Game.ended > since).order(Game.ended)
+
+
+def game_record(game, score):
+    """Return the exported fields of a game and its Score"""
+    return collections.OrderedDict([
+        ('game', game.key.urlsafe()),
+        ('user', game.user.id()),
+        ('ended', game.ended.strftime(TIME_FORMAT) if game.ended else None),
+        ('date', str(score.date) if score else None),
+        ('score_card', game.score_card),
+        ('dice_history', game.dice_history),
+        ('cat_history', [cat.name for cat in game.cat_history])])
+
+
+def pages(since=None, cursor=None, page_size=PAGE_SIZE):
+    """Yield ([game records], cursor after them) of the completed games,
+    fetching the next page along with the Scores of the current one"""
+    query = game_query(since)
+    future = query.fetch_page_async(page_size, start_cursor=cursor)
+    while future is not None:
+        games, cursor, more = future.get_result()
+        scores = ndb.get_multi_async(
+            [Score.key_for(game.key) for game in games])
+        future = None
+        if more and cursor:
+            future = query.fetch_page_async(page_size, start_cursor=cursor)
+        yield ([game_record(game, score.get_result())
+                for game, score in zip(games, scores)], cursor)
+
+
+# ==============
+# Chunk files, written to a temporary name until complete
+class NdjsonChunk(object):
+    extension = 'ndjson'
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.size = 0
+
+    def add(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self.file.write(line)
+        self.size += len(line)
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnsChunk(object):
+    extension = 'columns.json'
+    COLUMNS = ['game', 'user', 'ended', 'date'] + CARD_FIELDS + [
+        'dice_history', 'cat_history']
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = collections.OrderedDict(
+            (name, []) for name in self.COLUMNS)
+        self.size = 0
+
+    def add(self, record):
+        row = [record['game'], record['user'], record['ended'],
+               record['date']] + record['score_card'] + [
+            ''.join(record['dice_history']),
+            [CardCategory(name).number for name in record['cat_history']]]
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+        self.size += len(json.dumps(row, separators=(',', ':')))
+
+    def close(self):
+        with open(self.path, 'w') as output:
+            json.dump(self.columns, output, separators=(',', ':'))
+
+
+CHUNKS = {'ndjson': NdjsonChunk, 'columns': ColumnsChunk}
+
+
+def _next_run(after):
+    """(start time, game keys to leave out) of the run after the one of
+    manifest after"""
+    if after['last_ended'] is None:
+        # nothing ended since that run started
+        return (after['since'] and parse_time(after['since']),
+                after.get('skip', []))
+    return (parse_time(after['last_ended']) - SAFETY_WINDOW,
+            [key for ended, key in after.get('window', [])])
+
+
+def _write_manifest(output, manifest):
+    path = os.path.join(output, MANIFEST)
+    with open(path + '.tmp', 'w') as out:
+        json.dump(manifest, out, indent=2)
+    os.rename(path + '.tmp', path)
+
+
+def export(output, format='ndjson', since=None, resume=False,
+           chunk_bytes=CHUNK_BYTES, page_size=PAGE_SIZE, after=None):
+    """Export the completed games to chunk files in the directory output,
+    resuming the export recorded there when asked, or only those ended
+    since the run of the manifest after. Returns the manifest"""
+    # keep no entity in the context cache, memory would grow with games
+    ndb.get_context().set_cache_policy(False)
+    ndb.get_context().set_memcache_policy(False)
+    if resume:
+        with open(os.path.join(output, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['done']:
+            return manifest
+    else:
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        skip = []
+        if after is not None:
+            since, skip = _next_run(after)
+        # window: [ended, game] of the games written that ended within
+        # SAFETY_WINDOW of last_ended, for the next run to leave out
+        manifest = collections.OrderedDict([
+            ('format', format),
+            ('since', since.strftime(TIME_FORMAT) if since else None),
+            ('skip', skip), ('games', 0), ('last_ended', None),
+            ('window', []), ('chunks', []), ('cursor', None),
+            ('done', False)])
+        _write_manifest(output, manifest)
+    chunk_class = CHUNKS[manifest['format']]
+    since = manifest['since'] and parse_time(manifest['since'])
+    cursor = manifest['cursor'] and Cursor(urlsafe=manifest['cursor'])
+    chunk = None
+    games = 0
+    last_ended = manifest['last_ended']
+    skip = set(manifest.get('skip', []))
+    recent = dict((game, ended) for ended, game in manifest.get('window', []))
+
+    def finish(chunk, cursor):
+        name = 'chunk-%05d.%s' % (len(manifest['chunks']),
+                                  chunk_class.extension)
+        chunk.close()
+        os.rename(os.path.join(output, name + '.tmp'),
+                  os.path.join(output, name))
+        manifest['chunks'].append(name)
+        manifest['games'] += games
+        manifest['last_ended'] = last_ended
+        if last_ended is not None:
+            cutoff = (parse_time(last_ended) -
+                      SAFETY_WINDOW).strftime(TIME_FORMAT)
+            for game, ended in recent.items():
+                if ended <= cutoff:
+                    del recent[game]
+        manifest['window'] = sorted([ended, game]
+                                    for game, ended in recent.items())
+        manifest['cursor'] = cursor.urlsafe() if cursor else None
+        _write_manifest(output, manifest)
+    for records, cursor in pages(since, cursor, page_size):
+        for record in records:
+            if record['game'] in skip:
+                # written by the previous run, and still as recent
+                recent[record['game']] = record['ended']
+        records = [record for record in records
+                   if record['game'] not in skip]
+        if not records:
+            continue
+        if chunk is None:
+            chunk = chunk_class(os.path.join(output, 'chunk-%05d.%s.tmp' % (
+                len(manifest['chunks']), chunk_class.extension)))
+            games = 0
+        for record in records:
+            chunk.add(record)
+            # times of one format sort as strings
+            if record['ended']:
+                recent[record['game']] = record['ended']
+                if last_ended is None or record['ended'] > last_ended:
+                    last_ended = record['ended']
+        games += len(records)
+        if chunk.size >= chunk_bytes:
+            finish(chunk, cursor)
+            chunk = None
+    if chunk is not None:
+        finish(chunk, cursor)
+    manifest['done'] = True
+    _write_manifest(output, manifest)
+    return manifest
+
+
+def connect(server):
+    """Send the datastore calls of this process to an app's remote_api"""
+    remote_api_stub.ConfigureRemoteApiForOAuth(
+        server, '/_ah/remote_api', secure=not server.startswith('localhost'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--format', choices=sorted(CHUNKS), default='ndjson')
+    runs = parser.add_mutually_exclusive_group()
+    runs.add_argument('--after')
+    runs.add_argument('--since')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--server', default='localhost:8080')
+    parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+    since = args.since and parse_time(args.since)
+    after = None
+    if args.after:
+        with open(os.path.join(args.after, MANIFEST)) as manifest_file:
+            after = json.load(manifest_file)
+    connect(args.server)
+    manifest = export(args.output, args.format, since, args.resume,
+                      args.chunk_bytes, args.page_size, after)
+    print('%s games in %s chunks, last ended %s'
+          % (manifest['games'], len(manifest['chunks']),
+             manifest['last_ended']))
+
+
+if __name__ == '__main__':
+    main()
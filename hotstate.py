@@ -0,0 +1,224 @@
+"""hotstate.py - Write-behind cache of the rolls of a round in progress.
+
+A roll only changes the dice, roll_remain and the roll log, so rolls are
+kept in memcache and the Game entity is written when a category is chosen,
+when the game ends, or when a roll comes FLUSH_AFTER seconds after the
+last write. Entries are replaced with compare-and-set, a roll that loses a
+race is retried on the new state.
+
+Every move, or batch of moves, adds one to the game's version. Stored
+writes are transactions that fail when the stored game has moved past the
+version the move was made on. A client passing the version it saw as
+move_seq gets StaleMoveError instead of a move on a newer state, or, when
+it retries the last move applied, the recorded outcome of that move.
+
+Losing an entry costs the rolls of the current round only: the stored game
+is at the start of the round (or at its last flush) and the round is
+played again from there. Rolls made on a stored game draw a fresh dice
+stream (see engine.GameState.draw), kept by the cache entry for the rolls
+after them, so the rolls lost with an entry are not dealt again. A move
+whose write fails drops the entry, which is never ahead of a store that
+did not take it."""
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import codec
+import engine
+import play
+
+NAMESPACE = 'game_state'
+MOVES_NAMESPACE = 'game_moves'
+# seconds an entry is kept, and after which a roll is also written
+ENTRY_TTL = 24 * 3600
+FLUSH_AFTER = 300
+# seconds the outcome of a move is kept for retries
+MOVE_TTL = 3600
+CAS_RETRIES = 5
+
+
+class StaleMoveError(Exception):
+    """StaleMoveError -- the move was made on an older version of the game"""
+
+    def __init__(self, version):
+        super(StaleMoveError, self).__init__(
+            'The game is at move %s.' % version)
+        self.version = version
+
+
+def _cache_key(game_key):
+    return game_key.urlsafe()
+
+
+def _move_key(game_key, move_seq):
+    return '%s:%d' % (game_key.urlsafe(), move_seq)
+
+
+def _decode(packed, round_remain, game_over):
+    state = codec.decode_state(packed)
+    state.round_remain = round_remain
+    state.game_over = game_over
+    return state
+
+
+def _cached(entry, state, version):
+    """(state, version, saved_at) of a cache entry (version, round_remain,
+    saved_at, packed state, draw), or None if it is not newer than the
+    stored game"""
+    # entries of an older layout are dropped with the rolls they hold
+    if (entry is None or len(entry) != 5 or state.game_over or
+            entry[0] <= version):
+        return None
+    cached = _decode(entry[3], entry[1], False)
+    cached.draw = entry[4]
+    return cached, entry[0], entry[2]
+
+
+def _fresh(state):
+    """A copy of a stored state drawing its rolls from a new dice stream"""
+    state = state.copy()
+    state.draw = random.randrange(1, play.DRAWS)
+    return state
+
+
+def load(game):
+    """Bring a game up to date with its cached rolls, returns the game"""
+    if game:
+        load_multi([game])
+    return game
+
+
+def load_multi(games):
+    """Bring games up to date with their cached rolls"""
+    entries = memcache.get_multi([_cache_key(game.key) for game in games],
+                                 namespace=NAMESPACE)
+    for game in games:
+        cached = _cached(entries.get(_cache_key(game.key)),
+                         game.to_state(), game.version)
+        if cached is not None:
+            game.set_state(cached[0])
+            game.version = cached[1]
+
+
+def forget(game_key):
+    """Drop the cached rolls of a game, when it is deleted"""
+    memcache.delete(_cache_key(game_key), namespace=NAMESPACE)
+
+
+def _record(game, move_seq, fingerprint, result):
+    """Record the outcome of a move made on version move_seq, with the
+    version and packed state it brought the game to"""
+    memcache.set(_move_key(game.key, move_seq),
+                 (fingerprint, move_seq, game.version, game.round_remain,
+                  game.game_over, codec.encode_state(result.state),
+                  result.message),
+                 time=MOVE_TTL, namespace=MOVES_NAMESPACE)
+
+
+def _replay(game, move_seq, fingerprint, state, version):
+    """Return the recorded MoveResult of a move made on version move_seq,
+    or None unless it was this move and it is what brought the game to
+    state at version. A version seen again after its cache entry was lost
+    does not match the record of the move first made on it."""
+    record = memcache.get(_move_key(game.key, move_seq),
+                          namespace=MOVES_NAMESPACE)
+    # records of an older layout are left to expire
+    if record is None or len(record) != 7:
+        return None
+    (recorded_fingerprint, base_version, recorded_version, round_remain,
+     game_over, packed, message) = record
+    if (recorded_fingerprint != fingerprint or base_version != move_seq or
+            (recorded_version, round_remain, game_over) !=
+            (version, state.round_remain, state.game_over) or
+            packed != codec.encode_state(state)):
+        return None
+    game.set_state(state)
+    game.version = version
+    return engine.MoveResult(state, message)
+
+
+def _put_if_current(game, base_version):
+    """Put the game unless the stored one is past base_version, in which
+    case return the stored game"""
+    def txn():
+        stored = game.key.get()
+        if stored is not None and stored.version > base_version:
+            return stored
+        game.put()
+        return None
+    return ndb.transaction(txn)
+
+
+def apply_move(game, move, move_seq=None, fingerprint=None):
+    """Apply move, a function from a GameState to an engine.MoveResult, to
+    the game and store the outcome. move_seq is the version of the game
+    the client moved on and fingerprint tells its moves apart. Returns the
+    MoveResult, or None if the move kept losing races with other moves on
+    the game. Raises StaleMoveError."""
+    client = memcache.Client()
+    key = _cache_key(game.key)
+    stored_state, stored_version = game.to_state(), game.version
+    for attempt in range(CAS_RETRIES):
+        entry = client.gets(key, namespace=NAMESPACE)
+        cached = _cached(entry, stored_state, stored_version)
+        if cached is None:
+            cached = _fresh(stored_state), stored_version, time.time()
+        state, version, saved_at = cached
+        if move_seq is not None and move_seq != version:
+            replayed = _replay(game, move_seq, fingerprint, state, version)
+            if replayed is not None:
+                return replayed
+            raise StaleMoveError(version)
+        result = move(state)
+        game.set_state(result.state)
+        game.version = version
+        if not result.effects:
+            return result
+        game.version = version + 1
+        if engine.END_GAME in result.effects:
+            if game.end_game(version):
+                client.delete(key, namespace=NAMESPACE)
+                if move_seq is not None:
+                    _record(game, move_seq, fingerprint, result)
+                return result
+            newer = game.key.get(use_cache=False)
+        else:
+            # the cache entry decides which of racing moves comes first
+            now = time.time()
+            durable = (result.state.round_remain != stored_state.round_remain
+                       or now - saved_at >= FLUSH_AFTER)
+            value = (game.version, game.round_remain,
+                     now if durable else saved_at,
+                     codec.encode_state(result.state), result.state.draw)
+            if entry is None:
+                claimed = client.add(key, value, time=ENTRY_TTL,
+                                     namespace=NAMESPACE)
+                if not claimed and client.gets(
+                        key, namespace=NAMESPACE) is None:
+                    # memcache is unavailable, write the move through
+                    claimed = durable = True
+            else:
+                claimed = client.cas(key, value, time=ENTRY_TTL,
+                                     namespace=NAMESPACE)
+            newer = None
+            if claimed and durable:
+                stored = False
+                try:
+                    newer = _put_if_current(game, version)
+                    stored = newer is None
+                finally:
+                    if not stored:
+                        # the entry holds a move the store did not take
+                        client.delete(key, namespace=NAMESPACE)
+            if claimed and newer is None:
+                if move_seq is not None:
+                    _record(game, move_seq, fingerprint, result)
+                return result
+        if newer is not None:
+            # another move was stored first, start over from it
+            stored_state, stored_version = newer.to_state(), newer.version
+        game.set_state(stored_state)
+        game.version = stored_version
+    return None
@@ -0,0 +1,230 @@
+"""instrument.py - Sampled latency, RPC and cache statistics of API methods.
+
+For a INSTRUMENT_SAMPLE_RATE share of calls, @instrumented records the wall
+time, datastore RPCs and bytes, cache hits and misses of an API method
+into histograms kept in the instance, and the time the framework then
+takes to encode its response, timed by a wrapper of
+protojson.ProtoJson.encode_message that only times that response. They
+are logged as a JSON line every DUMP_INTERVAL seconds and served by
+/admin/api_stats (see main.py). A call that is not sampled costs a count
+under the lock and one random draw. Nothing is counted when the rate is
+0."""
+import functools
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from protorpc import protojson
+
+import settings
+
+DUMP_INTERVAL = 60
+# histogram buckets are powers of _GROWTH times _SMALLEST
+_SMALLEST = 0.01
+_GROWTH = 1.1
+
+_local = threading.local()
+_lock = threading.Lock()
+_methods = {}
+_hooks_installed = []
+_last_dump = [time.time()]
+
+
+class Histogram(object):
+    """Counts of values in buckets growing by 10%, so percentiles are
+    within 10% of the value"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        if value <= _SMALLEST:
+            bucket = 0
+        else:
+            bucket = int(math.ceil(math.log(value / _SMALLEST, _GROWTH)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile, None if
+        empty"""
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return _SMALLEST * _GROWTH ** bucket
+        return None
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class MethodStats(object):
+    """Histograms of the sampled calls of one method"""
+    METRICS = ('wall_ms', 'datastore_rpcs', 'datastore_bytes',
+               'serialize_ms')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.histograms = dict((metric, Histogram())
+                               for metric in self.METRICS)
+
+    def to_dict(self):
+        wall = self.histograms['wall_ms']
+        stats = {'calls': self.calls, 'sampled': wall.count,
+                 'errors': self.errors, 'cache_hits': self.cache_hits,
+                 'cache_misses': self.cache_misses}
+        for percent in (50, 95, 99):
+            stats['p%d_ms' % percent] = wall.percentile(percent)
+        for metric in self.METRICS:
+            stats['mean_' + metric] = self.histograms[metric].mean()
+        return stats
+
+
+class _Sample(object):
+    __slots__ = ('rpcs', 'rpc_bytes', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.rpcs = 0
+        self.rpc_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def _pre_call(service, call, request, response):
+    sample = getattr(_local, 'sample', None)
+    if sample is not None and service == 'datastore_v3':
+        sample.rpcs += 1
+        sample.rpc_bytes += request.ByteSize()
+
+
+def _post_call(service, call, request, response):
+    sample = getattr(_local, 'sample', None)
+    if sample is None:
+        return
+    if service == 'datastore_v3':
+        sample.rpc_bytes += response.ByteSize()
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        sample.cache_hits += hits
+        sample.cache_misses += request.key_size() - hits
+
+
+_encode_message = protojson.ProtoJson.encode_message
+
+
+def _timed_encode_message(protocol, message):
+    """ProtoJson.encode_message, timing the encoding of a sampled call's
+    response"""
+    pending = getattr(_local, 'encoding', None)
+    if pending is None or pending[1] is not message:
+        return _encode_message(protocol, message)
+    _local.encoding = None
+    start = time.time()
+    try:
+        return _encode_message(protocol, message)
+    finally:
+        serialize = time.time() - start
+        stats = _method_stats(pending[0])
+        with _lock:
+            stats.histograms['serialize_ms'].add(1000 * serialize)
+
+
+def _install_hooks():
+    with _lock:
+        if not _hooks_installed:
+            proxy = apiproxy_stub_map.apiproxy
+            proxy.GetPreCallHooks().Append('instrument', _pre_call)
+            proxy.GetPostCallHooks().Append('instrument', _post_call)
+            protojson.ProtoJson.encode_message = _timed_encode_message
+            _hooks_installed.append(True)
+
+
+def count_cache(hits, misses):
+    """Count lookups of an in-process cache in the call being sampled"""
+    sample = getattr(_local, 'sample', None)
+    if sample is not None:
+        sample.cache_hits += hits
+        sample.cache_misses += misses
+
+
+def _method_stats(name):
+    stats = _methods.get(name)
+    if stats is None:
+        with _lock:
+            stats = _methods.setdefault(name, MethodStats())
+    return stats
+
+
+def _record(name, wall, sample, failed):
+    stats = _method_stats(name)
+    with _lock:
+        stats.errors += failed
+        stats.cache_hits += sample.cache_hits
+        stats.cache_misses += sample.cache_misses
+        stats.histograms['wall_ms'].add(1000 * wall)
+        stats.histograms['datastore_rpcs'].add(sample.rpcs)
+        stats.histograms['datastore_bytes'].add(sample.rpc_bytes)
+    if time.time() - _last_dump[0] >= DUMP_INTERVAL:
+        _last_dump[0] = time.time()
+        dump()
+
+
+def snapshot():
+    """Return {method name: statistics} of this instance"""
+    with _lock:
+        return dict((name, stats.to_dict())
+                    for name, stats in _methods.items())
+
+
+def dump():
+    """Log the statistics as one JSON line"""
+    logging.info('api_stats %s', json.dumps(snapshot(), sort_keys=True))
+
+
+def reset():
+    with _lock:
+        _methods.clear()
+
+
+def instrumented(method):
+    """Decorator of API methods, see the module docstring"""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(service, request):
+        rate = settings.INSTRUMENT_SAMPLE_RATE
+        if not rate:
+            return method(service, request)
+        stats = _method_stats(name)
+        with _lock:
+            stats.calls += 1
+        if random.random() >= rate:
+            return method(service, request)
+        _install_hooks()
+        sample = _local.sample = _Sample()
+        start = time.time()
+        response = None
+        try:
+            response = method(service, request)
+            return response
+        finally:
+            wall = time.time() - start
+            _local.sample = None
+            _local.encoding = None
+            if response is not None:
+                # the framework encodes it next, on this thread
+                _local.encoding = (name, response)
+            _record(name, wall, sample, response is None)
+    return wrapper
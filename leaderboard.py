@@ -0,0 +1,137 @@
+"""leaderboard.py - Top scores kept up to date as games end.
+
+Each time window (all time, the week or the day of Score.date) has one
+Leaderboard entity holding its top LEADERBOARD_SIZE scores with the user
+names copied in, cached in memcache. Game.end_game offers every new score
+with record_score, which only writes when the score makes the board, so
+reading a board is one memcache get (or one datastore get on a miss).
+
+A read only fills the cache when it holds no board, and a write merges the
+board it committed into the cached one with compare-and-set. Entries are
+only ever added, so a read that loaded the board before a write cannot
+put the older board back, nor can racing writes drop each other's
+entries."""
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import models
+from settings import LEADERBOARD_SIZE
+
+ALL_TIME = 'ALL_TIME'
+WEEKLY = 'WEEKLY'
+DAILY = 'DAILY'
+WINDOWS = (ALL_TIME, WEEKLY, DAILY)
+# memcache lifetime of a board, in seconds
+_CACHE_TIME = {ALL_TIME: 24 * 3600, WEEKLY: 8 * 24 * 3600,
+               DAILY: 2 * 24 * 3600}
+NAMESPACE = 'leaderboard'
+CAS_RETRIES = 5
+
+
+class Leaderboard(ndb.Model):
+    """Leaderboard -- top scores of a time window, best first. Each entry
+    is [result, user name, date string, Score id]"""
+    entries = ndb.JsonProperty(default=[])
+
+
+def board_id(window, day):
+    """Return the id of the window's board for a date"""
+    if window == ALL_TIME:
+        return 'all-time'
+    if window == WEEKLY:
+        year, week, weekday = day.isocalendar()
+        return 'weekly-%d-%02d' % (year, week)
+    return 'daily-%s' % day
+
+
+def _sort(entries):
+    """Order entries best first, dropping duplicates and the overflow"""
+    entries = dict((entry[3], entry) for entry in entries).values()
+    entries.sort(key=lambda entry: (-entry[0], entry[2]))
+    return entries[:LEADERBOARD_SIZE]
+
+
+def _rebuild(window, day):
+    """Build a board from the Score entities"""
+    query = models.Score.query()
+    if window == ALL_TIME:
+        scores = query.order(-models.Score.result).fetch(LEADERBOARD_SIZE)
+    elif window == DAILY:
+        scores = query.filter(models.Score.date == day).order(
+            -models.Score.result).fetch(LEADERBOARD_SIZE)
+    else:
+        # the week's best are among the best of its days
+        monday = day - timedelta(days=day.weekday())
+        entries = []
+        for i in range(7):
+            entries.extend(get_board(DAILY, monday + timedelta(days=i)))
+        return _sort(entries)
+    users = models.get_users(score.user for score in scores)
+    return _sort([[score.result, users[score.user].name, str(score.date),
+                   score.key.id()]
+                  for score in scores if users[score.user]])
+
+
+def get_board(window, day):
+    """Return the entries of the window's board for a date"""
+    key = board_id(window, day)
+    entries = memcache.get(key, namespace=NAMESPACE)
+    if entries is not None:
+        return entries
+    board = Leaderboard.get_by_id(key)
+    if board is None:
+        entries = _rebuild(window, day)
+        Leaderboard(id=key, entries=entries).put()
+    else:
+        entries = board.entries
+    # a board cached since the get is at least as new as this one
+    memcache.add(key, entries, time=_CACHE_TIME[window], namespace=NAMESPACE)
+    return entries
+
+
+def _qualifies(entries, result):
+    return (len(entries) < LEADERBOARD_SIZE or
+            result > entries[LEADERBOARD_SIZE - 1][0])
+
+
+@ndb.transactional
+def _add_entry(key, entry):
+    """Add the entry to the stored board, returns the committed entries or
+    None if the board was left as it is"""
+    board = Leaderboard.get_by_id(key)
+    if board is None or not _qualifies(board.entries, entry[0]):
+        # a missing board is rebuilt from the scores on its next read
+        return None
+    board.entries = _sort(board.entries + [entry])
+    board.put()
+    return board.entries
+
+
+def _cache_entries(key, window, entries):
+    """Merge committed entries into the cached board"""
+    client = memcache.Client()
+    for attempt in range(CAS_RETRIES):
+        cached = client.gets(key, namespace=NAMESPACE)
+        if cached is None:
+            if client.add(key, entries, time=_CACHE_TIME[window],
+                          namespace=NAMESPACE):
+                return
+        elif client.cas(key, _sort(cached + entries),
+                        time=_CACHE_TIME[window], namespace=NAMESPACE):
+            return
+    # the next read loads the committed board
+    memcache.delete(key, namespace=NAMESPACE)
+
+
+def record_score(score, user_name):
+    """Offer a new, already stored Score to each window's board"""
+    entry = [score.result, user_name, str(score.date), score.key.id()]
+    for window in WINDOWS:
+        if not _qualifies(get_board(window, score.date), score.result):
+            continue
+        key = board_id(window, score.date)
+        entries = _add_entry(key, entry)
+        if entries is not None:
+            _cache_entries(key, window, entries)
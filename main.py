@@ -2,38 +2,95 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import json
 import logging
 
 import webapp2
-from google.appengine.api import mail, app_identity
 from api import YahtzeeGameApi
-
-from models import User
-from models import Game
+import counters
+import instrument
+import rankings
+import reminders
+import stats
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
         """Send a reminder email to each User with an email about games.
         Called every 24 hours using a cron job"""
-        app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-        for user in users:
-            num_games = Game.query(
-                        Game.user == user.key).filter(
-                        Game.game_over == False).count()
-            if num_games > 0:
-                subject = 'This is a reminder!'
-                body = 'Hello {}, try out Yahtzee Game, \
-                you have {} games to complete!'.format(user.name, num_games)
-                # This will send test emails, the arguments to send_mail are:
-                # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                               user.email,
-                               subject,
-                               body)
+        reminders.start()
+
+
+class ReminderFanOutTask(webapp2.RequestHandler):
+    def post(self):
+        """Enqueue reminder batches for the next page of users"""
+        reminders.fan_out(self.request.get('cursor') or None)
+
+
+class SendRemindersTask(webapp2.RequestHandler):
+    def post(self):
+        """Send the reminders of a batch of users"""
+        reminders.send_batch(self.request.get('keys').split(','),
+                             attempt=int(self.request.get('attempt') or 1))
+
+
+class BuildRankBuckets(webapp2.RequestHandler):
+    def get(self):
+        """Start counting users per max_score for rank lookups.
+        Called every hour using a cron job"""
+        rankings.start_build()
+
+
+class BuildRankBucketsTask(webapp2.RequestHandler):
+    def post(self):
+        """Count the next batch of users of a rank bucket build"""
+        rankings.build_step()
+
+
+class RepairActiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild every User's active game list from the games.
+        Called every week using a cron job"""
+        counters.start_repair()
+
+
+class RepairActiveGamesTask(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the active game lists of the next batch of users"""
+        counters.repair_step(self.request.get('cursor') or None)
+
+
+class BackfillUserStats(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild every User's stats from the completed games, or with
+        resume=1 carry on with the backfill in progress"""
+        stats.start_backfill(resume=bool(self.request.get('resume')))
+        self.response.write('Backfill of user stats started.')
+
+
+class BackfillUserStatsTask(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the stats of the next batch of users"""
+        stats.backfill_step()
+
+
+class ApiStats(webapp2.RequestHandler):
+    def get(self):
+        """Return the latency percentiles and costs of each API method
+        sampled by this instance"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrument.snapshot(), sort_keys=True))
 
 
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    (reminders.FAN_OUT_URL, ReminderFanOutTask),
+    (reminders.SEND_URL, SendRemindersTask),
+    ('/crons/build_rank_buckets', BuildRankBuckets),
+    (rankings.BUILD_URL, BuildRankBucketsTask),
+    ('/crons/repair_active_games', RepairActiveGames),
+    (counters.REPAIR_URL, RepairActiveGamesTask),
+    ('/admin/backfill_user_stats', BackfillUserStats),
+    (stats.BACKFILL_URL, BackfillUserStatsTask),
+    ('/admin/api_stats', ApiStats),
 ], debug=True)
@@ -2,15 +2,24 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import array
 import httplib
+import math
+import os
+import threading
 import endpoints
-from datetime import date
 from datetime import datetime
 from protorpc import messages
 from protorpc import message_types
 from google.appengine.ext import ndb
 from google.appengine.ext.ndb import msgprop
 
+import codec
+import engine
+import instrument
+import leaderboard
+import play
+
 
 class CardCategory(messages.Enum):
     """CardCategory -- Game Card Category"""
@@ -32,6 +41,9 @@ class CardCategory(messages.Enum):
     LOWER_SCORE = 15
     TOTAL = 16
 # CATEGORIES = [0, 1, 2, 3, 4, 5, 8, 9, 10, 11, 12, 13, 14]
+CATEGORY_NAMES = [CardCategory(i).name for i in range(play.TOTAL + 1)]
+# GameForm field of each score card slot
+CARD_FIELDS = [name.lower() for name in CATEGORY_NAMES]
 
 
 # --------------------------------------------------------
@@ -42,110 +54,338 @@ class User(ndb.Model):
     email = ndb.StringProperty()
     max_score = ndb.IntegerProperty(default=-1)
     games_completed = ndb.IntegerProperty(default=0)
-
-    def to_perf_form(self):
+    active_game_keys = ndb.KeyProperty(
+        kind='Game', repeated=True, indexed=False)
+    active_games = ndb.ComputedProperty(
+        lambda self: len(self.active_game_keys))
+
+    def add_active_game(self, key):
+        """Count a game the user started"""
+        if key not in self.active_game_keys:
+            self.active_game_keys.append(key)
+
+    def remove_active_game(self, key):
+        """Stop counting a game that ended or was cancelled"""
+        if key in self.active_game_keys:
+            self.active_game_keys.remove(key)
+
+    def to_perf_form(self, rank=None):
         """Return a user performance form"""
         form = UserPerfForm()
         form.name = self.name
         form.max_score = self.max_score
         form.games_completed = self.games_completed
+        form.rank = rank
         return form
 
 
+# Users fetched during the current request
+_request_local = threading.local()
+
+
+def _user_cache():
+    """Return the User cache of the current request"""
+    request_id = os.environ.get('REQUEST_LOG_ID')
+    if getattr(_request_local, 'request_id', None) != request_id:
+        _request_local.request_id = request_id
+        _request_local.users = {}
+    return _request_local.users
+
+
+def get_users(keys):
+    """Return a {key: User} map of the keys, fetching the users not seen
+    in this request with a single get_multi"""
+    return get_users_async(keys).get_result()
+
+
+@ndb.tasklet
+def get_users_async(keys):
+    """Future of get_users"""
+    cache = _user_cache()
+    keys = set(keys)
+    missing = [key for key in keys if key not in cache]
+    instrument.count_cache(len(keys) - len(missing), len(missing))
+    if missing:
+        users = yield ndb.get_multi_async(missing)
+        for key, user in zip(missing, users):
+            # keep a user written by this request while the get ran
+            cache.setdefault(key, user)
+    raise ndb.Return(dict((key, cache[key]) for key in keys))
+
+
+def get_user(key):
+    """Return the User of a key, fetched at most once per request"""
+    return get_user_async(key).get_result()
+
+
+@ndb.tasklet
+def get_user_async(key):
+    """Future of get_user"""
+    users = yield get_users_async([key])
+    raise ndb.Return(users[key])
+
+
+def remember_user(user):
+    """Replace the cached User of the request after writing it"""
+    _user_cache()[user.key] = user
+
+
 class UserPerfForm(messages.Message):
     """UserPerfForm -- Show user's performance"""
     name = messages.StringField(1, required=True)
     max_score = messages.IntegerField(2, required=True)
     games_completed = messages.IntegerField(3, required=True)
+    rank = messages.IntegerField(4)
 
 
 class UsersRankingForm(messages.Message):
     """UsersRankingForm -- List the ranking of users"""
     items = messages.MessageField(UserPerfForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class UserRankForm(messages.Message):
+    """UserRankForm -- a user's position in the rankings"""
+    user = messages.MessageField(UserPerfForm, 1, required=True)
+    ranked_users = messages.IntegerField(2, required=True)
+    message = messages.StringField(3)
 
 
 # --------------------------------------------------------
 # Game
 class Game(ndb.Model):
-    """Game -- Game object"""
+    """Game -- Game object. The dice, score card and history are packed
+    into state (see codec.py), only user, round_remain, game_over and
+    ended are indexed"""
     user = ndb.KeyProperty(required=True, kind='User')
     round_remain = ndb.IntegerProperty(required=True)
-    roll_remain = ndb.IntegerProperty(required=True)
     game_over = ndb.BooleanProperty(required=True, default=False)
-    dice = ndb.IntegerProperty(repeated=True)  # list of Integer
-    score_card = ndb.IntegerProperty(repeated=True)  # list of cat score
-    cat_history = msgprop.EnumProperty(
-                CardCategory, repeated=True)
-    dice_history = ndb.StringProperty(repeated=True)
+    # when the game was recorded by end_game, see export.py
+    ended = ndb.DateTimeProperty()
+    state = ndb.BlobProperty()
+    # number of moves made, see hotstate.py
+    version = ndb.IntegerProperty(default=0, indexed=False)
+    # games written before the packed state, moved into it on their next put
+    legacy_roll_remain = ndb.IntegerProperty('roll_remain', indexed=False)
+    legacy_dice = ndb.IntegerProperty('dice', repeated=True, indexed=False)
+    legacy_score_card = ndb.IntegerProperty(
+        'score_card', repeated=True, indexed=False)
+    legacy_cat_history = msgprop.EnumProperty(
+        CardCategory, 'cat_history', repeated=True, indexed=False)
+    legacy_dice_history = ndb.StringProperty(
+        'dice_history', repeated=True, indexed=False)
+    legacy_seed = ndb.IntegerProperty('seed', indexed=False)
+    legacy_roll_log = ndb.StringProperty(
+        'roll_log', repeated=True, indexed=False)
+
+    def _game_state(self):
+        """The decoded engine.GameState, kept on the entity until put"""
+        state = getattr(self, '_decoded', None)
+        if state is None:
+            if self.state:
+                state = codec.decode_state(self.state)
+            else:
+                # rounds scored in a total, before totals were refused, have
+                # no category the packed history can hold and are left out
+                rounds = [(dice, int(cat)) for dice, cat in zip(
+                    self.legacy_dice_history, self.legacy_cat_history)
+                    if int(cat) in play.CATEGORY_INDEX]
+                state = engine.GameState(
+                    roll_remain=self.legacy_roll_remain or 0,
+                    dice=list(self.legacy_dice),
+                    score_card=list(self.legacy_score_card) or None,
+                    cat_history=[cat for dice, cat in rounds],
+                    dice_history=[dice for dice, cat in rounds],
+                    seed=self.legacy_seed, roll_log=list(self.legacy_roll_log))
+            self._decoded = state
+        state.round_remain = self.round_remain
+        state.game_over = self.game_over
+        return state
+
+    def _pre_put_hook(self):
+        self.state = codec.encode_state(self._game_state())
+        self.legacy_roll_remain = None
+        self.legacy_dice = []
+        self.legacy_score_card = []
+        self.legacy_cat_history = []
+        self.legacy_dice_history = []
+        self.legacy_seed = None
+        self.legacy_roll_log = []
+
+    def _state_property(name):
+        def get(self):
+            return getattr(self._game_state(), name)
+
+        def set(self, value):
+            setattr(self._game_state(), name, value)
+        return property(get, set)
+
+    roll_remain = _state_property('roll_remain')
+    dice = _state_property('dice')
+    score_card = _state_property('score_card')
+    dice_history = _state_property('dice_history')
+    seed = _state_property('seed')
+    roll_log = _state_property('roll_log')
+    del _state_property
+
+    @property
+    def cat_history(self):
+        return [CardCategory(cat) for cat in self._game_state().cat_history]
 
     @classmethod
     def new_game(cls, user):
         """Createes and returns a new game"""
-        game = Game(
-            user=user, round_remain=13, roll_remain=3, score_card=[-1]*17)
-        game.put()
+        game = Game(user=user)
+        game.set_state(engine.new_state())
+
+        @ndb.tasklet
+        def txn():
+            # store the game and count it on its user together
+            player, key = yield user.get_async(), game.put_async()
+            player.add_active_game(key)
+            yield player.put_async()
+            raise ndb.Return(player)
+        remember_user(ndb.transaction_async(txn, xg=True).get_result())
         return game
 
-    def to_form(self, message):
-        """Returns a GameForm representation of the Game"""
+    def cancel(self):
+        """Delete an active game, returns False if it is over"""
+        @ndb.tasklet
+        def txn():
+            game, user = yield self.key.get_async(), self.user.get_async()
+            if not game or game.game_over:
+                raise ndb.Return(None)
+            user.remove_active_game(self.key)
+            yield user.put_async(), self.key.delete_async()
+            raise ndb.Return(user)
+        user = ndb.transaction_async(txn, xg=True).get_result()
+        if user is None:
+            return False
+        remember_user(user)
+        return True
+
+    def to_state(self):
+        """Return the engine.GameState of the game"""
+        return self._game_state().copy()
+
+    def set_state(self, state):
+        """Copy an engine.GameState onto the game"""
+        self._decoded = state.copy()
+        self.round_remain = state.round_remain
+        self.game_over = state.game_over
+
+    def open_scores(self):
+        """Return [(category, points)] of the dice in the categories not
+        scored yet"""
+        return self._game_state().open_scores()
+
+    def replay_dice_history(self):
+        """Rebuild dice_history from the seed and roll log"""
+        history = play.replay_dice_history(self.seed, self.roll_log)
+        return history[:len(self.dice_history)]
+
+    def to_form(self, message, user=None):
+        """Returns a GameForm representation of the Game. Pass the user
+        when it is already loaded"""
+        return self.to_form_async(message, user).get_result()
+
+    @ndb.tasklet
+    def to_form_async(self, message, user=None):
+        """Future of to_form, fetching the user alongside other calls"""
+        if user is None:
+            user = yield get_user_async(self.user)
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = user.name
         form.round_remain = self.round_remain
         form.roll_remain = self.roll_remain
         form.game_over = self.game_over
         form.dice = self.dice
-        form.ones = self.score_card[0]
-        form.twos = self.score_card[1]
-        form.threes = self.score_card[2]
-        form.fours = self.score_card[3]
-        form.fives = self.score_card[4]
-        form.sixes = self.score_card[5]
-        form.upper_score = self.score_card[6]
-        form.upper_bonus = self.score_card[7]
-        form.three_of_a_kind = self.score_card[8]
-        form.four_of_a_kind = self.score_card[9]
-        form.full_house = self.score_card[10]
-        form.small_straight = self.score_card[11]
-        form.large_straight = self.score_card[12]
-        form.yahtzee = self.score_card[13]
-        form.chance = self.score_card[14]
-        form.lower_score = self.score_card[15]
-        form.total = self.score_card[16]
+        for name, points in zip(CARD_FIELDS, self.score_card):
+            setattr(form, name, points)
+        form.version = self.version
         form.message = message
-        return form
-
-    def end_game(self):
-        """Record game when it reaches the end round"""
+        raise ndb.Return(form)
+
+    def end_game(self, base_version=None):
+        """Record game when it reaches the end round. The game, its Score,
+        the user's results and UserStats are written in one transaction,
+        which does nothing if the game was already recorded or, given
+        base_version, was stored past it. Returns whether the game was
+        recorded."""
+        return self.end_game_async(base_version).get_result()
+
+    @ndb.tasklet
+    def end_game_async(self, base_version=None):
+        """Future of end_game"""
         self.game_over = True
-        self.put()
+        self.ended = datetime.utcnow()
         total_score = self.score_card[16]
-        score = Score(user=self.user, date=date.today(), result=total_score)
-        score.put()
-        user = User.query(User.key == self.user).get()
-        # record max score
-        if total_score > user.max_score:
-            user.max_score = total_score
-        # count game completed
-        user.games_completed += 1
-        user.put()
-
-    def to_history_form(self):
-        """Return history of the game to form"""
-        form = GameHistoryForm()
-        # get current history records length
-        length = len(self.dice_history)
-        for i in range(0, length):
-            history = GameHistory()
-            history.dice = self.dice_history[i]
-            history.category = self.cat_history[i].name
-            if i is 0:
-                form_list = [history]
-            else:
-                form_list.append(history)
-        form.items = [item for item in form_list]
+        score = Score(key=Score.key_for(self.key), user=self.user,
+                      date=self.ended.date(), result=total_score)
+        state = self._game_state()
+        stats_key = UserStats.key_for(self.user)
+
+        @ndb.tasklet
+        def txn():
+            stored, user, stats = yield (self.key.get_async(),
+                                         self.user.get_async(),
+                                         stats_key.get_async())
+            if stored and (stored.game_over or base_version is not None and
+                           stored.version > base_version):
+                raise ndb.Return(None)
+            # record max score
+            if total_score > user.max_score:
+                user.max_score = total_score
+            # count game completed
+            user.games_completed += 1
+            user.remove_active_game(self.key)
+            stats = stats or UserStats(key=stats_key)
+            stats.add_game(state.score_card, state.cat_history)
+            yield ndb.put_multi_async([self, score, user, stats])
+            raise ndb.Return(user)
+        user = yield ndb.transaction_async(txn, xg=True)
+        if user is None:
+            raise ndb.Return(False)
+        remember_user(user)
+        leaderboard.record_score(score, user.name)
+        raise ndb.Return(True)
+
+    def history(self, offset=0, limit=play.ROUNDS):
+        """Return (dice_history, cat_history, rounds played) of rounds
+        [offset, offset + limit), with category numbers. Sliced from the
+        packed state without decoding it unless it is already"""
+        if getattr(self, '_decoded', None) is None and self.state:
+            dice_history, cat_history = codec.history_slice(
+                self.state, offset, limit)
+            return dice_history, cat_history, codec.history_length(
+                self.state)
+        state = self._game_state()
+        end = offset + limit
+        return (state.dice_history[offset:end], state.cat_history[offset:end],
+                len(state.dice_history))
+
+    def _history_page(self, form, offset, rounds, shown):
+        form.rounds = rounds
+        if offset + shown < rounds:
+            form.next_offset = offset + shown
         return form
 
+    def to_history_form(self, offset=0, limit=play.ROUNDS):
+        """Return rounds [offset, offset + limit) of the game's history"""
+        dice_history, cat_history, rounds = self.history(offset, limit)
+        form = GameHistoryForm(items=[
+            GameHistory(dice=dice, category=CATEGORY_NAMES[category])
+            for dice, category in zip(dice_history, cat_history)])
+        return self._history_page(form, offset, rounds, len(dice_history))
+
+    def to_compact_history_form(self, offset=0, limit=play.ROUNDS):
+        """Return rounds [offset, offset + limit) of the game's history as
+        a CompactHistoryForm"""
+        dice_history, cat_history, rounds = self.history(offset, limit)
+        form = CompactHistoryForm(dice=dice_history, categories=cat_history)
+        return self._history_page(form, offset, rounds, len(dice_history))
+
 
 class GameForm(messages.Message):
     """GameForm -- for outbound game state information"""
@@ -173,6 +413,7 @@ class GameForm(messages.Message):
     lower_score = messages.IntegerField(22)
     total = messages.IntegerField(23)
     message = messages.StringField(24)
+    version = messages.IntegerField(25)
 
 
 class GameForms(messages.Message):
@@ -183,12 +424,79 @@ class GameForms(messages.Message):
 class ChooseDiceForm(messages.Message):
     """"Used to choose the index of dice kept for next roll"""
     index_chosen = messages.IntegerField(1, repeated=True)
+    move_seq = messages.IntegerField(2)
 
 
 class ChooseCatForm(messages.Message):
     """Used to choose the category after each round"""
     category = messages.EnumField(
         'CardCategory', 1, required=True)
+    move_seq = messages.IntegerField(2)
+
+
+class HintForm(messages.Message):
+    """HintForm -- the best move for the current round of a game"""
+    index_chosen = messages.IntegerField(1, repeated=True)
+    category = messages.EnumField('CardCategory', 2)
+    expected_score = messages.FloatField(3, required=True)
+    message = messages.StringField(4)
+
+
+class CategoryScoreForm(messages.Message):
+    """CategoryScoreForm -- points the dice would score in a category"""
+    category = messages.EnumField('CardCategory', 1, required=True)
+    points = messages.IntegerField(2, required=True)
+
+
+class CategoryScoresForm(messages.Message):
+    """CategoryScoresForm -- points of every category still open"""
+    items = messages.MessageField(CategoryScoreForm, 1, repeated=True)
+    message = messages.StringField(2)
+
+
+class MoveForm(messages.Message):
+    """MoveForm -- a move of a batch: choosing category, or else rolling
+    the dice not kept"""
+    index_chosen = messages.IntegerField(1, repeated=True)
+    category = messages.EnumField('CardCategory', 2)
+
+
+class MovesForm(messages.Message):
+    """MovesForm -- inbound moves to make in order on a game"""
+    moves = messages.MessageField(MoveForm, 1, repeated=True)
+    move_seq = messages.IntegerField(2)
+
+
+class GameMovesForm(messages.Message):
+    """GameMovesForm -- inbound moves to make in order on one of many
+    games"""
+    urlsafe_game_key = messages.StringField(1, required=True)
+    moves = messages.MessageField(MoveForm, 2, repeated=True)
+    move_seq = messages.IntegerField(3)
+
+
+class GamesMovesForm(messages.Message):
+    """GamesMovesForm -- multiple GameMovesForm container"""
+    items = messages.MessageField(GameMovesForm, 1, repeated=True)
+
+
+class MoveStepForm(messages.Message):
+    """MoveStepForm -- outcome of a move of a batch"""
+    applied = messages.BooleanField(1, required=True)
+    dice = messages.IntegerField(2, repeated=True)
+    points = messages.IntegerField(3)
+    message = messages.StringField(4)
+
+
+class MovesResultForm(messages.Message):
+    """MovesResultForm -- the moves made on a game and its new state"""
+    game = messages.MessageField(GameForm, 1, required=True)
+    steps = messages.MessageField(MoveStepForm, 2, repeated=True)
+
+
+class MovesResultForms(messages.Message):
+    """MovesResultForms -- multiple MovesResultForm container"""
+    items = messages.MessageField(MovesResultForm, 1, repeated=True)
 
 
 class GameHistory(messages.Message):
@@ -198,22 +506,43 @@ class GameHistory(messages.Message):
 
 
 class GameHistoryForm(messages.Message):
-    """GameHistoryForm -- return detailed record of the whole game"""
+    """GameHistoryForm -- return detailed record of the whole game, or of
+    a page of its rounds with the number of rounds played and the offset
+    of the next page"""
     items = messages.MessageField(GameHistory, 1, repeated=True)
+    rounds = messages.IntegerField(2)
+    next_offset = messages.IntegerField(3)
+
+
+class CompactHistoryForm(messages.Message):
+    """CompactHistoryForm -- the rounds of GameHistoryForm as the dice of
+    each round packed into a string of faces and the CardCategory numbers
+    chosen"""
+    dice = messages.StringField(1, repeated=True)
+    categories = messages.IntegerField(2, repeated=True)
+    rounds = messages.IntegerField(3)
+    next_offset = messages.IntegerField(4)
 
 
 # --------------------------------------------------------
 # Score
 class Score(ndb.Model):
-    """Score -- record of each game"""
+    """Score -- record of each game, a child of its Game for games ended
+    since scores were linked to them"""
     user = ndb.KeyProperty(required=True, kind='User')
     date = ndb.DateProperty(required=True)
     result = ndb.IntegerProperty(required=True)
 
-    def to_form(self):
-        """Return a score form"""
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(cls, game_key.id(), parent=game_key)
+
+    def to_form(self, users=None):
+        """Return a score form. users is a {key: User} map of prefetched
+        users, see get_users"""
         form = ScoreForm()
-        form.user_name = self.user.get().name
+        user = users[self.user] if users else get_user(self.user)
+        form.user_name = user.name
         form.date = str(self.date)
         form.result = self.result
         return form
@@ -226,11 +555,133 @@ class ScoreForm(messages.Message):
     result = messages.IntegerField(3, required=True)
 
 
+class ScoreWindow(messages.Enum):
+    """ScoreWindow -- time window of a leaderboard"""
+    ALL_TIME = 0
+    WEEKLY = 1
+    DAILY = 2
+
+
 class ScoreForms(messages.Message):
     """ScoreForms -- multiple  Scores outbound form message"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
 
 
+# --------------------------------------------------------
+# UserStats
+class ArrayProperty(ndb.BlobProperty):
+    """A fixed-size array.array of numbers stored as its bytes. Unset, it
+    reads as an array of zeros"""
+
+    def __init__(self, typecode, size, name=None, **kwds):
+        super(ArrayProperty, self).__init__(name, **kwds)
+        self._typecode = typecode
+        self._size = size
+
+    def _zeros(self):
+        return array.array(self._typecode, [0]) * self._size
+
+    def _validate(self, value):
+        if not isinstance(value, array.array) or len(value) != self._size:
+            raise TypeError('Expected an array of %s numbers, got %r'
+                            % (self._size, value))
+
+    def _to_base_type(self, value):
+        return value.tostring()
+
+    def _from_base_type(self, value):
+        values = array.array(self._typecode)
+        values.fromstring(value)
+        return values
+
+    def _get_value(self, entity):
+        value = super(ArrayProperty, self)._get_value(entity)
+        if value is None:
+            value = self._zeros()
+            self._set_value(entity, value)
+        return value
+
+
+class UserStats(ndb.Model):
+    """UserStats -- aggregates of a user's completed games, kept up by
+    Game.end_game in the user's entity group. Scores have running means
+    and M2 sums of squared deviations (Welford), per category in arrays
+    ordered as play.CATEGORIES"""
+    games = ndb.IntegerProperty(default=0, indexed=False)
+    score_mean = ndb.FloatProperty(default=0.0, indexed=False)
+    score_m2 = ndb.FloatProperty(default=0.0, indexed=False)
+    bonus_games = ndb.IntegerProperty(default=0, indexed=False)
+    category_mean = ArrayProperty('d', len(play.CATEGORIES))
+    category_m2 = ArrayProperty('d', len(play.CATEGORIES))
+    # games scoring more than 0 in the category
+    category_hits = ArrayProperty('I', len(play.CATEGORIES))
+    # sum of the rounds, from 1, the category was chosen in
+    category_rounds = ArrayProperty('I', len(play.CATEGORIES))
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, 'stats', parent=user_key)
+
+    def add_game(self, score_card, cat_history):
+        """Count a completed game by its score card and the categories in
+        the order chosen"""
+        self.games += 1
+        delta = score_card[play.TOTAL] - self.score_mean
+        self.score_mean += delta / self.games
+        self.score_m2 += delta * (score_card[play.TOTAL] - self.score_mean)
+        if score_card[play.UPPER_BONUS] > 0:
+            self.bonus_games += 1
+        means = self.category_mean
+        m2 = self.category_m2
+        for i, category in enumerate(play.CATEGORIES):
+            points = score_card[category]
+            delta = points - means[i]
+            means[i] += delta / self.games
+            m2[i] += delta * (points - means[i])
+            if points > 0:
+                self.category_hits[i] += 1
+        for round_no, category in enumerate(cat_history):
+            self.category_rounds[play.CATEGORY_INDEX[int(category)]] += (
+                round_no + 1)
+
+    def to_form(self):
+        """Return a UserStatsForm of the aggregates"""
+        def stddev(m2):
+            return math.sqrt(m2 / self.games) if self.games else 0.0
+
+        def rate(count):
+            return float(count) / self.games if self.games else 0.0
+        form = UserStatsForm(games=self.games, mean_score=self.score_mean,
+                             score_stddev=stddev(self.score_m2),
+                             bonus_rate=rate(self.bonus_games))
+        for i, category in enumerate(play.CATEGORIES):
+            form.categories.append(CategoryStatsForm(
+                category=CardCategory(category),
+                mean=self.category_mean[i],
+                stddev=stddev(self.category_m2[i]),
+                hit_rate=rate(self.category_hits[i]),
+                mean_round=rate(self.category_rounds[i])))
+        return form
+
+
+class CategoryStatsForm(messages.Message):
+    """CategoryStatsForm -- a user's results in one category"""
+    category = messages.EnumField('CardCategory', 1, required=True)
+    mean = messages.FloatField(2, required=True)
+    stddev = messages.FloatField(3, required=True)
+    hit_rate = messages.FloatField(4, required=True)
+    mean_round = messages.FloatField(5, required=True)
+
+
+class UserStatsForm(messages.Message):
+    """UserStatsForm -- statistics of a user's completed games"""
+    games = messages.IntegerField(1, required=True)
+    mean_score = messages.FloatField(2, required=True)
+    score_stddev = messages.FloatField(3, required=True)
+    bonus_rate = messages.FloatField(4, required=True)
+    categories = messages.MessageField(CategoryStatsForm, 5, repeated=True)
+
+
 # --------------------------------------------------------
 # Needed for registration
 class StringMessage(messages.Message):
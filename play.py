@@ -1,5 +1,13 @@
 """play.py - File for collecting functions for play the game."""
+import binascii
+import hashlib
+import itertools
 import random
+import threading
+try:
+    import numpy
+except ImportError:  # pragma: no cover - numpy is optional
+    numpy = None
 # Category constants
 ONES = 0
 TWOS = 1
@@ -19,11 +27,19 @@ CHANCE = 14
 LOWER_SCORE = 15
 TOTAL = 16
 TOTAL_DICE = 5
+ROUNDS = 13
+ROLLS_PER_ROUND = 3
+SEED_BITS = 48
+# Categories a player can choose, in score card order
+CATEGORIES = [ONES, TWOS, THREES, FOURS, FIVES, SIXES,
+              THREE_OF_A_KIND, FOUR_OF_A_KIND, FULL_HOUSE,
+              SMALL_STRAIGHT, LARGE_STRAIGHT, YAHTZEE, CHANCE]
 
 
 # ==============
 # Find the score for each dice rolled
-def find_score(dice, category):
+def _compute_score(dice, category):
+    """Score the dice for one category by counting the faces."""
     faces = [1, 2, 3, 4, 5, 6]
 
     # helper function
@@ -72,13 +88,163 @@ def find_score(dice, category):
     return 0
 
 
+def _build_score_table():
+    """Score every sorted 5-dice roll (252 of them) for all categories."""
+    table = {}
+    for roll in itertools.combinations_with_replacement(range(1, 7),
+                                                        TOTAL_DICE):
+        table[roll] = tuple(_compute_score(list(roll), category)
+                            for category in CATEGORIES)
+    return table
+
+# sorted dice tuple -> scores ordered as CATEGORIES
+SCORE_TABLE = _build_score_table()
+# category -> position in a SCORE_TABLE row
+CATEGORY_INDEX = dict((category, i) for i, category in enumerate(CATEGORIES))
+
+
+def score_all(dice):
+    """Return the scores of the dice for every category, ordered as
+    CATEGORIES."""
+    scores = SCORE_TABLE.get(tuple(sorted(dice)))
+    if scores is None:
+        # not a complete roll, fall back to counting
+        scores = tuple(_compute_score(list(dice), category)
+                       for category in CATEGORIES)
+    return scores
+
+
+def find_score(dice, category):
+    """Return the points the dice earn in the category."""
+    index = CATEGORY_INDEX.get(category)
+    if index is None:
+        # totals and bonus are not chosen categories
+        return 0
+    scores = SCORE_TABLE.get(tuple(sorted(dice)))
+    if scores is None:
+        return _compute_score(list(dice), category)
+    return scores[index]
+
+
+def score_batch(dice_rows):
+    """Score many rolls at once.
+
+    Args:
+        dice_rows: N x 5 array (or list of lists) of dice faces.
+    Returns:
+        N x 13 scores ordered as CATEGORIES -- a numpy array when numpy is
+        available, otherwise a list of lists.
+    """
+    if numpy is None:
+        return [list(score_all(row)) for row in dice_rows]
+    dice = numpy.asarray(dice_rows, dtype=numpy.int8).reshape(-1, TOTAL_DICE)
+    rows = dice.shape[0]
+    counts = numpy.empty((rows, 6), dtype=numpy.int8)
+    for face in range(6):
+        counts[:, face] = (dice == face + 1).sum(axis=1)
+    total = dice.sum(axis=1, dtype=numpy.int16)
+    most = counts.max(axis=1)
+    present = counts > 0
+    scores = numpy.zeros((rows, len(CATEGORIES)), dtype=numpy.int16)
+    # Upper section
+    for face in range(6):
+        scores[:, face] = counts[:, face] * (face + 1)
+    # Lower section, masks of the matched patterns
+    scores[:, 6] = numpy.where(most >= 3, total, 0)
+    scores[:, 7] = numpy.where(most >= 4, total, 0)
+    full_house = (counts == 3).any(axis=1) & (counts == 2).any(axis=1)
+    scores[:, 8] = full_house * 25
+    middle = present[:, 2] & present[:, 3]
+    small_straight = middle & (
+        (present[:, 0] & present[:, 1]) | (present[:, 1] & present[:, 4]) |
+        (present[:, 4] & present[:, 5]))
+    scores[:, 9] = small_straight * 30
+    large_straight = (most == 1) & (~present[:, 0] | ~present[:, 5])
+    scores[:, 10] = large_straight * 40
+    scores[:, 11] = (most == 5) * 50
+    scores[:, 12] = total
+    return scores
+
+
 # ==============
 # Dice
-def roll_dice(num):
-    dice = []
-    for i in range(num):
-        dice.append(random.randint(1, 6))
-    return dice
+class DiceSource(object):
+    """Seedable source of dice faces. Random bytes are drawn in bulk from
+    one RNG call and bytes of 252 and over are rejected, so each face is
+    equally likely."""
+
+    def __init__(self, seed=None, chunk_size=64):
+        self._random = random.Random(seed)
+        self._chunk_size = chunk_size
+        self._faces = []
+
+    def _random_bytes(self):
+        bits = self._random.getrandbits(8 * self._chunk_size)
+        return binascii.unhexlify('%0*x' % (2 * self._chunk_size, bits))
+
+    def roll(self, num):
+        """Return a list of num dice."""
+        while len(self._faces) < num:
+            self._faces.extend([byte % 6 + 1
+                                for byte in bytearray(self._random_bytes())
+                                if byte < 252])
+        dice = self._faces[:num]
+        del self._faces[:num]
+        return dice
+
+
+class GameDice(object):
+    """The dice of a seeded game. Every roll has its own stream, the
+    SHA-256 blocks of 'seed:round:roll:counter', or
+    'seed:round:roll:counter:draw' for a draw other than 0, so any roll can
+    be replayed from the seed and the roll log. The hash of the seed is
+    taken once and copied for each roll, so keep one GameDice per game
+    rather than one per roll."""
+    __slots__ = ('_seed_hash',)
+
+    def __init__(self, seed):
+        self._seed_hash = hashlib.sha256(('%d:' % seed).encode('ascii'))
+
+    def roll(self, num, round_no, roll_no, draw=0):
+        """Return a list of num dice for one roll of the game."""
+        faces = []
+        counter = 0
+        while len(faces) < num:
+            block = self._seed_hash.copy()
+            key = '%d:%d:%d' % (round_no, roll_no, counter)
+            if draw:
+                key += ':%d' % draw
+            block.update(key.encode('ascii'))
+            # only as many bytes as there are dice left are turned to faces
+            for byte in bytearray(block.digest()):
+                if byte < 252:
+                    faces.append(byte % 6 + 1)
+                    if len(faces) == num:
+                        return faces
+            counter += 1
+        return faces
+
+# draws of a roll, 0 to DRAWS - 1, that the roll log has room for
+DRAWS = 128
+
+# DiceSource is not thread safe, each request thread rolls from its own
+_local = threading.local()
+
+
+def _default_source():
+    source = getattr(_local, 'source', None)
+    if source is None:
+        source = _local.source = DiceSource()
+    return source
+
+
+def new_seed():
+    """Return a fresh seed for a game."""
+    return random.SystemRandom().getrandbits(SEED_BITS)
+
+
+def roll_dice(num, source=None):
+    return (source or _default_source()).roll(num)
 
 
 def choose_dice(dice, index_chosen):
@@ -92,10 +258,51 @@ def choose_dice(dice, index_chosen):
     return dice_kept
 
 
-def roll(dice_kept):
+def roll(dice_kept, source=None):
     if not dice_kept:
-        dice = roll_dice(TOTAL_DICE)
+        dice = roll_dice(TOTAL_DICE, source)
     else:
         num_dice = TOTAL_DICE - len(dice_kept)
-        dice = dice_kept + roll_dice(num_dice)
+        dice = dice_kept + roll_dice(num_dice, source)
     return dice
+
+
+# ==============
+# Replay
+def log_roll(round_no, index_chosen, draw=0):
+    """Return the roll log entry of a roll keeping index_chosen."""
+    entry = '%d:%s' % (round_no, ''.join(str(i) for i in index_chosen))
+    return entry + ':%d' % draw if draw else entry
+
+
+def parse_roll(entry):
+    """Return (round_no, index_chosen, draw) of a roll log entry."""
+    fields = entry.split(':')
+    return (int(fields[0]), [int(i) for i in fields[1]],
+            int(fields[2]) if len(fields) > 2 else 0)
+
+
+def replay_dice_history(seed, roll_log):
+    """Rebuild the final dice of each round, formatted as in
+    Game.dice_history, from a game's seed and roll log. A round still in
+    progress is included as the last item."""
+    game_dice = GameDice(seed)
+    history = []
+    dice = []
+    current_round = None
+    roll_no = 0
+    for entry in roll_log:
+        round_no, kept, draw = parse_roll(entry)
+        if round_no != current_round:
+            if current_round is not None:
+                history.append(''.join(str(num) for num in dice))
+            current_round = round_no
+            roll_no = 0
+            dice = []
+        dice_kept = choose_dice(dice, kept)
+        dice = dice_kept + game_dice.roll(TOTAL_DICE - len(dice_kept),
+                                          round_no, roll_no, draw)
+        roll_no += 1
+    if current_round is not None:
+        history.append(''.join(str(num) for num in dice))
+    return history
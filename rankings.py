@@ -0,0 +1,122 @@
+"""rankings.py - Paged user rankings and rank lookup.
+
+Users rank by max_score, then by fewer games_completed. Users equal on
+both share a rank, one more than the users ahead of them, and the next
+user's rank skips past them (1, 2, 2, 4). Pages walk the
+(max_score desc, games_completed) index with a cursor. A user's rank comes
+from RankBuckets, a count of users per max_score materialized by a task
+chain (see main.py), plus one count of the users tied on max_score that
+completed fewer games."""
+import bisect
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import models
+
+# Users counted by each task of the bucket build
+BUILD_BATCH = 20000
+BUILD_URL = '/tasks/build_rank_buckets'
+
+
+class RankBuckets(ndb.Model):
+    """RankBuckets -- number of users per max_score. 'current' is the last
+    complete build, 'building' holds a build in progress and its cursor.
+    counts is [max_score, users] sorted best first"""
+    counts = ndb.JsonProperty(default=[])
+    cursor = ndb.StringProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def ranking_query():
+    return models.User.query().order(-models.User.max_score).order(
+        models.User.games_completed)
+
+
+def encode_page_token(offset, last, cursor):
+    """Token of the page after offset users, the last of them ranked
+    last = (rank, max_score, games_completed)"""
+    return '%d:%d:%d:%d:%s' % ((offset,) + tuple(last) + (cursor.urlsafe(),))
+
+
+def decode_page_token(token):
+    """Return (offset, (rank, max_score, games_completed) of the user
+    before the page, Cursor) of a page token, raises ValueError"""
+    offset, rank, max_score, games, cursor = token.split(':', 4)
+    return (int(offset), (int(rank), int(max_score), int(games)),
+            Cursor(urlsafe=cursor))
+
+
+def page_ranks(users, offset, last=None):
+    """Return the ranks of users ranked from offset + 1 on, the user before
+    them ranked last = (rank, max_score, games_completed)"""
+    ranks = []
+    for i, user in enumerate(users):
+        if last is None or last[1:] != (user.max_score,
+                                        user.games_completed):
+            last = (offset + i + 1, user.max_score, user.games_completed)
+        ranks.append(last[0])
+    return ranks
+
+
+def get_page(page_size, token=None):
+    """Return (users, their ranks, next page token or None)"""
+    offset, last, cursor = (decode_page_token(token) if token
+                            else (0, None, None))
+    users, next_cursor, more = ranking_query().fetch_page(
+        page_size, start_cursor=cursor)
+    ranks = page_ranks(users, offset, last)
+    next_token = None
+    if more and next_cursor and users:
+        next_token = encode_page_token(
+            offset + len(users),
+            (ranks[-1], users[-1].max_score, users[-1].games_completed),
+            next_cursor)
+    return users, ranks, next_token
+
+
+def start_build():
+    """Start a new bucket build, dropping one left unfinished"""
+    RankBuckets(id='building').put()
+    taskqueue.add(url=BUILD_URL)
+
+
+def build_step():
+    """Count the next batch of users, enqueueing the following step or
+    publishing the finished buckets"""
+    building = RankBuckets.get_by_id('building')
+    if building is None:
+        return
+    counts = dict(building.counts)
+    cursor = Cursor(urlsafe=building.cursor) if building.cursor else None
+    query = models.User.query(projection=[models.User.max_score])
+    users, cursor, more = query.fetch_page(BUILD_BATCH, start_cursor=cursor)
+    for user in users:
+        counts[user.max_score] = counts.get(user.max_score, 0) + 1
+    counts = sorted(counts.items(), reverse=True)
+    if more and cursor:
+        building.counts = counts
+        building.cursor = cursor.urlsafe()
+        building.put()
+        taskqueue.add(url=BUILD_URL)
+    else:
+        RankBuckets(id='current', counts=counts).put()
+        building.key.delete()
+
+
+def get_rank(user):
+    """Return (rank, ranked users) of a user, or (None, 0) before the
+    first bucket build. Ranks as the pages do."""
+    buckets = RankBuckets.get_by_id('current')
+    if buckets is None:
+        return None, 0
+    scores = [-score for score, users in buckets.counts]
+    position = bisect.bisect_left(scores, -user.max_score)
+    ahead = sum(users for score, users in buckets.counts[:position])
+    tied_ahead = models.User.query(
+        models.User.max_score == user.max_score,
+        models.User.games_completed < user.games_completed).count(
+            keys_only=True)
+    total = sum(users for score, users in buckets.counts)
+    return ahead + tied_ahead + 1, total
@@ -0,0 +1,146 @@
+"""reminders.py - Reminder emails about games left to complete.
+
+The daily cron starts a chain of fan-out tasks. Each one walks a page of
+users with active games by cursor, enqueues send tasks of SEND_BATCH users
+and enqueues the next fan-out task. A send task reads the active game
+counts off its users and mails them through a rate-limited, retrying
+sender. Users whose mail still fails go in a new send task, at most
+SEND_ATTEMPTS times."""
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import mail_service_pb
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from google.appengine.runtime import apiproxy_errors
+
+from models import User
+
+QUEUE = 'reminders'
+FAN_OUT_URL = '/tasks/reminders/fan_out'
+SEND_URL = '/tasks/reminders/send'
+# Users walked by each fan-out task and mailed by each send task
+FAN_OUT_PAGE = 1000
+SEND_BATCH = 100
+# Send tasks a user's mail is tried in, and seconds before the first resend,
+# doubled for each one after it
+SEND_ATTEMPTS = 3
+RESEND_DELAY = 60
+# taskqueue.Queue.add takes at most this many tasks at once
+_MAX_TASKS_PER_ADD = 100
+
+
+class RateLimitedMailer(object):
+    """Sends mail at most per_second times a second, retrying transient
+    mail service errors with a growing backoff. Other errors, such as an
+    unauthorized sender, are raised for the caller to handle"""
+    TRANSIENT_ERRORS = (apiproxy_errors.DeadlineExceededError,
+                        apiproxy_errors.OverQuotaError)
+    # application errors of the mail service worth retrying
+    TRANSIENT_CODES = (mail_service_pb.MailServiceError.INTERNAL_ERROR,)
+
+    def __init__(self, sender, per_second=10, retries=3, backoff=0.5,
+                 send_mail=None, sleep=time.sleep, clock=time.time):
+        self.sender = sender
+        self.interval = 1.0 / per_second
+        self.retries = retries
+        self.backoff = backoff
+        self._send_mail = send_mail or mail.send_mail
+        self._sleep = sleep
+        self._clock = clock
+        self._next_send = 0.0
+
+    def _wait_turn(self):
+        now = self._clock()
+        if now < self._next_send:
+            self._sleep(self._next_send - now)
+            now = self._next_send
+        self._next_send = now + self.interval
+
+    def send(self, to, subject, body):
+        """Send a mail, return False if it still failed after the retries"""
+        wait = self.backoff
+        for attempt in range(self.retries):
+            self._wait_turn()
+            try:
+                self._send_mail(self.sender, to, subject, body)
+                return True
+            except mail.InvalidEmailError:
+                logging.warning('Invalid reminder address %s', to)
+                return True
+            except (self.TRANSIENT_ERRORS +
+                    (apiproxy_errors.ApplicationError,)) as error:
+                if (isinstance(error, apiproxy_errors.ApplicationError) and
+                        error.application_error not in self.TRANSIENT_CODES):
+                    raise
+                logging.warning('Reminder to %s failed: %s', to, error)
+                if attempt + 1 < self.retries:
+                    self._sleep(wait)
+                    wait *= 2
+        return False
+
+
+def _add_tasks(tasks):
+    queue = taskqueue.Queue(QUEUE)
+    for i in range(0, len(tasks), _MAX_TASKS_PER_ADD):
+        queue.add(tasks[i:i + _MAX_TASKS_PER_ADD])
+
+
+def start():
+    """Start the fan-out over all users"""
+    taskqueue.add(url=FAN_OUT_URL, queue_name=QUEUE)
+
+
+def fan_out(cursor=None):
+    """Enqueue send tasks for a page of users and the next fan-out task"""
+    query = User.query(User.active_games > 0).order(User.active_games)
+    keys, next_cursor, more = query.fetch_page(
+        FAN_OUT_PAGE, start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+        keys_only=True)
+    tasks = [taskqueue.Task(url=SEND_URL, params={
+        'keys': ','.join(key.urlsafe() for key in keys[i:i + SEND_BATCH])})
+             for i in range(0, len(keys), SEND_BATCH)]
+    if more and next_cursor:
+        tasks.append(taskqueue.Task(url=FAN_OUT_URL, params={
+            'cursor': next_cursor.urlsafe()}))
+    _add_tasks(tasks)
+    return len(keys)
+
+
+def send_batch(urlsafe_keys, mailer=None, attempt=1):
+    """Mail the users of a send task that have games to complete. Users
+    whose mail still fails are put back on the queue in a new task, unless
+    this was their last attempt. A user whose mail is refused is logged and
+    dropped, since the task must not fail and be retried once mails to
+    others have gone out."""
+    keys = [ndb.Key(urlsafe=urlsafe) for urlsafe in urlsafe_keys]
+    if mailer is None:
+        mailer = RateLimitedMailer('noreply@{}.appspotmail.com'.format(
+            app_identity.get_application_id()))
+    failed = []
+    for user in ndb.get_multi(keys):
+        if not user or not user.email or user.active_games < 1:
+            continue
+        num_games = user.active_games
+        subject = 'This is a reminder!'
+        body = ('Hello {}, try out Yahtzee Game, you have {} games to '
+                'complete!'.format(user.name, num_games))
+        try:
+            sent = mailer.send(user.email, subject, body)
+        except apiproxy_errors.ApplicationError as error:
+            logging.error('Dropped the reminder to user %s: %s',
+                          user.key.urlsafe(), error)
+            continue
+        if not sent:
+            failed.append(user.key.urlsafe())
+    if failed and attempt < SEND_ATTEMPTS:
+        _add_tasks([taskqueue.Task(
+            url=SEND_URL, countdown=RESEND_DELAY * 2 ** (attempt - 1),
+            params={'keys': ','.join(failed), 'attempt': attempt + 1})])
+    elif failed:
+        logging.error('Gave up on reminders to %d users after %d attempts',
+                      len(failed), attempt)
+    return len(keys)
@@ -2,4 +2,10 @@
 """"settings.py - user settings."""
 # Replace the following lines with client IDs obtained from the APIs
 # Console or Cloud Console.
-WEB_CLIENT_ID = '785939177767-6oiscac4v1cjvl9j7i91k0ko3d4im3pd.apps.googleusercontent.com'
\ No newline at end of file
+WEB_CLIENT_ID = '785939177767-6oiscac4v1cjvl9j7i91k0ko3d4im3pd.apps.googleusercontent.com'
+
+# Number of scores kept on each leaderboard
+LEADERBOARD_SIZE = 10
+
+# Share of API calls measured by instrument.py, 0 turns it off
+INSTRUMENT_SAMPLE_RATE = 0.01
@@ -0,0 +1,248 @@
+"""simulate.py - Self-play of complete games with engine moves.
+
+    python simulate.py --games 100000 --strategy greedy [--processes N]
+        [--seed 1] [--output results.ysim]
+
+Game i is seeded from the master seed and i, so a run is reproducible
+whatever the number of processes. Results are streamed to a columnar file
+of blocks (see write_block) and summarised with throughput at the end."""
+import argparse
+import array
+import math
+import multiprocessing
+import random
+import struct
+import sys
+import time
+
+import engine
+import play
+import solver
+
+RESULTS_MAGIC = b'YZSM'
+RESULTS_VERSION = 2
+_FILE_HEADER = struct.Struct('<4sH')
+_BLOCK_HEADER = struct.Struct('<I')
+# column name, array typecode
+COLUMNS = ([('card_%d' % category, 'b') for category in play.CATEGORIES] +
+           [('total', 'h'), ('bonus', 'b'), ('yahtzees', 'b')])
+
+
+# ==============
+# Strategies -- return ('roll', index_chosen) or ('score', category)
+def _open_categories(state):
+    return [category for category in play.CATEGORIES
+            if state.score_card[category] == -1]
+
+
+def random_strategy(state, rand):
+    """Reroll random dice half of the time, score a random category."""
+    if not state.dice:
+        return 'roll', []
+    if state.roll_remain > 0 and rand.random() < 0.5:
+        keep = rand.randint(0, play.TOTAL_DICE - 1)
+        return 'roll', sorted(rand.sample(range(play.TOTAL_DICE), keep))
+    return 'score', rand.choice(_open_categories(state))
+
+
+def greedy_strategy(state, rand):
+    """Keep the most common face, then score the open category find_score
+    rates highest."""
+    if not state.dice:
+        return 'roll', []
+    face = max(set(state.dice), key=state.dice.count)
+    if state.roll_remain > 0 and state.dice.count(face) < play.TOTAL_DICE:
+        return 'roll', [i for i, die in enumerate(state.dice) if die == face]
+    return 'score', max(_open_categories(state),
+                        key=lambda category: play.find_score(state.dice,
+                                                             category))
+
+
+def optimal_strategy(state, rand):
+    """Follow solver.advise, which needs the expected-value table."""
+    hint = solver.advise(state.score_card, state.dice, state.roll_remain)
+    if hint.category is not None:
+        return 'score', hint.category
+    return 'roll', hint.index_chosen
+
+STRATEGIES = {
+    'random': random_strategy,
+    'greedy': greedy_strategy,
+    'optimal': optimal_strategy,
+}
+
+
+# ==============
+# Games
+def game_seed(master_seed, game_no):
+    return (master_seed << 32) | game_no
+
+
+def play_game(strategy, seed):
+    """Play a game to the end and return its final GameState."""
+    state = engine.new_state(seed)
+    rand = random.Random(seed)
+    while not state.game_over:
+        action, value = strategy(state, rand)
+        if action == 'roll':
+            result = engine.roll_dice(state, value)
+        else:
+            result = engine.choose_category(state, value)
+        if not result.effects:
+            raise RuntimeError('%s refused: %s' % (action, result.message))
+        state = result.state
+    return state
+
+
+def _play_block(args):
+    """Play games [first, last) and return their result columns."""
+    strategy_name, master_seed, first, last = args
+    strategy = STRATEGIES[strategy_name]
+    columns = [array.array(typecode) for name, typecode in COLUMNS]
+    for game_no in range(first, last):
+        state = play_game(strategy, game_seed(master_seed, game_no))
+        card = state.score_card
+        values = [card[category] for category in play.CATEGORIES]
+        values.append(card[play.TOTAL])
+        values.append(1 if card[play.UPPER_BONUS] else 0)
+        # a Yahtzee scored, not five of a kind put elsewhere or scratched
+        values.append(1 if card[play.YAHTZEE] == 50 else 0)
+        for column, value in zip(columns, values):
+            column.append(value)
+    return columns
+
+
+# ==============
+# Results file
+def write_header(results_file):
+    results_file.write(_FILE_HEADER.pack(RESULTS_MAGIC, RESULTS_VERSION))
+
+
+def write_block(results_file, columns):
+    """Append a block: its row count then each column, little-endian."""
+    results_file.write(_BLOCK_HEADER.pack(len(columns[0])))
+    for column in columns:
+        if sys.byteorder != 'little':
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        results_file.write(column.tostring())
+
+
+def read_blocks(path):
+    """Yield each block of a results file as a dict of column arrays."""
+    with open(path, 'rb') as results_file:
+        magic, version = _FILE_HEADER.unpack(
+            results_file.read(_FILE_HEADER.size))
+        if magic != RESULTS_MAGIC or version != RESULTS_VERSION:
+            raise IOError('%s is not a simulation results file' % path)
+        while True:
+            header = results_file.read(_BLOCK_HEADER.size)
+            if not header:
+                return
+            rows = _BLOCK_HEADER.unpack(header)[0]
+            block = {}
+            for name, typecode in COLUMNS:
+                column = array.array(typecode)
+                column.fromstring(results_file.read(rows * column.itemsize))
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                block[name] = column
+            yield block
+
+
+# ==============
+# Runner
+class Summary(object):
+    """Running aggregates of the simulated games."""
+
+    def __init__(self):
+        self.games = 0
+        self.total = 0
+        self.total_squares = 0
+        self.best = None
+        self.worst = None
+        self.bonuses = 0
+        self.yahtzees = 0
+
+    def add(self, columns):
+        totals = columns[-3]
+        self.games += len(totals)
+        self.total += sum(totals)
+        self.total_squares += sum(total * total for total in totals)
+        if self.games == len(totals):
+            self.best, self.worst = max(totals), min(totals)
+        else:
+            self.best = max(self.best, max(totals))
+            self.worst = min(self.worst, min(totals))
+        self.bonuses += sum(columns[-2])
+        self.yahtzees += sum(columns[-1])
+
+    def report(self, seconds):
+        mean = float(self.total) / self.games
+        variance = max(0.0, float(self.total_squares) / self.games -
+                       mean * mean)
+        return '\n'.join([
+            'games:        %d in %.1fs (%.0f games/s)'
+            % (self.games, seconds, self.games / seconds),
+            'total:        mean %.2f, stdev %.2f, min %d, max %d'
+            % (mean, math.sqrt(variance), self.worst, self.best),
+            'upper bonus:  %.2f%% of games'
+            % (100.0 * self.bonuses / self.games),
+            'yahtzees:     %.2f%% of games scored one'
+            % (100.0 * self.yahtzees / self.games)])
+
+
+def simulate(games, strategy, master_seed=1, processes=1, output=None,
+             block_size=1000):
+    """Play games in blocks across a process pool, streaming each block to
+    output. Returns the Summary."""
+    blocks = [(strategy, master_seed, first, min(games, first + block_size))
+              for first in range(0, games, block_size)]
+    summary = Summary()
+    results_file = open(output, 'wb') if output else None
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        if results_file:
+            write_header(results_file)
+        if pool is None:
+            results = (_play_block(block) for block in blocks)
+        else:
+            # in order, so the file is the same for any process count
+            results = pool.imap(_play_block, blocks)
+        for columns in results:
+            summary.add(columns)
+            if results_file:
+                write_block(results_file, columns)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if results_file:
+            results_file.close()
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='simulate.py', description='Simulate complete games.')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES),
+                        default='greedy')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv[1:])
+    if args.strategy == 'optimal':
+        # fail early, and load before the workers fork
+        solver.get_table()
+    start = time.time()
+    summary = simulate(args.games, args.strategy, args.seed, args.processes,
+                       args.output, args.block_size)
+    print(summary.report(time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
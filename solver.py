@@ -0,0 +1,430 @@
+"""solver.py - Optimal strategy for the game, built on play.find_score.
+
+The expected-value table holds, for every score card state, the points still
+to be earned from the start of a round under optimal play. A state is the set
+of filled categories (13 bits) plus the upper section score capped at 63,
+the only part of the score that affects future points (through the bonus).
+Building the table is slow, so it is generated once with
+
+    python solver.py build [--processes N] [--output PATH]
+
+and loaded lazily by advise(), which then only has to evaluate the rolls
+left in the current round."""
+import argparse
+import array
+import collections
+import itertools
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+
+import play
+
+NUM_CATEGORIES = len(play.CATEGORIES)
+UPPER_CATEGORIES = 6
+UPPER_CAP = 63
+UPPER_BONUS = 35
+REROLLS = 2
+FULL_MASK = (1 << NUM_CATEGORIES) - 1
+NUM_STATES = (FULL_MASK + 1) * (UPPER_CAP + 1)
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'yahtzee_ev.bin')
+TABLE_MAGIC = b'YZEV'
+TABLE_VERSION = 2
+# magic, version, number of states, crc32 of the values
+_HEADER = struct.Struct('<4sHII')
+
+
+# ==============
+# Rolls and keeps
+def _probability(dice):
+    """Chance of rolling exactly this multiset of dice."""
+    ways = math.factorial(len(dice))
+    for face in set(dice):
+        ways //= math.factorial(dice.count(face))
+    return float(ways) / 6 ** len(dice)
+
+
+# Every sorted roll of 5 dice and its scores ordered as play.CATEGORIES
+ROLLS = sorted(play.SCORE_TABLE)
+ROLL_INDEX = dict((roll, i) for i, roll in enumerate(ROLLS))
+ROLL_SCORES = [play.SCORE_TABLE[roll] for roll in ROLLS]
+# Every sorted group of 0 to 5 dice that can be kept
+KEEPS = [keep for num in range(play.TOTAL_DICE + 1)
+         for keep in itertools.combinations_with_replacement(range(1, 7),
+                                                             num)]
+KEEP_INDEX = dict((keep, i) for i, keep in enumerate(KEEPS))
+EMPTY_KEEP = KEEP_INDEX[()]
+
+
+def _keep_outcomes(keep):
+    """Return (roll index, probability) of each roll reachable from keep."""
+    outcomes = []
+    for dice in itertools.combinations_with_replacement(
+            range(1, 7), play.TOTAL_DICE - len(keep)):
+        roll = tuple(sorted(keep + dice))
+        outcomes.append((ROLL_INDEX[roll], _probability(list(dice))))
+    return outcomes
+
+KEEP_OUTCOMES = [_keep_outcomes(keep) for keep in KEEPS]
+
+
+def _sub_keeps(dice):
+    """Return the distinct keep indexes that are subsets of the dice."""
+    keeps = set()
+    for mask in range(1 << len(dice)):
+        keep = tuple(sorted(dice[i] for i in range(len(dice))
+                            if mask & (1 << i)))
+        keeps.add(KEEP_INDEX[keep])
+    return sorted(keeps)
+
+ROLL_KEEPS = [_sub_keeps(roll) for roll in ROLLS]
+
+
+def _reachable_uppers():
+    """Map each set of filled upper categories to its possible capped
+    upper scores."""
+    reachable = {}
+    for mask in range(1 << UPPER_CATEGORIES):
+        scores = set([0])
+        for i in range(UPPER_CATEGORIES):
+            if mask & (1 << i):
+                scores = set(min(UPPER_CAP, score + count * (i + 1))
+                             for score in scores
+                             for count in range(play.TOTAL_DICE + 1))
+        reachable[mask] = sorted(scores)
+    return reachable
+
+REACHABLE_UPPERS = _reachable_uppers()
+
+
+# ==============
+# State evaluation
+def state_index(mask, upper):
+    """Position of a score card state in the expected-value table."""
+    return (mask << 6) | upper
+
+
+def card_state(score_card):
+    """Return (filled mask, capped upper score) of a Game score card."""
+    mask = 0
+    upper = 0
+    for i, category in enumerate(play.CATEGORIES):
+        if score_card[category] != -1:
+            mask |= 1 << i
+            if i < UPPER_CATEGORIES:
+                upper += score_card[category]
+    return mask, min(UPPER_CAP, upper)
+
+
+def _final_values(table, mask, upper):
+    """Return, for each roll, the best value of scoring it now and the
+    category (index into play.CATEGORIES) to score it in."""
+    choices = []
+    for i in range(NUM_CATEGORIES):
+        if mask & (1 << i):
+            continue
+        next_mask = (mask | (1 << i)) << 6
+        if i < UPPER_CATEGORIES:
+            # points -> points + bonus + future value
+            values = {}
+            for count in range(play.TOTAL_DICE + 1):
+                points = count * (i + 1)
+                new_upper = min(UPPER_CAP, upper + points)
+                bonus = UPPER_BONUS if upper < UPPER_CAP <= new_upper else 0
+                values[points] = points + bonus + table[next_mask | new_upper]
+            choices.append((i, values, None))
+        else:
+            choices.append((i, None, table[next_mask | upper]))
+    values = []
+    categories = []
+    for scores in ROLL_SCORES:
+        best = -1.0
+        best_category = None
+        for i, upper_values, future in choices:
+            if upper_values is None:
+                value = scores[i] + future
+            else:
+                value = upper_values[scores[i]]
+            if value > best:
+                best = value
+                best_category = i
+        values.append(best)
+        categories.append(best_category)
+    return values, categories
+
+
+def _keep_values(roll_values, keeps=None):
+    """Expected value of rolling again from each keep (or only the given
+    keep indexes, returned as a dict)."""
+    if keeps is None:
+        return [sum([roll_values[roll] * chance for roll, chance in outcomes])
+                for outcomes in KEEP_OUTCOMES]
+    return dict((keep, sum([roll_values[roll] * chance
+                            for roll, chance in KEEP_OUTCOMES[keep]]))
+                for keep in keeps)
+
+
+def _roll_values(keep_values):
+    """Best value of each roll when the dice to keep can still be chosen."""
+    return [max([keep_values[keep] for keep in keeps])
+            for keeps in ROLL_KEEPS]
+
+
+def state_value(table, mask, upper):
+    """Expected points still to earn from the start of a round."""
+    if mask == FULL_MASK:
+        return 0.0
+    values = _final_values(table, mask, upper)[0]
+    for reroll in range(REROLLS):
+        values = _roll_values(_keep_values(values))
+    return _keep_values(values, [EMPTY_KEEP])[EMPTY_KEEP]
+
+
+def _solve_masks(table, masks):
+    """Fill in the states of the given card masks, returns states solved."""
+    solved = 0
+    for mask in masks:
+        for upper in REACHABLE_UPPERS[mask & ((1 << UPPER_CATEGORIES) - 1)]:
+            table[state_index(mask, upper)] = state_value(table, mask, upper)
+            solved += 1
+    return solved
+
+
+def layers():
+    """Card masks grouped by filled categories, most complete first.
+    A layer only depends on the layers before it."""
+    grouped = [[] for filled in range(NUM_CATEGORIES)]
+    for mask in range(FULL_MASK):
+        grouped[bin(mask).count('1')].append(mask)
+    return [(filled, grouped[filled])
+            for filled in reversed(range(NUM_CATEGORIES))]
+
+# Shared output table of the build worker processes
+_shared_table = None
+
+
+def _init_worker(table):
+    global _shared_table
+    _shared_table = table
+
+
+def _solve_chunk(masks):
+    return _solve_masks(_shared_table, masks)
+
+
+def build_table(processes=1, progress=None, chunk_size=8):
+    """Solve every reachable state, layer by layer.
+
+    Args:
+        processes: worker processes to fan each layer out across.
+        progress: called after each layer with (filled categories,
+            states solved, seconds taken).
+        chunk_size: card masks handed to a worker at a time.
+    Returns:
+        The expected-value table, an array of floats.
+    """
+    if processes > 1:
+        table = multiprocessing.RawArray('f', NUM_STATES)
+        pool = multiprocessing.Pool(processes, _init_worker, (table,))
+    else:
+        table = array.array('f', [0.0]) * NUM_STATES
+        pool = None
+    try:
+        for filled, masks in layers():
+            start = time.time()
+            if pool is None:
+                solved = _solve_masks(table, masks)
+            else:
+                chunks = [masks[i:i + chunk_size]
+                          for i in range(0, len(masks), chunk_size)]
+                solved = sum(pool.imap_unordered(_solve_chunk, chunks))
+            if progress:
+                progress(filled, solved, time.time() - start)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return array.array('f', table)
+
+
+# ==============
+# Persisted table
+def save_table(table, path=TABLE_PATH):
+    """Write the table as a versioned header followed by little-endian
+    floats. The file is written aside and renamed so a reader never sees a
+    partial table."""
+    data = array.array('f', table)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    values = data.tostring()
+    checksum = zlib.crc32(values) & 0xffffffff
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as table_file:
+        table_file.write(_HEADER.pack(
+            TABLE_MAGIC, TABLE_VERSION, len(data), checksum))
+        table_file.write(values)
+    os.rename(temp_path, path)
+
+
+def read_table(path=TABLE_PATH):
+    """Read a table written by save_table, checking its version and
+    checksum."""
+    with open(path, 'rb') as table_file:
+        header = table_file.read(_HEADER.size)
+        values = table_file.read()
+    if len(header) != _HEADER.size:
+        raise IOError('%s is not a strategy table' % path)
+    magic, version, count, checksum = _HEADER.unpack(header)
+    if (magic != TABLE_MAGIC or version != TABLE_VERSION or
+            count != NUM_STATES):
+        raise IOError('%s is not a version %s strategy table'
+                      % (path, TABLE_VERSION))
+    if zlib.crc32(values) & 0xffffffff != checksum:
+        raise IOError('%s failed its checksum' % path)
+    table = array.array('f')
+    table.fromstring(values)
+    if len(table) != count:
+        raise IOError('%s is truncated' % path)
+    if sys.byteorder != 'little':
+        table.byteswap()
+    return table
+
+_table = None
+
+
+def get_table():
+    """Return the expected-value table, loading it on first use."""
+    global _table
+    if _table is None:
+        _table = read_table()
+    return _table
+
+
+# ==============
+# Advice
+class Hint(object):
+    """The best move for a round.
+
+    index_chosen: positions of the dice to keep before rolling again, or
+        None when the dice should be scored now.
+    category: play category constant to score now, or None to roll.
+    expected: expected final score of the game when playing on optimally.
+    """
+
+    def __init__(self, index_chosen, category, expected):
+        self.index_chosen = index_chosen
+        self.category = category
+        self.expected = expected
+
+
+# (mask, upper) -> [final values, final categories, roll values], least
+# recently used first
+_round_cache = collections.OrderedDict()
+_ROUND_CACHE_SIZE = 256
+
+
+def _round_values(table, mask, upper):
+    """Values of the rolls of a round from the table's values of the
+    states after it, kept for the most recently advised states."""
+    key = (mask, upper)
+    cached = _round_cache.pop(key, None)
+    if cached is None:
+        if len(_round_cache) >= _ROUND_CACHE_SIZE:
+            _round_cache.popitem(last=False)
+        values, categories = _final_values(table, mask, upper)
+        cached = [values, categories, None]
+    _round_cache[key] = cached
+    return cached
+
+
+def _card_points(score_card, upper):
+    """Points already on the card, including a reached bonus."""
+    points = sum(score_card[category] for category in play.CATEGORIES
+                 if score_card[category] != -1)
+    return points + (UPPER_BONUS if upper >= UPPER_CAP else 0)
+
+
+def _keep_positions(dice, keep):
+    """Positions in the dice that make up the sorted keep."""
+    positions = []
+    used = set()
+    for face in keep:
+        for i, die in enumerate(dice):
+            if die == face and i not in used:
+                used.add(i)
+                positions.append(i)
+                break
+    return sorted(positions)
+
+
+def advise(score_card, dice, roll_remain, table=None):
+    """Return the Hint for a Game's score_card, dice and roll_remain.
+
+    The table only holds values at the start of a round: a decision within
+    one depends on the dice and rolls left too, 252 x 3 times more states
+    than are worth storing. The rolls of the round are evaluated here from
+    the table's values of the 13 states it can end in, a few milliseconds
+    for a score card not advised recently."""
+    if table is None:
+        table = get_table()
+    mask, upper = card_state(score_card)
+    if mask == FULL_MASK:
+        raise ValueError('All categories are already chosen')
+    points = _card_points(score_card, upper)
+    if not dice:
+        return Hint([], None, points + table[state_index(mask, upper)])
+
+    cached = _round_values(table, mask, upper)
+    final_values, final_categories = cached[0], cached[1]
+    roll = ROLL_INDEX[tuple(sorted(dice))]
+    best_value = final_values[roll]
+    best_keep = None
+    if roll_remain > 0:
+        if roll_remain > 1:
+            if cached[2] is None:
+                cached[2] = _roll_values(_keep_values(final_values))
+            roll_values = cached[2]
+        else:
+            roll_values = final_values
+        keep_values = _keep_values(roll_values, ROLL_KEEPS[roll])
+        for keep, value in keep_values.items():
+            # keeping all five dice means scoring now
+            if len(KEEPS[keep]) < play.TOTAL_DICE and value > best_value:
+                best_value = value
+                best_keep = keep
+    if best_keep is None:
+        category = play.CATEGORIES[final_categories[roll]]
+        return Hint(None, category, points + best_value)
+    return Hint(_keep_positions(dice, KEEPS[best_keep]), None,
+                points + best_value)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='solver.py', description='Build the expected-value table.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=TABLE_PATH)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args(argv[1:])
+    start = time.time()
+
+    def progress(filled, solved, seconds):
+        print('layer %2d filled: %6d states in %7.1fs (%.0f states/s)'
+              % (filled, solved, seconds, solved / max(seconds, 1e-9)))
+    table = build_table(args.processes, progress)
+    save_table(table, args.output)
+    print('built %s with %d processes in %.1fs' % (
+        args.output, args.processes, time.time() - start))
+    print('expected score of a new game: %.2f'
+          % table[state_index(0, 0)])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
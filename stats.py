@@ -0,0 +1,130 @@
+"""stats.py - Backfill of the UserStats aggregates.
+
+Game.end_game keeps each user's UserStats up to date. The backfill builds
+them again from the completed games, for games that ended before
+UserStats existed. A task chain walks all users by cursor, replaying each
+batch's games in parallel with constant memory per user. Its progress
+lives in a StatsBackfill entity, so a chain that stopped can be resumed
+from the last batch done; replacing a user's stats twice does no harm.
+Users that complete a game while their stats are rebuilt, or whose
+replayed games do not add up to games_completed yet, are read again and
+rebuilt again. Those still playing are tried once more after the last
+batch, and only then skipped."""
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Game
+from models import User
+from models import UserStats
+
+BACKFILL_URL = '/tasks/backfill_user_stats'
+# Users rebuilt by each task, and games fetched per datastore batch
+BACKFILL_BATCH = 50
+GAMES_BATCH = 500
+# Times a user's stats are rebuilt in a task before putting them off
+REBUILD_ATTEMPTS = 3
+
+
+class StatsBackfill(ndb.Model):
+    """StatsBackfill -- a backfill in progress, with the cursor after the
+    last batch of users done and the users to try again once all batches
+    are done"""
+    cursor = ndb.StringProperty(indexed=False)
+    users = ndb.IntegerProperty(default=0, indexed=False)
+    skipped = ndb.IntegerProperty(default=0, indexed=False)
+    retry_keys = ndb.KeyProperty(kind='User', repeated=True, indexed=False)
+    retrying = ndb.BooleanProperty(default=False, indexed=False)
+    started = ndb.DateTimeProperty(auto_now_add=True)
+
+
+def start_backfill(resume=False):
+    """Start a backfill from the first user, or carry on with the one in
+    progress"""
+    if not resume or StatsBackfill.get_by_id('running') is None:
+        StatsBackfill(id='running').put()
+    taskqueue.add(url=BACKFILL_URL)
+
+
+@ndb.tasklet
+def _rebuild_async(user_key):
+    """Return a UserStats replayed from all the user's completed games"""
+    stats = UserStats(key=UserStats.key_for(user_key))
+    query = Game.query(Game.user == user_key, Game.game_over == True)
+    yield query.map_async(
+        lambda game: stats.add_game(game.score_card, game.cat_history),
+        batch_size=GAMES_BATCH)
+    raise ndb.Return(stats)
+
+
+@ndb.transactional
+def _replace_stats(stats, games_completed):
+    """Store rebuilt stats unless the user completed a game since they
+    were read, or the games replayed are not all the user completed: the
+    query of the games is eventually consistent and can miss one that just
+    ended"""
+    if stats.games != games_completed:
+        return False
+    user = stats.key.parent().get()
+    if user is None or user.games_completed != games_completed:
+        return False
+    stats.put()
+    return True
+
+
+def _rebuild_users(users):
+    """Rebuild and store the stats of users, reading again and rebuilding
+    those that completed a game meanwhile. Returns (users rebuilt, keys
+    of the users still changing)"""
+    done = 0
+    changed = []
+    for attempt in range(REBUILD_ATTEMPTS):
+        rebuilt = [_rebuild_async(user.key) for user in users]
+        changed = [user.key for user, stats in zip(users, rebuilt)
+                   if not _replace_stats(stats.get_result(),
+                                         user.games_completed)]
+        done += len(users) - len(changed)
+        if not changed:
+            break
+        users = [user for user in ndb.get_multi(changed) if user]
+    return done, changed
+
+
+def backfill_step():
+    """Rebuild the stats of the next batch of users, or of the users put
+    off once all batches are done, enqueueing the following step or
+    finishing the backfill"""
+    progress = StatsBackfill.get_by_id('running')
+    if progress is None:
+        return
+    if progress.retrying:
+        keys = progress.retry_keys[:BACKFILL_BATCH]
+        del progress.retry_keys[:BACKFILL_BATCH]
+        done, changed = _rebuild_users(
+            [user for user in ndb.get_multi(keys) if user])
+        if changed:
+            logging.warning('Skipped the stats of users still playing: %s',
+                            ', '.join(key.urlsafe() for key in changed))
+        progress.skipped += len(changed)
+        more = bool(progress.retry_keys)
+    else:
+        cursor = Cursor(urlsafe=progress.cursor) if progress.cursor else None
+        users, cursor, more = User.query().fetch_page(
+            BACKFILL_BATCH, start_cursor=cursor)
+        done, changed = _rebuild_users(users)
+        progress.retry_keys.extend(changed)
+        if more and cursor:
+            progress.cursor = cursor.urlsafe()
+        else:
+            progress.retrying = True
+            more = bool(progress.retry_keys)
+    progress.users += done
+    if more:
+        progress.put()
+        taskqueue.add(url=BACKFILL_URL)
+    else:
+        logging.info('Rebuilt the stats of %s users, skipped %s that were '
+                     'playing', progress.users, progress.skipped)
+        progress.key.delete()
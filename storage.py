@@ -0,0 +1,67 @@
+"""storage.py - Storage backends for engine.GameRunner.
+
+MemoryStore keeps users, games and scores in dicts, standing in for the
+datastore so whole games can be played, benchmarked and profiled without
+App Engine."""
+import itertools
+from datetime import date
+
+import play
+
+
+class MemoryUser(object):
+    """MemoryUser -- in-memory counterpart of models.User"""
+    __slots__ = ('name', 'email', 'max_score', 'games_completed')
+
+    def __init__(self, name, email=None):
+        self.name = name
+        self.email = email
+        self.max_score = -1
+        self.games_completed = 0
+
+
+class MemoryStore(object):
+    """Dict-backed stand-in for the datastore"""
+
+    def __init__(self):
+        self.users = {}
+        # game id -> (user id, GameState)
+        self.games = {}
+        # (user id, date, result) of each completed game
+        self.scores = []
+        self._ids = itertools.count(1)
+
+    def create_user(self, name, email=None):
+        """Create a user and return its id"""
+        user_id = next(self._ids)
+        self.users[user_id] = MemoryUser(name, email)
+        return user_id
+
+    def get_user(self, user_id):
+        return self.users[user_id]
+
+    def create_game(self, user_id, state):
+        """Store a new game and return its id"""
+        game_id = next(self._ids)
+        self.games[game_id] = (user_id, state)
+        return game_id
+
+    def get_game(self, game_id):
+        """Return the GameState of a game"""
+        return self.games[game_id][1]
+
+    def put_game(self, game_id, state):
+        self.games[game_id] = (self.games[game_id][0], state)
+
+    def end_game(self, game_id, state):
+        """Save a finished game, record its score and update the user"""
+        self.put_game(game_id, state)
+        user_id = self.games[game_id][0]
+        total_score = state.score_card[play.TOTAL]
+        self.scores.append((user_id, date.today(), total_score))
+        user = self.users[user_id]
+        # record max score
+        if total_score > user.max_score:
+            user.max_score = total_score
+        # count game completed
+        user.games_completed += 1
@@ -0,0 +1,61 @@
+"""test_codec.py - Pages of the packed history against the decoded one."""
+import random
+import unittest
+
+import codec
+import engine
+import play
+import simulate
+
+
+def played(rounds, seed):
+    """A state after rounds rounds of greedy play, seeded unless seed is
+    None"""
+    rand = random.Random(rounds)
+    state = engine.GameState(seed=seed)
+    while len(state.dice_history) < rounds:
+        action, value = simulate.greedy_strategy(state, rand)
+        if action == 'roll':
+            state = engine.roll_dice(state, value).state
+        else:
+            state = engine.choose_category(state, value).state
+    return state
+
+
+class HistorySliceTest(unittest.TestCase):
+
+    def check(self, state):
+        data = codec.encode_state(state)
+        decoded = codec.decode_state(data)
+        rounds = len(state.dice_history)
+        self.assertEqual(codec.history_length(data), rounds)
+        for offset in range(rounds + 3):
+            for limit in range(play.ROUNDS + 2):
+                end = offset + limit
+                self.assertEqual(
+                    codec.history_slice(data, offset, limit),
+                    (decoded.dice_history[offset:end],
+                     decoded.cat_history[offset:end]))
+
+    def test_seeded_games(self):
+        for rounds in range(play.ROUNDS + 1):
+            self.check(played(rounds, 12345 + rounds))
+
+    def test_unseeded_games(self):
+        for rounds in [0, 1, play.ROUNDS]:
+            self.check(played(rounds, None))
+
+    def test_no_rounds(self):
+        data = codec.encode_state(engine.new_state(7))
+        self.assertEqual(codec.history_length(data), 0)
+        self.assertEqual(codec.history_slice(data, 0, play.ROUNDS), ([], []))
+        self.assertEqual(codec.history_slice(data, 5, 1), ([], []))
+
+    def test_offset_past_the_end(self):
+        data = codec.encode_state(played(4, 99))
+        self.assertEqual(codec.history_slice(data, 4, 3), ([], []))
+        self.assertEqual(codec.history_slice(data, 40, 3), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""test_hotstate.py - Versions, stale moves and replays of cached rolls."""
+import unittest
+
+try:
+    from benchmarks import stubs
+    import engine
+    import hotstate
+    import models
+except ImportError:  # the App Engine SDK is not on the path
+    hotstate = None
+
+
+def roll(state):
+    return engine.roll_dice(state, [])
+
+
+@unittest.skipIf(hotstate is None, 'needs the App Engine SDK')
+class ApplyMoveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bed = stubs.setup_testbed()
+        user_key = models.User(name='player').put()
+        self.key = models.Game.new_game(user_key).key
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def load(self):
+        """The game as a new request sees it"""
+        stubs.new_request()
+        return hotstate.load(self.key.get())
+
+    def test_stale_move_seq(self):
+        hotstate.apply_move(self.load(), roll, 0, 'roll:')
+        with self.assertRaises(hotstate.StaleMoveError) as raised:
+            hotstate.apply_move(self.load(), roll, 0, 'roll:0')
+        self.assertEqual(raised.exception.version, 1)
+        self.assertEqual(self.load().version, 1)
+
+    def test_last_move_is_replayed(self):
+        hotstate.apply_move(self.load(), roll, 0, 'roll:')
+        first = hotstate.apply_move(self.load(), roll, 1, 'roll:')
+        game = self.load()
+        retried = hotstate.apply_move(game, roll, 1, 'roll:')
+        self.assertEqual(retried.state.dice, first.state.dice)
+        self.assertEqual(retried.state.roll_remain, first.state.roll_remain)
+        self.assertEqual(game.version, 2)
+        self.assertEqual(self.load().version, 2)
+
+    def test_record_not_replayed_after_entry_lost(self):
+        hotstate.apply_move(self.load(), roll, 0, 'roll:')
+        hotstate.apply_move(self.load(), roll, 1, 'roll:')
+        hotstate.forget(self.key)
+        # the stored game is back at the start of the round
+        self.assertEqual(self.load().version, 0)
+        with self.assertRaises(hotstate.StaleMoveError) as raised:
+            hotstate.apply_move(self.load(), roll, 1, 'roll:')
+        self.assertEqual(raised.exception.version, 0)
+        result = hotstate.apply_move(self.load(), roll, 0, 'roll:')
+        self.assertEqual(result.state.roll_remain, 2)
+        self.assertEqual(self.load().version, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+"""test_models.py - Datastore RPCs of the request-scoped User cache and of
+the API methods reading users, and history pages of packed and legacy
+games."""
+import datetime
+import random
+import unittest
+
+try:
+    from protorpc import message_types
+
+    import api
+    from benchmarks import stubs
+    import codec
+    import engine
+    import models
+    import play
+    import simulate
+except ImportError:  # the App Engine SDK is not on the path
+    models = None
+
+USERS = 10
+GAMES = 5
+_EMAIL = 'player@example.com'
+
+
+@unittest.skipIf(models is None, 'needs the App Engine SDK')
+class UserCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bed = stubs.setup_testbed()
+        keys = models.ndb.put_multi([models.User(name='user%d' % i)
+                                     for i in range(USERS)])
+        # each user twice, as on a leaderboard
+        self.scores = [models.Score(user=key, date=datetime.date.today(),
+                                    result=i) for i, key in
+                       enumerate(keys + keys)]
+        stubs.new_request()
+        self.counter = stubs.RpcCounter().install()
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def gets(self):
+        return self.counter.count('datastore_v3', 'Get')
+
+    def test_one_batched_get_per_request(self):
+        users = models.get_users(score.user for score in self.scores)
+        self.assertEqual(len(users), USERS)
+        forms = [score.to_form(users) for score in self.scores]
+        self.assertEqual([form.user_name for form in forms[:USERS]],
+                         ['user%d' % i for i in range(USERS)])
+        self.assertEqual(self.gets(), 1)
+
+    def test_no_get_once_warm(self):
+        models.get_users(score.user for score in self.scores)
+        self.counter.reset()
+        models.get_users(score.user for score in self.scores)
+        for score in self.scores:
+            score.to_form()
+            models.get_user(score.user)
+        self.assertEqual(self.gets(), 0)
+
+    def test_cache_is_per_request(self):
+        models.get_users(score.user for score in self.scores)
+        stubs.new_request()
+        self.counter.reset()
+        models.get_users(score.user for score in self.scores)
+        self.assertEqual(self.gets(), 1)
+
+
+
+@unittest.skipIf(models is None, 'needs the App Engine SDK')
+class EndpointRpcTest(unittest.TestCase):
+    """Datastore RPCs of a call do not grow with the users or games it
+    shows"""
+
+    def setUp(self):
+        self.bed = stubs.setup_testbed()
+        stubs.sign_in(_EMAIL)
+        self.service = api.YahtzeeGameApi()
+        self.service.create_user(message_types.VoidMessage())
+        self.user_key = models.ndb.Key(models.User, _EMAIL)
+        self.games = [models.Game.new_game(self.user_key)
+                      for i in range(GAMES)]
+        keys = models.ndb.put_multi(
+            [models.User(name='user%d' % i, max_score=i, games_completed=1)
+             for i in range(USERS)])
+        models.ndb.put_multi(
+            [models.Score(user=key, date=datetime.date.today(), result=i)
+             for i, key in enumerate(keys)])
+        stubs.new_request()
+        self.counter = stubs.RpcCounter().install()
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def rpcs(self, call):
+        return self.counter.count('datastore_v3', call)
+
+    def test_get_game(self):
+        request = api.GET_GAME_REQUEST.combined_message_class(
+            urlsafe_game_key=self.games[0].key.urlsafe())
+        self.service.get_game(request)
+        # the game and the user in one batch
+        self.assertEqual(self.rpcs('Get'), 1)
+        self.assertEqual(self.rpcs('RunQuery'), 0)
+
+    def test_get_user_games(self):
+        forms = self.service.get_user_games(message_types.VoidMessage())
+        self.assertEqual(len(forms.items), GAMES)
+        # the user, then all its games in one batch
+        self.assertEqual(self.rpcs('Get'), 2)
+        self.assertEqual(self.rpcs('RunQuery'), 0)
+
+    def test_get_high_scores(self):
+        request = api.HIGH_SCORES_REQUEST.combined_message_class(
+            number_of_results=USERS)
+        forms = self.service.get_high_scores(request)
+        self.assertEqual(len(forms.items), USERS)
+        # the missing board, then the users of its scores in one batch
+        self.assertEqual(self.rpcs('Get'), 2)
+        self.assertEqual(self.rpcs('RunQuery'), 1)
+        stubs.new_request()
+        self.counter.reset()
+        self.service.get_high_scores(request)
+        self.assertEqual(self.counter.count('datastore_v3'), 0)
+
+    def test_get_user_rankings(self):
+        request = api.RANKINGS_REQUEST.combined_message_class(
+            page_size=USERS + 1)
+        forms = self.service.get_user_rankings(request)
+        self.assertEqual(len(forms.items), USERS + 1)
+        # the users come with the ranking query
+        self.assertEqual(self.rpcs('Get'), 0)
+        self.assertEqual(self.rpcs('RunQuery'), 1)
+
+
+
+@unittest.skipIf(models is None, 'needs the App Engine SDK')
+class HistoryFormTest(unittest.TestCase):
+    """Pages of a game stored packed and of the same game stored before
+    the packed state"""
+    ROUNDS = 5
+
+    def setUp(self):
+        rand = random.Random(1)
+        state = engine.new_state(4321)
+        while len(state.dice_history) < self.ROUNDS:
+            action, value = simulate.greedy_strategy(state, rand)
+            if action == 'roll':
+                state = engine.roll_dice(state, value).state
+            else:
+                state = engine.choose_category(state, value).state
+        self.state = state
+        round_remain = play.ROUNDS - self.ROUNDS
+        self.games = [
+            models.Game(state=codec.encode_state(self.state),
+                        round_remain=round_remain),
+            models.Game(legacy_dice_history=self.state.dice_history,
+                        legacy_cat_history=[models.CardCategory(cat) for cat
+                                            in self.state.cat_history],
+                        legacy_seed=self.state.seed,
+                        round_remain=round_remain)]
+
+    def test_pages(self):
+        for game in self.games:
+            for offset in range(self.ROUNDS + 2):
+                for limit in range(1, self.ROUNDS + 2):
+                    end = offset + limit
+                    dice = self.state.dice_history[offset:end]
+                    categories = self.state.cat_history[offset:end]
+                    next_offset = end if end < self.ROUNDS else None
+                    form = game.to_history_form(offset, limit)
+                    self.assertEqual([item.dice for item in form.items],
+                                     dice)
+                    self.assertEqual([item.category for item in form.items],
+                                     [models.CATEGORY_NAMES[category]
+                                      for category in categories])
+                    compact = game.to_compact_history_form(offset, limit)
+                    self.assertEqual(compact.dice, dice)
+                    self.assertEqual(compact.categories, categories)
+                    for page in [form, compact]:
+                        self.assertEqual(page.rounds, self.ROUNDS)
+                        self.assertEqual(page.next_offset, next_offset)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""test_play.py - The score table against the scorer it replaced, and the
+dice of seeded games against the stream they were first rolled from and
+their roll log."""
+import hashlib
+import itertools
+import random
+import threading
+import unittest
+
+import codec
+import engine
+import play
+
+
+def baseline_find_score(dice, category):
+    """find_score as it was before the score table, counting the faces"""
+    faces = [1, 2, 3, 4, 5, 6]
+
+    def get_count(face):
+        return dice.count(face)
+    counts = map(get_count, faces)
+    if category in [play.ONES, play.TWOS, play.THREES, play.FOURS,
+                    play.FIVES, play.SIXES]:
+        return get_count(category + 1) * (category + 1)
+    elif category in [play.THREE_OF_A_KIND, play.FOUR_OF_A_KIND,
+                      play.YAHTZEE]:
+        if category is play.YAHTZEE:
+            maxCounts = category - 8
+            for face in faces:
+                if get_count(face) >= maxCounts:
+                    return 50
+        elif (category is play.THREE_OF_A_KIND or
+              category is play.FOUR_OF_A_KIND):
+            maxCounts = category - 5
+            for face in faces:
+                if get_count(face) >= maxCounts:
+                    return sum(dice)
+    elif category is play.FULL_HOUSE:
+        counts.sort()
+        if counts == [0, 0, 0, 0, 2, 3]:
+            return 25
+    elif category is play.LARGE_STRAIGHT:
+        if counts == [0, 1, 1, 1, 1, 1] or counts == [1, 1, 1, 1, 1, 0]:
+            return 40
+    elif category is play.SMALL_STRAIGHT:
+        countsStr = "".join(map(str, counts))
+        if ("1111" in countsStr or "2111" in countsStr or
+           "1211" in countsStr or "1121" in countsStr or "1112" in countsStr):
+            return 30
+    elif category is play.CHANCE:
+        return sum(dice)
+    return 0
+
+
+# every ordered roll of five dice
+ROLLS = [list(roll) for roll in
+         itertools.product(range(1, 7), repeat=play.TOTAL_DICE)]
+
+
+class ScoreTableTest(unittest.TestCase):
+
+    def test_table_covers_sorted_rolls(self):
+        self.assertEqual(len(play.SCORE_TABLE), 252)
+
+    def test_find_score_matches_baseline(self):
+        for dice in ROLLS:
+            for category in range(play.TOTAL + 1):
+                self.assertEqual(
+                    play.find_score(dice, category),
+                    baseline_find_score(dice, category),
+                    'dice %s, category %d' % (dice, category))
+
+    def test_score_all_matches_baseline(self):
+        for dice in ROLLS:
+            self.assertEqual(
+                list(play.score_all(dice)),
+                [baseline_find_score(dice, category)
+                 for category in play.CATEGORIES], 'dice %s' % dice)
+
+    @unittest.skipIf(play.numpy is None, 'needs numpy')
+    def test_score_batch_matches_score_all(self):
+        scores = play.score_batch(ROLLS)
+        self.assertEqual(scores.shape, (len(ROLLS), len(play.CATEGORIES)))
+        for dice, row in zip(ROLLS, scores.tolist()):
+            self.assertEqual(row, list(play.score_all(dice)),
+                             'dice %s' % dice)
+
+    def test_incomplete_roll_falls_back(self):
+        for dice in [[], [6], [2, 2, 2], [1, 2, 3, 4]]:
+            for category in play.CATEGORIES:
+                self.assertEqual(play.find_score(dice, category),
+                                 baseline_find_score(dice, category))
+
+
+def keyed_dice(seed, round_no, roll_no, num):
+    """The dice games were rolled with before GameDice"""
+    faces = []
+    counter = 0
+    while len(faces) < num:
+        block = '%d:%d:%d:%d' % (seed, round_no, roll_no, counter)
+        faces.extend([byte % 6 + 1 for byte in
+                      bytearray(hashlib.sha256(block).digest())
+                      if byte < 252])
+        counter += 1
+    return faces[:num]
+
+
+class GameDiceTest(unittest.TestCase):
+
+    def test_rolls_match_keyed_stream(self):
+        rand = random.Random(1)
+        for i in range(200):
+            seed = rand.getrandbits(play.SEED_BITS)
+            game_dice = play.GameDice(seed)
+            for round_no in range(play.ROUNDS):
+                for roll_no in range(play.ROLLS_PER_ROUND):
+                    for num in range(1, play.TOTAL_DICE + 1):
+                        self.assertEqual(
+                            game_dice.roll(num, round_no, roll_no),
+                            keyed_dice(seed, round_no, roll_no, num))
+
+    def test_draws_are_replayed(self):
+        rand = random.Random(2)
+        state = engine.new_state(rand.getrandbits(play.SEED_BITS))
+        rounds = []
+        for round_no in range(4):
+            for roll_no in range(play.ROLLS_PER_ROUND):
+                # a round started again from the store draws afresh
+                state.draw = rand.randrange(play.DRAWS)
+                state = engine.roll_dice(state, [0, 2] if roll_no else [])
+                self.assertTrue(state.effects)
+                state = state.state
+            rounds.append(''.join(str(face) for face in state.dice))
+            state = engine.choose_category(
+                state, play.CATEGORIES[round_no]).state
+        self.assertEqual(play.replay_dice_history(state.seed, state.roll_log),
+                         rounds)
+        self.assertEqual(codec.decode_state(codec.encode_state(state))
+                         .roll_log, state.roll_log)
+
+    def test_other_draws_roll_other_dice(self):
+        game_dice = play.GameDice(7)
+        rolls = set(tuple(game_dice.roll(play.TOTAL_DICE, 0, 0, draw))
+                    for draw in range(play.DRAWS))
+        self.assertGreater(len(rolls), play.DRAWS - 4)
+
+
+class DefaultSourceTest(unittest.TestCase):
+
+    def test_threads_roll_from_their_own_source(self):
+        sources = []
+
+        def roll():
+            play.roll_dice(play.TOTAL_DICE)
+            sources.append(play._default_source())
+        threads = [threading.Thread(target=roll) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(source) for source in sources)), 4)
+        self.assertNotIn(play._default_source(), sources)
+
+
+if __name__ == '__main__':
+    unittest.main()
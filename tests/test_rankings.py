@@ -0,0 +1,75 @@
+"""test_rankings.py - Ranks of the ranking pages and of get_rank."""
+import unittest
+
+try:
+    import endpoints
+
+    import api
+    from benchmarks import stubs
+    import models
+    import rankings
+except ImportError:  # the App Engine SDK is not on the path
+    rankings = None
+
+# (max_score, games_completed) and the competition rank of each user
+USERS = [(100, 3, 1), (90, 2, 2), (90, 2, 2), (90, 5, 4), (80, 1, 5),
+         (80, 1, 5), (70, 0, 7)]
+
+
+@unittest.skipIf(rankings is None, 'needs the App Engine SDK')
+class RankingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bed = stubs.setup_testbed()
+        models.ndb.put_multi([
+            models.User(name='user%d' % i, max_score=max_score,
+                        games_completed=games)
+            for i, (max_score, games, rank) in enumerate(USERS)])
+
+    def tearDown(self):
+        self.bed.deactivate()
+
+    def pages(self, page_size):
+        ranked = []
+        token = None
+        while True:
+            users, ranks, token = rankings.get_page(page_size, token)
+            ranked.extend(zip(users, ranks))
+            if token is None:
+                return ranked
+
+    def test_pages_share_ranks_of_tied_users(self):
+        # pages of 2 split the users tied on rank 2
+        for page_size in [1, 2, 3, len(USERS)]:
+            ranked = self.pages(page_size)
+            self.assertEqual(
+                [(user.max_score, user.games_completed, rank)
+                 for user, rank in ranked], USERS)
+
+    def test_get_rank_matches_pages(self):
+        rankings.start_build()
+        rankings.build_step()
+        for user, rank in self.pages(2):
+            self.assertEqual(rankings.get_rank(user), (rank, len(USERS)))
+
+
+    def rankings_page(self, cursor):
+        request = api.RANKINGS_REQUEST.combined_message_class(
+            page_size=2, cursor=cursor)
+        return api.YahtzeeGameApi().get_user_rankings(request)
+
+    def test_bad_cursors_are_bad_requests(self):
+        token = self.rankings_page(None).next_cursor
+        offset, last, cursor = rankings.decode_page_token(token)
+        # a cursor of another query
+        other_cursor = models.User.query().order(
+            models.User.name).fetch_page(1)[1]
+        for cursor in ['garbage', token[:token.rindex(':') + 1] + 'x!y',
+                       rankings.encode_page_token(offset, last,
+                                                  other_cursor)]:
+            self.assertRaises(endpoints.BadRequestException,
+                              self.rankings_page, cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,26 @@
 """utils.py - File for collecting general utility functions."""
 
+import collections
+import hashlib
 import logging
 from google.appengine.ext import ndb
 import endpoints
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+TOKENINFO_DEADLINE = 5
+TOKEN_NAMESPACE = 'tokens'
+# longest a token's user id is kept, and tokens kept per instance
+TOKEN_TTL = 600
+TOKEN_CACHE_SIZE = 10000
+
 
 def get_by_urlsafe(urlsafe, model):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
@@ -24,8 +35,43 @@ def get_by_urlsafe(urlsafe, model):
         exists.
     Raises:
         ValueError:"""
+    return get_by_urlsafe_async(urlsafe, model).get_result()
+
+
+@ndb.tasklet
+def get_by_urlsafe_async(urlsafe, model):
+    """Returns a Future of the entity get_by_urlsafe returns, so the get
+        runs alongside other datastore calls. Errors are raised by
+        get_result()"""
+    entity = yield _key_by_urlsafe(urlsafe).get_async()
+    if not entity:
+        raise ndb.Return(None)
+    if not isinstance(entity, model):
+        raise ValueError('Incorrect Kind')
+    raise ndb.Return(entity)
+
+
+def get_multi_by_urlsafe(urlsafes, model):
+    """Returns the entities that urlsafe Key strings point to, fetched in
+        one batch, as get_by_urlsafe does for one
+    Args:
+        urlsafes: A list of urlsafe key strings
+        model: The expected entity kind
+    Returns:
+        A list of the entities, with None where no entity exists.
+    Raises:
+        ValueError:"""
+    entities = ndb.get_multi(
+        [_key_by_urlsafe(urlsafe) for urlsafe in urlsafes])
+    for entity in entities:
+        if entity and not isinstance(entity, model):
+            raise ValueError('Incorrect Kind')
+    return entities
+
+
+def _key_by_urlsafe(urlsafe):
     try:
-        key = ndb.Key(urlsafe=urlsafe)
+        return ndb.Key(urlsafe=urlsafe)
     except TypeError:
         raise endpoints.BadRequestException('Invalid Key')
     except Exception, e:
@@ -34,12 +80,60 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
-    if not entity:
-        return None
-    if not isinstance(entity, model):
-        raise ValueError('Incorrect Kind')
-    return entity
+
+class TokenCache(object):
+    """Instance cache of token -> user id, dropping expired tokens and the
+    least recently used ones beyond size"""
+
+    def __init__(self, size, clock=time.time):
+        self.size = size
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is None or entry[1] <= self._clock():
+                return None
+            self._entries[token] = entry
+            return entry[0]
+
+    def put(self, token, user_id, ttl):
+        with self._lock:
+            self._entries.pop(token, None)
+            self._entries[token] = (user_id, self._clock() + ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+def _fetch_token_info(token):
+    """Ask tokeninfo about a token, as an id token and then as an access
+    token. Returns the decoded answer, or None at once on an error."""
+    token_types = ['id_token', 'access_token']
+    if 'OAUTH_USER_ID' in os.environ:
+        token_types = ['access_token']
+    for token_type in token_types:
+        try:
+            resp = urlfetch.fetch('%s?%s=%s' % (TOKENINFO_URL, token_type,
+                                                token),
+                                  deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error, e:
+            logging.warning('tokeninfo request failed: %s', e)
+            return None
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        if resp.status_code != 400 or 'invalid_token' not in resp.content:
+            logging.warning('tokeninfo answered %s', resp.status_code)
+            return None
+    return None
 
 
 def get_user_id(user, id_type="email"):
@@ -47,26 +141,27 @@ def get_user_id(user, id_type="email"):
         return user.email()
 
     if id_type == "oauth":
-        """A workaround implementation for getting userid."""
+        """A workaround implementation for getting userid. The user id of a
+        token is kept in the instance and in memcache until the token
+        expires, at most TOKEN_TTL seconds."""
         auth = os.getenv('HTTP_AUTHORIZATION')
+        if not auth:
+            return ''
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
-
+        key = hashlib.sha256(token).hexdigest()
+        user_id = _token_cache.get(key)
+        if user_id is not None:
+            return user_id
+        cached = memcache.get(key, namespace=TOKEN_NAMESPACE)
+        if cached is not None:
+            user_id, expires = cached
+            _token_cache.put(key, user_id, expires - time.time())
+            return user_id
+        info = _fetch_token_info(token) or {}
+        user_id = info.get('user_id', '')
+        ttl = min(TOKEN_TTL, int(info.get('expires_in', TOKEN_TTL)))
+        if user_id and ttl > 0:
+            _token_cache.put(key, user_id, ttl)
+            memcache.set(key, (user_id, time.time() + ttl), time=ttl,
+                         namespace=TOKEN_NAMESPACE)
+        return user_id